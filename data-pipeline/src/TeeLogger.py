@@ -4,13 +4,14 @@ import sys
 class TeeLogger:
     last_message_was_omitted = False
 
-    def __init__(self, logfile):
+    def __init__(self, logfile, write_header=True):
         self.terminal = sys.stdout  # store the original stdout
         self.encoding = self.terminal.encoding  # expose encoding from the original stdout
 
         self.log = open(logfile, "a", encoding="utf-8")  # open the log file in append mode
-        self.log.write('Play back this log in your terminal.\n')
-        self.log.write(f'Run `tail {logfile} -n +4`.\n\n')
+        if write_header:
+            self.log.write('Play back this log in your terminal.\n')
+            self.log.write(f'Run `tail {logfile} -n +4`.\n\n')
 
     def write(self, message):
         if isinstance(message, bytes):
@@ -0,0 +1,276 @@
+import argparse
+import json
+import logging
+import math
+import os
+import shutil
+import subprocess
+import sys
+import time
+import traceback
+from pathlib import Path
+from typing import Any, Callable
+
+# the workloads that are measured at each scale, in the order they run
+workload_names = ['greenlink_gtfs', 'replica', 'essential_services', 'future_routes', 'finalize']
+
+# stages deeper than this (e.g., individual chunks) are left out of the scaling report
+report_depth = 2
+
+
+def run_greenlink_gtfs() -> None:
+    # the synthetic feed is already in the season folders, so convert it
+    # the same way a downloaded feed is converted instead of downloading it
+    from etl.sources.greenlink_gtfs.etl import GreenlinkGtfsETL
+
+    areas_folder = Path('./input/replica_interest_area_polygons')
+    area_geojson_paths = [path for path in areas_folder.glob('*.geojson') if path.name != 'full_area.geojson']
+    seasons = [(int(folder.parent.name), folder.name)
+               for folder in Path(GreenlinkGtfsETL.folder_path).glob('*/*') if folder.is_dir()]
+
+    etl = GreenlinkGtfsETL(seasons=seasons, area_geojson_paths=area_geojson_paths)  # type: ignore
+    for season in etl.seasons:
+        if not etl._feed_is_complete(season):
+            etl.to_csv(season)
+            etl.convert_to_geojson(season)
+            etl._record_feed(season)
+    etl.run()
+
+
+def run_replica() -> None:
+    from etl.sources.replica.etl import ReplicaETL
+
+    trip_columns = ['activity_id', 'person_id', 'mode',
+                    'travel_purpose', 'tour_type', 'transit_route_ids',
+                    'network_link_ids', 'vehicle_type', 'start_local_hour',
+                    'end_local_hour', 'duration_minutes',
+                    'destination_building_use_l1', 'destination_building_use_l2',]
+    ReplicaETL(trip_columns).run(mode='process')
+
+
+def run_essential_services() -> None:
+    from etl.sources.essential_services.etl import EssentialServicesETL
+    EssentialServicesETL().run()
+
+
+def run_future_routes() -> None:
+    from etl.sources.future_routes.etl import FutureRoutesETL
+    FutureRoutesETL().run()
+
+
+def run_finalize() -> None:
+    # the data folder is resolved when the module is imported, so import it from the scale's folder
+    from etl.finalize import finalize
+    finalize()
+
+
+workloads: dict[str, Callable[[], None]] = {
+    'greenlink_gtfs': run_greenlink_gtfs,
+    'replica': run_replica,
+    'essential_services': run_essential_services,
+    'future_routes': run_future_routes,
+    'finalize': run_finalize,
+}
+
+
+def run_workloads(names: list[str]) -> None:
+    """
+    Run the workloads in the current working directory and record each of
+    them as a stage in the run report. Runs in a separate process for each
+    scale so that measurements (and class-level state) do not leak between scales.
+    """
+    from etl.run_report import stage, write_run_report
+
+    for name in names:
+        print(f'\nRunning {name}...')
+        try:
+            with stage(name):
+                workloads[name]()
+        except Exception:
+            # keep measuring the other workloads (later workloads may fail too if they depend on this one)
+            traceback.print_exc()
+    write_run_report()
+
+
+def link_or_copy(source: str, destination: str) -> None:
+    if source.endswith('.parquet'):
+        os.link(source, destination)
+    else:
+        shutil.copy2(source, destination)
+
+
+def generate(scale: float, seed: int) -> dict[str, Any]:
+    from etl.synthetic_data import SyntheticDataGenerator
+
+    started_at = time.perf_counter()
+    sizes = SyntheticDataGenerator(scale, seed=seed).generate()
+    return {**sizes, 'generation_seconds': round(time.perf_counter() - started_at, 3)}
+
+
+def scaling_exponent(scales: list[float], values: list[float | None]) -> float | None:
+    """
+    The slope of the least-squares line through log(value) and log(scale). A
+    slope of 1 is linear scaling, 2 is quadratic, and less than 1 is sublinear.
+    """
+    points = [(math.log(scale), math.log(value)) for scale, value in zip(scales, values)
+              if value is not None and value > 0]
+    if len(points) < 2:
+        return None
+
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    variance = sum((x - mean_x) ** 2 for x, _ in points)
+    if variance == 0:
+        return None
+    return round(sum((x - mean_x) * (y - mean_y) for x, y in points) / variance, 3)
+
+
+def build_scaling_report(scales: list[float], runs: dict[float, dict[str, Any]]) -> dict[str, Any]:
+    """Combine the run reports for each scale into a scaling curve for each stage."""
+    stage_paths: list[str] = []
+    measurements: dict[str, dict[float, dict[str, Any]]] = {}
+    for scale in scales:
+        for record in runs[scale]['stages']:
+            if record['path'].count('/') >= report_depth:
+                continue
+            if record['path'] not in measurements:
+                stage_paths.append(record['path'])
+                measurements[record['path']] = {}
+
+            # stages that run more than once (e.g., for each area) are summed
+            measurement = measurements[record['path']].setdefault(scale, {
+                'status': 'ok', 'runs': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'peak_rss_bytes': None,
+            })
+            measurement['runs'] += 1
+            measurement['wall_seconds'] = round(measurement['wall_seconds'] + record['wall_seconds'], 3)
+            measurement['cpu_seconds'] = round(measurement['cpu_seconds'] + record['cpu_seconds'], 3)
+            if record['peak_rss_bytes'] is not None:
+                measurement['peak_rss_bytes'] = max(measurement['peak_rss_bytes'] or 0, record['peak_rss_bytes'])
+            if record['status'] != 'ok':
+                measurement['status'] = record['status']
+
+    stages = []
+    for path in stage_paths:
+        by_scale = measurements[path]
+        stages.append({
+            'path': path,
+            'scales': {str(scale): by_scale.get(scale) for scale in scales},
+            'wall_seconds_exponent': scaling_exponent(
+                scales, [by_scale[scale]['wall_seconds'] if scale in by_scale else None for scale in scales]),
+            'peak_rss_exponent': scaling_exponent(
+                scales, [by_scale[scale]['peak_rss_bytes'] if scale in by_scale else None for scale in scales]),
+        })
+
+    return {
+        'scales': scales,
+        'inputs': {str(scale): runs[scale]['inputs'] for scale in scales},
+        'stages': stages,
+    }
+
+
+def print_scaling_report(report: dict[str, Any]) -> None:
+    scales: list[float] = report['scales']
+    header = f'{'stage':<48}' + ''.join(f'{f'{scale:g}x (s)':>12}{f'{scale:g}x (GB)':>12}' for scale in scales) \
+        + f'{'time exp':>10}{'mem exp':>10}'
+    print('\n' + header)
+    print('-' * len(header))
+    for stage in report['stages']:
+        row = f'{('  ' * stage['path'].count('/')) + stage['path'].split('/')[-1]:<48}'
+        for scale in scales:
+            measurement = stage['scales'][str(scale)]
+            if measurement is None:
+                row += f'{'-':>12}{'-':>12}'
+                continue
+            wall = f'{measurement['wall_seconds']:.1f}' + ('!' if measurement['status'] != 'ok' else '')
+            peak = measurement['peak_rss_bytes']
+            row += f'{wall:>12}{f'{peak / 1024 ** 3:.2f}' if peak is not None else '-':>12}'
+        for exponent in [stage['wall_seconds_exponent'], stage['peak_rss_exponent']]:
+            row += f'{f'{exponent:.2f}' if exponent is not None else '-':>10}'
+        print(row)
+    print('\n! = the stage failed at this scale. An exponent of 1 is linear scaling.')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog='Data Pipeline Benchmark',
+        description='Generates synthetic inputs at several scales, runs the replica (process mode), essential services, '
+                    'future routes, and finalize steps on them, and reports how the wall time and peak memory of each '
+                    'stage grow with the scale.',
+    )
+    parser.add_argument(
+        '--scales', type=str, default='1,10,100',
+        help='Comma-separated list of scale factors. Scale 1 has 20,000 people and 100,000 trips.')
+    parser.add_argument(
+        '--output', type=str, default='./data/benchmark',
+        help='The folder for the synthetic data and the scaling report. Each scale gets its own folder.')
+    parser.add_argument(
+        '--workloads', type=str, default=','.join(workload_names),
+        help='Comma-separated list of workloads to run. greenlink_gtfs is required by the others.')
+    parser.add_argument(
+        '--seed', type=int, default=0, help='The seed for the synthetic data.')
+    parser.add_argument(
+        '--regenerate', action='store_true',
+        help='Generate the synthetic data again even if it already exists for a scale.')
+    parser.add_argument(
+        '--run-workloads', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    selected_workloads = [name.strip() for name in args.workloads.split(',') if name.strip()]
+    unknown_workloads = set(selected_workloads) - set(workload_names)
+    if unknown_workloads:
+        parser.error(f'Unknown workloads: {', '.join(sorted(unknown_workloads))}. '
+                     f'Choose from: {', '.join(workload_names)}.')
+
+    # runs the workloads for a single scale (in the scale's folder)
+    if args.run_workloads:
+        run_workloads(selected_workloads)
+        sys.exit(0)
+
+    scales = sorted({float(scale) for scale in args.scales.split(',') if scale.strip()})
+    output_folder = Path(args.output).resolve()
+    src_folder = Path(__file__).resolve().parent
+
+    runs: dict[float, dict[str, Any]] = {}
+    for scale in scales:
+        scale_folder = output_folder / f'scale-{scale:g}'
+        inputs_folder = scale_folder / 'inputs'
+        run_folder = scale_folder / 'run'
+        inputs_path = scale_folder / 'inputs.json'
+        print(f'\n=== Scale {scale:g} ({scale_folder}) ===')
+
+        # generate the synthetic data once for each scale
+        if args.regenerate or not inputs_path.exists():
+            shutil.rmtree(scale_folder, ignore_errors=True)
+            inputs_folder.mkdir(parents=True)
+            os.chdir(inputs_folder)
+            inputs = generate(scale, args.seed)
+            with open(inputs_path, 'w') as file:
+                json.dump(inputs, file, indent=2)
+        with open(inputs_path, 'r') as file:
+            inputs = json.load(file)
+
+        # run on a fresh copy of the synthetic data so that nothing is skipped as
+        # up to date from a previous benchmark (the large tables are linked instead
+        # of copied because the workloads never modify them)
+        os.chdir(output_folder)
+        shutil.rmtree(run_folder, ignore_errors=True)
+        shutil.copytree(inputs_folder, run_folder, copy_function=link_or_copy)
+
+        # run the workloads in a fresh process so that each scale is measured from a clean start
+        report_path = run_folder / 'data' / 'logs' / 'run-report-benchmark.json'
+        environment = {**os.environ, 'RUN_REPORT_PATH': str(report_path),
+                       'PYTHONPATH': os.pathsep.join(filter(None, [str(src_folder), os.getenv('PYTHONPATH')]))}
+        subprocess.run([sys.executable, str(src_folder / 'benchmark.py'), '--run-workloads',
+                        '--workloads', ','.join(selected_workloads)], cwd=run_folder, env=environment)
+
+        with open(report_path, 'r') as file:
+            runs[scale] = {'inputs': inputs, 'stages': json.load(file)['stages']}
+
+    report = build_scaling_report(scales, runs)
+    report_path = output_folder / 'scaling_report.json'
+    with open(report_path, 'w') as file:
+        json.dump(report, file, indent=2)
+
+    print_scaling_report(report)
+    print(f'\nSaved the scaling report to {report_path}')
@@ -0,0 +1,275 @@
+import json
+import os
+import shutil
+import sqlite3
+import time
+from contextlib import closing
+from pathlib import Path
+from typing import Any, Iterable, Optional, TypedDict
+
+type StrPath = str | os.PathLike[str]
+
+
+class Checkpoint(TypedDict):
+    stage: str
+    season: str
+    area: str
+    day: str
+    chunk: str
+    tag: str
+    outputs: list[str]
+    result: Any
+    completed_at: float
+
+
+def partial_path(path: StrPath) -> Path:
+    """
+    Get the path that a partial output should be written to before it is
+    committed with `CheckpointStore.commit`.
+
+    The partial path is a hidden file in the same folder as the output so that
+    renaming it is atomic and so that readers that scan the folder (e.g., dask
+    and pyarrow, which skip hidden files) never see an incomplete output.
+    """
+    path = Path(path)
+    return path.with_name(f'.{path.name}.partial')
+
+
+def replace_with_partial(path: StrPath) -> None:
+    """
+    Move the partial output for `path` (see `partial_path`) into place,
+    replacing any existing output. Does nothing if there is no partial output.
+    """
+    path = Path(path)
+    partial = partial_path(path)
+    if not partial.exists():
+        return
+    # folders cannot be replaced by renaming, so remove the existing output first
+    if path.is_dir():
+        shutil.rmtree(path)
+    elif partial.is_dir() and path.exists():
+        path.unlink()
+    os.replace(partial, path)
+
+
+class CheckpointStore:
+    """
+    A record of the units of work that have finished, which allows long
+    stages to resume where they left off.
+
+    Each unit of work is identified by its stage and, where they apply, its
+    season, area, day, and chunk. A unit is complete when it has been committed
+    with the same tag (e.g., a hash of the inputs that the unit depends on)
+    and all of its outputs still exist.
+
+    Outputs should be written to their `partial_path` and are moved into place
+    when the unit is committed, so an interrupted write never leaves an output
+    that looks complete. Units may also store a small JSON-serializable result
+    (e.g., statistics) instead of or in addition to output files.
+
+    Unlike the build manifest, which decides whether work is up to date by
+    hashing its inputs and outputs, checkpoints are cheap to check and query, so
+    they are suitable for the thousands of chunks inside of a single stage.
+
+    The store is a SQLite database so that it can be safely updated by
+    processes and threads that run at the same time. It is kept in the data
+    folder (the only folder that the Docker image keeps between runs), which no
+    source runner clears, so interrupted work resumes in the next run too.
+    """
+
+    database_path = Path('./data/checkpoints.sqlite')
+
+    def __init__(self, database_path: Optional[StrPath] = None) -> None:
+        if database_path is not None:
+            self.database_path = Path(database_path)
+        self.database_path.parent.mkdir(parents=True, exist_ok=True)
+
+        with closing(self._connect()) as connection, connection:
+            connection.executescript('''
+                CREATE TABLE IF NOT EXISTS checkpoints (
+                    stage TEXT NOT NULL,
+                    season TEXT NOT NULL,
+                    area TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    chunk TEXT NOT NULL,
+                    tag TEXT NOT NULL,
+                    outputs TEXT NOT NULL,
+                    result TEXT,
+                    completed_at REAL NOT NULL,
+                    PRIMARY KEY (stage, season, area, day, chunk)
+                );
+            ''')
+
+    def _connect(self) -> sqlite3.Connection:
+        # wait for other processes to finish writing instead of failing immediately
+        return sqlite3.connect(self.database_path, timeout=60)
+
+    def commit(
+        self,
+        stage: str,
+        *,
+        season: str = '',
+        area: str = '',
+        day: str = '',
+        chunk: str = '',
+        tag: str = '',
+        outputs: Iterable[StrPath] = (),
+        result: Any = None,
+    ) -> None:
+        """
+        Record that a unit of work has finished.
+
+        The partial output for each output path (see `partial_path`) is moved into
+        place before the unit is recorded. Outputs without a partial output are
+        recorded as they are.
+
+        Args:
+            stage: The name of the stage that the unit belongs to.
+            season: The season of the unit (e.g., `south_atlantic_2023_Q2`), if any.
+            area: The area of the unit, if any.
+            day: The day of the unit (`thursday` or `saturday`), if any.
+            chunk: The chunk of the unit, if any.
+            tag: A value that must match when checking whether the unit is complete.
+            outputs: The files or folders produced by the unit.
+            result: A JSON-serializable result to store with the unit.
+        """
+        outputs = [str(path) for path in outputs]
+        for path in outputs:
+            replace_with_partial(path)
+
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO checkpoints '
+                '(stage, season, area, day, chunk, tag, outputs, result, completed_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (stage, season, area, day, chunk, tag, json.dumps(outputs),
+                 json.dumps(result) if result is not None else None, time.time())
+            )
+
+    def get(
+        self,
+        stage: str,
+        *,
+        season: str = '',
+        area: str = '',
+        day: str = '',
+        chunk: str = '',
+        tag: Optional[str] = None,
+    ) -> Optional[Checkpoint]:
+        """
+        Get a complete unit of work. Returns None if the unit has not been committed,
+        was committed with a different tag, or any of its outputs are missing.
+        """
+        checkpoints = self.query(stage, season=season, area=area, day=day, chunk=chunk, tag=tag)
+        if not checkpoints:
+            return None
+        checkpoint = checkpoints[0]
+        if not all(os.path.exists(path) for path in checkpoint['outputs']):
+            return None
+        return checkpoint
+
+    def is_complete(
+        self,
+        stage: str,
+        *,
+        season: str = '',
+        area: str = '',
+        day: str = '',
+        chunk: str = '',
+        tag: Optional[str] = None,
+    ) -> bool:
+        """
+        Whether a unit of work has been committed with the given tag
+        and all of its outputs still exist.
+        """
+        return self.get(stage, season=season, area=area, day=day, chunk=chunk, tag=tag) is not None
+
+    def query(
+        self,
+        stage: str,
+        *,
+        season: Optional[str] = None,
+        area: Optional[str] = None,
+        day: Optional[str] = None,
+        chunk: Optional[str] = None,
+        tag: Optional[str] = None,
+    ) -> list[Checkpoint]:
+        """
+        Find the committed units of work for a stage. Only the filters
+        that are provided are applied.
+
+        The outputs of the units are not checked. Use `get` or `is_complete`
+        to confirm that a single unit is complete.
+        """
+        where, values = self._where(stage, season=season, area=area, day=day, chunk=chunk, tag=tag)
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                'SELECT stage, season, area, day, chunk, tag, outputs, result, completed_at '
+                f'FROM checkpoints WHERE {where} ORDER BY season, area, day, chunk',
+                values
+            ).fetchall()
+
+        return [
+            Checkpoint(
+                stage=stage, season=season, area=area, day=day, chunk=chunk, tag=tag,
+                outputs=json.loads(outputs), result=json.loads(result) if result is not None else None,
+                completed_at=completed_at,
+            )
+            for stage, season, area, day, chunk, tag, outputs, result, completed_at in rows
+        ]
+
+    def forget(
+        self,
+        stage: str,
+        *,
+        season: Optional[str] = None,
+        area: Optional[str] = None,
+        day: Optional[str] = None,
+        chunk: Optional[str] = None,
+    ) -> None:
+        """
+        Remove the committed units of work for a stage so that they will be done
+        again. Only the filters that are provided are applied. Outputs are not removed.
+        """
+        where, values = self._where(stage, season=season, area=area, day=day, chunk=chunk)
+        with closing(self._connect()) as connection, connection:
+            connection.execute(f'DELETE FROM checkpoints WHERE {where}', values)
+
+    def adopt_marker(
+        self,
+        marker_path: StrPath,
+        stage: str,
+        *,
+        season: str = '',
+        area: str = '',
+        day: str = '',
+        chunk: str = '',
+        tag: str = '',
+        outputs: Iterable[StrPath] = (),
+        remove_marker: bool = True,
+    ) -> bool:
+        """
+        Commit a unit of work that was marked as complete with a marker file
+        before the checkpoint store existed so that it is not done again.
+
+        Returns:
+            Whether the marker file and all of the outputs existed and the unit was committed.
+        """
+        outputs = [str(path) for path in outputs]
+        if not os.path.exists(marker_path) or not all(os.path.exists(path) for path in outputs):
+            return False
+
+        self.commit(stage, season=season, area=area, day=day, chunk=chunk, tag=tag, outputs=outputs)
+        if remove_marker:
+            os.remove(marker_path)
+        return True
+
+    @staticmethod
+    def _where(stage: str, **filters: Optional[str]) -> tuple[str, list[str]]:
+        clauses = ['stage = ?']
+        values = [stage]
+        for column, value in filters.items():
+            if value is not None:
+                clauses.append(f'{column} = ?')
+                values.append(value)
+        return ' AND '.join(clauses), values
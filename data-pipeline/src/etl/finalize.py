@@ -11,6 +11,8 @@ from typing import TypedDict
 
 from tqdm import tqdm
 
+from etl.run_report import instrument, stage
+
 FILE_EXTENSIONS_TO_MOVE = ['.json', '.geojson', '.deflate', '.vectortiles', '.md']
 PIPELINE_DATA_DIR = './data'
 PUBLIC_DIR_NAME = '__public'
@@ -45,9 +47,10 @@ def finalize():
     print(f'  Found {len(items_to_copy)} files to link or copy ({total_bytes // 1000000} MB).')
 
     # copy with progress bar
-    with ThreadPoolExecutor(max_workers=8) as pool:
+    with stage('link_or_copy') as record, ThreadPoolExecutor(max_workers=8) as pool:
         list(tqdm(pool.map(link_or_copy, items_to_copy), total=len(
             items_to_copy), desc="Linking or copying files"))
+        record.rows_out = len(items_to_copy)
 
     # recursively delete empty directories in public/data
     print("Deleting empty directories...")
@@ -180,6 +183,7 @@ def delete_empty_directories(path: Path) -> None:
             pass
 
 
+@instrument('deflate_json_files')
 def deflate_json_files(directory: Path) -> None:
     """Deflate all .json and .geojson files in the given directory and its subdirectories."""
     import zlib
@@ -271,6 +275,7 @@ def _index_vectortiles(vectortiles_file: Path) -> None:
         tqdm.write(f"Error repackaging {vectortiles_file.name}: {error}")
 
 
+@instrument('cloud_optimize_vectortiles')
 def cloud_optimize_vectortiles(directory: Path) -> None:
     """
     Recursively look for .vectortiles files in a directory and its subdirectories.
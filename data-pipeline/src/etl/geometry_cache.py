@@ -0,0 +1,60 @@
+import os
+from functools import lru_cache
+from typing import Optional
+
+import geopandas
+import numpy
+import shapely
+from pyproj import CRS
+from shapely.geometry.base import BaseGeometry
+
+type StrPath = str | os.PathLike[str]
+
+# the number of dissolved geometries that are kept in memory in each process
+max_cached_geometries = 64
+
+
+def prepared_union(geometry: geopandas.GeoSeries | BaseGeometry) -> BaseGeometry:
+    """
+    Dissolve geometries into a single geometry and prepare it with
+    `shapely.prepare`, so that testing many geometries against it (e.g.,
+    with `intersects`, `within`, or `shapely.contains_xy`) uses an index of
+    its edges instead of checking every edge for every geometry.
+
+    A single geometry is prepared as it is. Preparing a geometry that is
+    already prepared does nothing.
+    """
+    union = geometry.union_all() if isinstance(geometry, geopandas.GeoSeries) else geometry
+    shapely.prepare(union)
+    return union
+
+
+@lru_cache(maxsize=max_cached_geometries)
+def _read_dissolved_geometry(files: tuple[tuple[str, int, int], ...], crs: Optional[str]) -> BaseGeometry:
+    geometries: list[numpy.ndarray] = []
+    for path, _, _ in files:
+        geometry = geopandas.read_file(path, columns=['geometry']).geometry
+        geometries.append((geometry if crs is None else geometry.to_crs(CRS(crs))).to_numpy())
+    return prepared_union(shapely.union_all(numpy.concatenate(geometries)))
+
+
+def dissolved_geometry(*paths: StrPath, crs: Optional[CRS | str] = None) -> BaseGeometry:
+    """
+    Read the geometry of one or more files (e.g., service areas, interest
+    areas, or scenario sheds), dissolve it into a single geometry, and prepare
+    it (see `prepared_union`).
+
+    The result is cached in memory by the path, size, and modification time of
+    each file and by the CRS, so each file is only read and dissolved once in a
+    process until it changes. The geometry is shared by every caller, so it
+    must not be modified.
+
+    Args:
+        paths: The files to read. The geometry of all of the files is dissolved together.
+        crs: The CRS to reproject the geometry to. If None, the geometry is kept in the CRS of each file.
+    """
+    files = tuple(
+        (os.path.abspath(path), (stat := os.stat(path)).st_size, stat.st_mtime_ns)
+        for path in paths
+    )
+    return _read_dissolved_geometry(files, CRS(crs).to_wkt() if crs is not None else None)
@@ -0,0 +1,203 @@
+import multiprocessing
+import os
+import queue
+import time
+from multiprocessing.queues import Queue
+from typing import Optional, TypedDict
+
+# the minimum time without progress before a runner is considered stalled
+# when nothing better is known about the stage it is in
+minimum_stall_seconds = float(os.getenv('STALL_TIMEOUT_SECONDS', '900'))
+
+# heartbeats for the same stage are sent at most this often (stage changes are always sent)
+send_interval = 1.0
+
+
+class Heartbeat(TypedDict):
+    pid: int
+    time: float
+    stage: str
+    done: Optional[int]
+    total: Optional[int]
+
+
+# the channel for the runner process (and its child processes, which inherit it)
+_channel: Optional[Queue] = None
+_last_sent: tuple[str, float] = ('', 0.0)
+
+
+def create_channel() -> Queue:
+    """Create a channel that a runner process can send heartbeats over."""
+    # a queue from the fork context cannot be passed to worker pool processes, which are
+    # started from a fork server, but a queue from the spawn context can be passed to both
+    return multiprocessing.get_context('spawn').Queue()
+
+
+def connect(channel: Queue) -> None:
+    """
+    Send heartbeats from this process (and the child processes it starts)
+    over the given channel.
+    """
+    global _channel, _last_sent
+    _channel = channel
+    _last_sent = ('', 0.0)
+
+    # do not wait for unsent heartbeats when the process exits
+    channel.cancel_join_thread()
+
+
+def current_channel() -> Optional[Queue]:
+    """The channel that this process sends heartbeats over (if any)."""
+    return _channel
+
+
+def send_heartbeat(stage: str, done: Optional[int] = None, total: Optional[int] = None) -> None:
+    """
+    Tell the watchdog that the runner is making progress.
+
+    Does nothing if this process is not connected to a watchdog, so it is
+    safe to call from code that is not run by the pipeline runner.
+
+    Args:
+        stage: The path of the stage that is making progress.
+        done: The number of units of work that are done in the stage, if known.
+        total: The total number of units of work in the stage, if known.
+    """
+    global _last_sent
+    if _channel is None:
+        return
+
+    now = time.time()
+    last_stage, last_time = _last_sent
+    if stage == last_stage and now - last_time < send_interval:
+        return
+    _last_sent = (stage, now)
+
+    try:
+        _channel.put_nowait(Heartbeat(pid=os.getpid(), time=now, stage=stage, done=done, total=total))
+    except (OSError, ValueError, queue.Full):
+        # the watchdog has gone away; the runner should keep working
+        pass
+
+
+class StallWatchdog:
+    """
+    Decides whether a runner has stalled based on the heartbeats it sends.
+
+    A heartbeat counts as progress when the process that sent it enters a stage
+    that it has not been in before or when the number of units done that the
+    process reports for the stage increased. Heartbeats that repeat a stage and
+    units done that were already seen (e.g., from a loop that is stuck, or from
+    several processes that take turns sending heartbeats for their own stages)
+    do not count as progress.
+
+    The runner is stalled when the time since the last progress is longer than
+    the allowance for its current stage, which is the largest of:
+    - `minimum_stall_seconds`
+    - 1.5 times the duration of the stage in the previous run report
+    - 10 times the average time between units of work in the stage
+    """
+
+    def __init__(self, channel: Queue, expected_durations: Optional[dict[str, float]] = None,
+                 minimum_seconds: Optional[float] = None) -> None:
+        self.channel = channel
+        self.expected_durations = expected_durations or {}
+        self.minimum_seconds = minimum_stall_seconds if minimum_seconds is None else minimum_seconds
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget all progress (e.g., after the runner is restarted)."""
+        now = time.time()
+        self.stage = ''
+        self.done: Optional[int] = None
+        self.total: Optional[int] = None
+        self.last_progress_at = now
+        # keyed by (process ID, stage) so that processes working on different stages
+        # or on different parts of the same stage do not look like progress to each other
+        self.seen_stages: set[tuple[int, str]] = set()
+        self.stage_done: dict[tuple[int, str], int] = {}
+        self.stage_unit_started_at: dict[tuple[int, str], tuple[float, int]] = {}
+        self.stage_unit_seconds: dict[str, float] = {}
+
+    def receive(self) -> None:
+        """Read all heartbeats that have arrived since the last call."""
+        while True:
+            try:
+                heartbeat: Heartbeat = self.channel.get_nowait()
+            except queue.Empty:
+                return
+            except (OSError, ValueError, EOFError):
+                return
+            self._observe(heartbeat)
+
+    def _observe(self, heartbeat: Heartbeat) -> None:
+        stage = heartbeat['stage']
+        done = heartbeat['done']
+        key = (heartbeat['pid'], stage)
+        is_progress = key not in self.seen_stages
+        self.seen_stages.add(key)
+        if done is not None:
+            previous_done = self.stage_done.get(key)
+            if previous_done is None or done > previous_done:
+                is_progress = True
+                self._observe_rate(key, heartbeat['time'], done)
+                self.stage_done[key] = done
+
+        self.stage = stage
+        self.done = done
+        self.total = heartbeat['total']
+        if is_progress:
+            self.last_progress_at = max(self.last_progress_at, heartbeat['time'])
+
+    def _observe_rate(self, key: tuple[int, str], at: float, done: int) -> None:
+        # the average number of seconds per unit since the first heartbeat with units for this stage
+        # from the same process
+        if key not in self.stage_unit_started_at:
+            self.stage_unit_started_at[key] = (at, done)
+            return
+        started_at, started_done = self.stage_unit_started_at[key]
+        if done > started_done:
+            _, stage = key
+            self.stage_unit_seconds[stage] = (at - started_at) / (done - started_done)
+
+    def allowance(self) -> float:
+        """The number of seconds without progress that are allowed for the current stage."""
+        allowance = self.minimum_seconds
+        expected = self.expected_durations.get(self.stage)
+        if expected is not None:
+            allowance = max(allowance, expected * 1.5)
+        unit_seconds = self.stage_unit_seconds.get(self.stage)
+        if unit_seconds is not None:
+            allowance = max(allowance, unit_seconds * 10)
+        return allowance
+
+    def idle_seconds(self) -> float:
+        """The number of seconds since the last progress."""
+        return time.time() - self.last_progress_at
+
+    def describe(self) -> str:
+        """A short description of the current stage and progress."""
+        progress = ''
+        if self.done is not None:
+            progress = f' ({self.done}/{self.total if self.total is not None else "?"})'
+        return f'{self.stage or "(start)"}{progress}'
+
+
+def descendant_pids(pid: int) -> list[int]:
+    """
+    Find the process IDs of all descendants of a process (children first).
+
+    Returns an empty list if /proc is not available (e.g., on macOS).
+    """
+    children: list[int] = []
+    try:
+        for task in os.listdir(f'/proc/{pid}/task'):
+            with open(f'/proc/{pid}/task/{task}/children', 'r') as file:
+                children += [int(child) for child in file.read().split()]
+    except OSError:
+        return []
+
+    descendants = list(children)
+    for child in children:
+        descendants += descendant_pids(child)
+    return descendants
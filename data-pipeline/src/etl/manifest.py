@@ -0,0 +1,292 @@
+import ast
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from pathlib import Path
+from typing import Any, Iterable, Optional
+
+type StrPath = str | os.PathLike[str]
+
+etl_folder = Path(__file__).parent
+
+# shared modules that schedule, measure, or resume work but do not affect its outputs,
+# so changing them does not invalidate the work of the source runners that import them
+infrastructure_modules = {
+    'checkpoints', 'heartbeat', 'manifest', 'memory_budget', 'planner',
+    'run_report', 'runner', 'synthetic_data', 'worker_pool',
+}
+
+
+class BuildManifest:
+    """
+    A pipeline-wide record of the work that has already been done.
+
+    Each unit of work (a source runner or a stage inside of one) is identified
+    by a key. When the work finishes, its fingerprint is recorded alongside
+    a fingerprint of its outputs. The fingerprint combines the content of the
+    inputs, the code that produces the outputs, and the parameters that
+    affect the outputs. On the next run, the work can be skipped if the
+    fingerprint is unchanged and the outputs have not been modified
+    or removed.
+
+    The manifest is a SQLite database so that it can be safely updated by
+    source runners that run at the same time in separate processes.
+
+    File content hashes are cached by path, size, and modification time so that
+    unchanged files are not re-read on every run.
+
+    Set the `FORCE_REBUILD` environment variable to `1` to treat all recorded
+    work as out of date. The work will still be recorded when it finishes.
+    """
+
+    database_path = Path('./data/build_manifest.sqlite')
+
+    def __init__(self, database_path: Optional[StrPath] = None) -> None:
+        if database_path is not None:
+            self.database_path = Path(database_path)
+        self.database_path.parent.mkdir(parents=True, exist_ok=True)
+
+        # read at initialization (not import) so that command line flags can set it
+        self.force = os.getenv('FORCE_REBUILD', '0') == '1'
+
+        self._file_digests: Optional[dict[str, tuple[int, int, str]]] = None
+        self._lock = threading.Lock()
+
+        with closing(self._connect()) as connection, connection:
+            connection.executescript('''
+                CREATE TABLE IF NOT EXISTS work (
+                    key TEXT PRIMARY KEY,
+                    fingerprint TEXT NOT NULL,
+                    outputs TEXT NOT NULL,
+                    outputs_fingerprint TEXT NOT NULL,
+                    recorded_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS file_digests (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    digest TEXT NOT NULL
+                );
+            ''')
+
+    def __getstate__(self) -> dict[str, Any]:
+        # locks cannot be pickled, so a new one is created when the
+        # manifest is sent to another process
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        # wait for other processes to finish writing instead of failing immediately
+        return sqlite3.connect(self.database_path, timeout=60)
+
+    def fingerprint(
+        self,
+        *,
+        inputs: Iterable[StrPath] = (),
+        parameters: Optional[dict[str, Any]] = None,
+        code: Iterable[StrPath] = (),
+    ) -> str:
+        """
+        Compute the fingerprint for a unit of work.
+
+        Args:
+            inputs: Files or folders whose content is read by the work. Folders
+                are hashed recursively. Paths that do not exist are included
+                as missing so that creating them changes the fingerprint.
+            parameters: JSON-serializable values that affect the outputs.
+                Only a hash of the values is stored, so they may contain secrets.
+            code: Files or folders containing the Python code that performs
+                the work. Only `.py` files are hashed.
+
+        Returns:
+            The fingerprint as a hex digest.
+        """
+        fingerprint = {
+            'inputs': self.hash_paths(inputs),
+            'parameters': json.dumps(parameters or {}, sort_keys=True, default=str),
+            'code': self.hash_paths(code, suffixes=('.py',)),
+        }
+        return hashlib.md5(json.dumps(fingerprint, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def is_fresh(self, key: str, fingerprint: str) -> bool:
+        """
+        Whether the work identified by `key` was already done with the same
+        fingerprint and its outputs are unchanged since they were recorded.
+        """
+        if self.force:
+            return False
+
+        with closing(self._connect()) as connection:
+            row = connection.execute(
+                'SELECT fingerprint, outputs, outputs_fingerprint FROM work WHERE key = ?', (key,)
+            ).fetchone()
+
+        if row is None:
+            return False
+
+        recorded_fingerprint, outputs, outputs_fingerprint = row
+        if recorded_fingerprint != fingerprint:
+            return False
+
+        return self.hash_paths(json.loads(outputs)) == outputs_fingerprint
+
+    def has_record(self, key: str) -> bool:
+        """
+        Whether any work has been recorded for `key`, regardless of whether
+        it is still fresh.
+        """
+        with closing(self._connect()) as connection:
+            row = connection.execute('SELECT 1 FROM work WHERE key = ?', (key,)).fetchone()
+        return row is not None
+
+    def record(self, key: str, fingerprint: str, outputs: Iterable[StrPath]) -> None:
+        """
+        Record that the work identified by `key` finished with the given
+        fingerprint and produced the given output files or folders.
+        """
+        outputs = sorted(str(path) for path in outputs)
+        outputs_fingerprint = self.hash_paths(outputs)
+
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO work (key, fingerprint, outputs, outputs_fingerprint, recorded_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (key, fingerprint, json.dumps(outputs), outputs_fingerprint, time.time())
+            )
+
+    def forget(self, key: str) -> None:
+        """
+        Remove the record for the work identified by `key` so that it will
+        not be considered fresh on the next run.
+        """
+        with closing(self._connect()) as connection, connection:
+            connection.execute('DELETE FROM work WHERE key = ?', (key,))
+
+    def hash_paths(self, paths: Iterable[StrPath], suffixes: Optional[tuple[str, ...]] = None) -> str:
+        """
+        Hash the content of files and folders (recursively) into a single digest.
+
+        The relative path of each file is included in the digest so that renaming
+        or moving a file changes the digest.
+
+        Args:
+            paths: The files or folders to hash.
+            suffixes: If provided, only files with these suffixes are hashed.
+        """
+        file_digests = self._load_file_digests()
+        new_file_digests: list[tuple[str, int, int, str]] = []
+
+        def hash_file(path: str) -> str:
+            stat = os.stat(path)
+            absolute_path = os.path.abspath(path)
+            cached = file_digests.get(absolute_path)
+            if cached is not None and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+                return cached[2]
+
+            with open(path, 'rb') as file:
+                digest = hashlib.file_digest(file, 'md5').hexdigest()
+            file_digests[absolute_path] = (stat.st_size, stat.st_mtime_ns, digest)
+            new_file_digests.append((absolute_path, stat.st_size, stat.st_mtime_ns, digest))
+            return digest
+
+        digest = hashlib.md5()
+        for path in sorted(str(path) for path in paths):
+            if os.path.isfile(path):
+                digest.update(f'{path}:{hash_file(path)}\n'.encode('utf-8'))
+            elif os.path.isdir(path):
+                for root, dirs, files in os.walk(path):
+                    dirs.sort()  # walk in a stable order
+                    for name in sorted(files):
+                        if suffixes is not None and not name.endswith(suffixes):
+                            continue
+                        file_path = os.path.join(root, name)
+                        relative_path = os.path.relpath(file_path, path)
+                        digest.update(f'{path}/{relative_path}:{hash_file(file_path)}\n'.encode('utf-8'))
+            else:
+                digest.update(f'{path}:missing\n'.encode('utf-8'))
+
+        # remember the digests of files that were read so they do not need to be read again
+        if new_file_digests:
+            with closing(self._connect()) as connection, connection:
+                connection.executemany(
+                    'INSERT OR REPLACE INTO file_digests (path, size, mtime_ns, digest) VALUES (?, ?, ?, ?)',
+                    new_file_digests
+                )
+
+        return digest.hexdigest()
+
+    def _load_file_digests(self) -> dict[str, tuple[int, int, str]]:
+        with self._lock:
+            if self._file_digests is None:
+                with closing(self._connect()) as connection:
+                    rows = connection.execute(
+                        'SELECT path, size, mtime_ns, digest FROM file_digests').fetchall()
+                self._file_digests = {path: (size, mtime_ns, digest)
+                                      for path, size, mtime_ns, digest in rows}
+            return self._file_digests
+
+
+def _imported_etl_modules(path: Path) -> set[str]:
+    """
+    Find the `etl` modules that a Python file imports (e.g., `geodesic` for
+    `from etl.geodesic import ...` and `sources.replica` for `import etl.sources.replica.etl`).
+    """
+    tree = ast.parse(path.read_text(), filename=str(path))
+    module_names: list[str] = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            module_names += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module is not None:
+            module_names.append(node.module)
+            if node.module == 'etl':
+                module_names += [f'etl.{alias.name}' for alias in node.names]
+
+    imported: set[str] = set()
+    for module_name in module_names:
+        parts = module_name.split('.')
+        if parts[0] != 'etl' or len(parts) < 2:
+            continue
+        # a module in another source's folder stands for the whole source
+        imported.add('.'.join(parts[1:3]) if parts[1] == 'sources' and len(parts) > 2 else parts[1])
+    return imported
+
+
+def source_code_paths(*source_names: str) -> list[Path]:
+    """
+    Get the paths to the code that is used by the given source runners: their
+    folders, the folders of the other sources that they import, and the shared
+    modules in the `etl` folder that they import (directly or through other
+    shared modules), except for `infrastructure_modules`.
+
+    Use the result as the `code` argument of `BuildManifest.fingerprint`.
+    """
+    pending = [f'sources.{name}' for name in source_names]
+    found: set[str] = set()
+    while pending:
+        module = pending.pop()
+        if module in found or module in infrastructure_modules:
+            continue
+        found.add(module)
+
+        if module.startswith('sources.'):
+            paths = sorted((etl_folder / module.replace('.', '/')).rglob('*.py'))
+        else:
+            paths = [etl_folder / f'{module}.py']
+        for path in paths:
+            if path.exists():
+                pending += _imported_etl_modules(path)
+
+    return [
+        etl_folder / module.replace('.', '/') if module.startswith('sources.') else etl_folder / f'{module}.py'
+        for module in sorted(found)
+        if module.startswith('sources.') or (etl_folder / f'{module}.py').exists()
+    ]
@@ -0,0 +1,225 @@
+import multiprocessing
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
+
+from etl.heartbeat import send_heartbeat
+from etl.run_report import current_stage, load_stage_peak_memory
+
+type MemorySize = int | str
+
+# the memory to reserve for a stage that has not been measured and does not declare its peak memory
+default_reservation = '2G'
+
+# how often a stage that is waiting for memory checks whether memory has been freed
+wait_interval = 5.0
+
+# the maximum number of reservations that can be open at the same time
+max_reservations = 256
+
+memory_units = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+# the budget is shared with child processes by forking, so it must be
+# configured in the main process before any source runner starts
+# (processes that are not forked must be attached to it; see `attach`)
+_budget: Optional[int] = None
+_condition: Any = None
+_slots: Any = None  # pairs of (pid, bytes) for each open reservation
+_measured_peaks: dict[str, int] = {}
+
+# the bytes reserved by the reservations that are open in the current thread
+# (a child process inherits the value from the thread that started it)
+_local = threading.local()
+
+type BudgetState = tuple[int, Any, Any, dict[str, int]]
+
+
+def parse_memory_size(size: MemorySize) -> int:
+    """
+    Parse a memory size such as `48G`, `512M`, or `1.5GB` into bytes.
+    A plain number is a number of bytes.
+    """
+    if isinstance(size, int):
+        return size
+
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*', size, re.IGNORECASE)
+    if match is None:
+        raise ValueError(f'Invalid memory size: {size!r}. Use a number of bytes or a size such as 48G or 512M.')
+    number, unit = match.groups()
+    return int(float(number) * memory_units[unit.upper()])
+
+
+def format_memory_size(size: int) -> str:
+    return f'{size / 1024 ** 3:.1f} GB'
+
+
+def configure(max_memory: Optional[MemorySize]) -> None:
+    """
+    Set the memory budget for the pipeline. Stages that reserve memory with
+    `reserve_memory` wait until their reservation fits in the budget.
+
+    If `max_memory` is None, there is no budget and reservations never wait.
+    """
+    global _budget, _condition, _slots, _measured_peaks
+    if max_memory is None:
+        _budget = None
+        return
+
+    # locks and shared memory from the fork context cannot be passed to worker pool processes,
+    # which are started from a fork server, but ones from the spawn context can be passed to both
+    context = multiprocessing.get_context('spawn')
+    _budget = parse_memory_size(max_memory)
+    _condition = context.Condition()
+    _slots = context.RawArray('q', max_reservations * 2)
+    _measured_peaks = load_stage_peak_memory()
+
+
+def current_budget() -> Optional[BudgetState]:
+    """
+    The memory budget of this process (if any), which can be passed to a
+    process that does not inherit it when it starts (see `attach`).
+    """
+    if _budget is None:
+        return None
+    return (_budget, _condition, _slots, _measured_peaks)
+
+
+def attach(state: BudgetState) -> None:
+    """
+    Reserve memory from this process (and the child processes it starts)
+    against the memory budget of the process that `state` came from
+    (see `current_budget`).
+    """
+    global _budget, _condition, _slots, _measured_peaks
+    _budget, _condition, _slots, _measured_peaks = state
+
+
+def held_memory() -> int:
+    """The bytes reserved by the reservations that are open in the current thread."""
+    return getattr(_local, 'held', 0)
+
+
+@contextmanager
+def continue_reservations(held: int) -> Iterator[None]:
+    """
+    Treat `held` bytes as already reserved by the current thread, so that
+    reservations nested in reservations that another process holds (see
+    `held_memory`) only reserve the memory that those reservations do not cover.
+    """
+    previous = held_memory()
+    _local.held = held
+    try:
+        yield
+    finally:
+        _local.held = previous
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _reserved_bytes() -> int:
+    """The bytes reserved by all open reservations. The condition must be held."""
+    reserved = 0
+    for index in range(max_reservations):
+        pid, size = _slots[index * 2], _slots[index * 2 + 1]
+        if pid == 0:
+            continue
+
+        # release reservations held by processes that were killed before they could release them
+        if not _is_alive(pid):
+            _slots[index * 2] = _slots[index * 2 + 1] = 0
+            continue
+
+        reserved += size
+    return reserved
+
+
+def _open_slot(size: int) -> int:
+    """Record a reservation in an empty slot. The condition must be held."""
+    for index in range(max_reservations):
+        if _slots[index * 2] == 0:
+            _slots[index * 2] = os.getpid()
+            _slots[index * 2 + 1] = size
+            return index
+    raise RuntimeError(f'More than {max_reservations} memory reservations are open at the same time.')
+
+
+@contextmanager
+def reserve_memory(name: str, *, declared: Optional[MemorySize] = None,
+                   default: Optional[MemorySize] = None) -> Iterator[int]:
+    """
+    Wait until the peak memory of a stage fits in the memory budget and
+    reserve it until the stage finishes.
+
+    The peak memory of the stage is, in order of preference:
+    - the `declared` peak memory
+    - the peak memory measured for the stage in the previous run report
+    - the `default` peak memory (or `default_reservation`)
+
+    Reservations may be nested (including in child processes). A nested
+    reservation only reserves the memory that its outer reservations do not
+    already cover. A stage whose peak memory is larger than the budget runs
+    when nothing else holds a reservation instead of waiting forever.
+
+    Does nothing if the budget has not been configured.
+
+    Args:
+        name: The name of the stage, which must match the name used for the
+            stage in the run report (relative to the current stage).
+        declared: The peak memory of the stage, if known in advance.
+        default: The peak memory of the stage if it has not been measured yet.
+
+    Yields:
+        The peak memory of the stage in bytes.
+    """
+    if _budget is None:
+        yield 0
+        return
+
+    parent = current_stage()
+    path = f'{parent.path}/{name}' if parent is not None else name
+
+    if declared is not None:
+        peak = parse_memory_size(declared)
+    elif path in _measured_peaks:
+        peak = _measured_peaks[path]
+    else:
+        peak = parse_memory_size(default if default is not None else default_reservation)
+
+    held = held_memory()
+    additional = max(0, peak - held)
+
+    started_waiting_at = time.time()
+    with _condition:
+        reserved = _reserved_bytes()
+        if reserved + additional > _budget and reserved - held > 0:
+            print(f'◘Waiting for {format_memory_size(additional)} of memory for {path} '
+                  f'({format_memory_size(reserved)} of {format_memory_size(_budget)} is reserved)...')
+
+        while reserved + additional > _budget and reserved - held > 0:
+            _condition.wait(wait_interval)
+            reserved = _reserved_bytes()
+
+            # waiting for memory is progress as far as the stall watchdog is concerned
+            send_heartbeat(f'{path} (waiting for memory)', int(time.time() - started_waiting_at))
+
+        slot = _open_slot(additional)
+
+    _local.held = held + additional
+    try:
+        yield peak
+    finally:
+        _local.held = held
+        with _condition:
+            _slots[slot * 2] = _slots[slot * 2 + 1] = 0
+            _condition.notify_all()
@@ -0,0 +1,169 @@
+import os
+import time
+import traceback
+from pathlib import Path
+from typing import Iterable, Optional, TypedDict
+
+from etl.manifest import BuildManifest
+from etl.run_report import StageTotals, load_stage_totals
+
+
+class PlannedUnit(TypedDict):
+    """A unit of work that a source runner would do."""
+    stage: str  # the path of the run report stage that does the work (used to estimate its time)
+    unit: str  # a description of the unit (e.g., its season, area, day, and travel mode)
+    cached: bool  # whether the unit is already done and would be skipped
+    input_bytes: int
+    estimated_rows: Optional[int]  # the rows the unit reads, if they can be counted without reading the data
+
+
+def path_bytes(paths: Iterable[str | os.PathLike[str]]) -> int:
+    """The total size of the files in `paths`. Folders are included recursively and missing paths are ignored."""
+    total = 0
+    for path in map(Path, paths):
+        if path.is_file():
+            total += path.stat().st_size
+        elif path.is_dir():
+            total += sum(file.stat().st_size for file in path.rglob('*') if file.is_file())
+    return total
+
+
+def count_parquet_rows(paths: Iterable[str | os.PathLike[str]]) -> Optional[int]:
+    """
+    Count the rows in the parquet files in `paths` (folders are searched
+    recursively) from their metadata, without reading the data.
+
+    Returns:
+        The number of rows, or None if there are no parquet files.
+    """
+    import pyarrow.parquet
+
+    parquet_files: list[Path] = []
+    for path in map(Path, paths):
+        if path.is_file() and path.suffix == '.parquet':
+            parquet_files.append(path)
+        elif path.is_dir():
+            parquet_files += [file for file in path.rglob('*.parquet') if not file.name.startswith('.')]
+
+    if not parquet_files:
+        return None
+    return sum(pyarrow.parquet.read_metadata(file).num_rows for file in parquet_files)
+
+
+def estimate_seconds(units: list[PlannedUnit], totals: dict[str, StageTotals]) -> list[Optional[float]]:
+    """
+    Estimate the time each unit takes from the previous run report.
+
+    When the stage of a unit reported the rows it read in the previous run, the
+    estimate is the unit's rows at the stage's time per row. Otherwise, the
+    stage's previous time is divided evenly between its units that will run.
+
+    Returns:
+        The estimated seconds for each unit, or None if there is no estimate.
+    """
+    units_to_run_per_stage: dict[str, int] = {}
+    for unit in units:
+        if not unit['cached']:
+            units_to_run_per_stage[unit['stage']] = units_to_run_per_stage.get(unit['stage'], 0) + 1
+
+    estimates: list[Optional[float]] = []
+    for unit in units:
+        total = totals.get(unit['stage'])
+        if total is None:
+            estimates.append(None)
+        elif total['rows_in'] and unit['estimated_rows'] is not None:
+            estimates.append(total['wall_seconds'] * unit['estimated_rows'] / total['rows_in'])
+        else:
+            estimates.append(total['wall_seconds'] / max(1, units_to_run_per_stage.get(unit['stage'], 0)))
+    return estimates
+
+
+def format_bytes(size: float) -> str:
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1000:
+            return f'{size:.0f} {unit}' if unit == 'B' else f'{size:.1f} {unit}'
+        size /= 1000
+    return f'{size:.1f} TB'
+
+
+def format_duration(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return '?'
+    return time.strftime('%H:%M:%S', time.gmtime(seconds)) if seconds < 86400 else f'{seconds / 3600:.0f}h'
+
+
+def plan_pipeline(etls: Optional[list[str]] = None) -> None:
+    """
+    Print every unit of work that `etl_runner` would do without doing any of it.
+
+    Source runners that declare their outputs are cached when their inputs,
+    code, and parameters have not changed since their last successful run (the
+    same check that `etl_runner` makes). Source runners whose runner.py
+    defines a `source_plan` function that returns a list of `PlannedUnit`s
+    are broken down into those units. Other source runners are a single unit.
+
+    The time of each unit is estimated from the most recent run report (see
+    `estimate_seconds`). Source runners without dependencies between them may
+    run at the same time, so the total is the time if they ran one at a time.
+
+    Args:
+        etls: The names of the source runners to plan. If None, all source runners are planned.
+    """
+    from etl.runner import (SourceRunner, load_source_runners, read_runner_declarations,
+                            runner_fingerprint, sources_dir)
+
+    loaded_runners, _, build_declarations, _ = load_source_runners()
+    manifest = BuildManifest()
+    totals = load_stage_totals()
+
+    print('\nPlanned work (estimates are from the most recent run report):')
+    total_seconds = 0.0
+    total_units = 0
+    units_without_estimate = 0
+    for source_name in loaded_runners:
+        if etls and source_name not in etls:
+            print(f'\n{source_name}: not selected')
+            continue
+
+        # sources that are up to date are skipped entirely
+        declaration = build_declarations.get(source_name)
+        if declaration is not None and manifest.is_fresh(
+                f'runner/{source_name}', runner_fingerprint(manifest, source_name, declaration)):
+            previous = totals.get(source_name)
+            print(f'\n{source_name}: cached (took {format_duration(previous['wall_seconds'] if previous else None)} '
+                  'in the previous run)')
+            continue
+
+        units: list[PlannedUnit] = []
+        runner_file = os.path.join(sources_dir, source_name, 'runner.py')
+        if os.path.exists(runner_file) and 'source_plan' in read_runner_declarations(runner_file)[0]:
+            try:
+                units = list(SourceRunner(source_name, 'source_plan')())  # type: ignore
+                # the units are stages inside of the source runner's stage
+                units = [PlannedUnit(**{**unit, 'stage': f'{source_name}/{unit['stage']}'}) for unit in units]
+            except Exception:
+                print(f'\n{source_name}: could not be planned')
+                traceback.print_exc()
+        if not units:
+            units = [PlannedUnit(stage=source_name, unit='all', cached=False, input_bytes=path_bytes(
+                declaration['inputs'] if declaration is not None else []), estimated_rows=None)]
+
+        estimates = estimate_seconds(units, totals)
+        source_seconds = sum(estimate or 0 for unit, estimate in zip(units, estimates) if not unit['cached'])
+        units_to_run = [unit for unit in units if not unit['cached']]
+        print(f'\n{source_name}: {len(units_to_run)} of {len(units)} units to run (~{format_duration(source_seconds)})')
+
+        width = max(len(unit['unit']) for unit in units)
+        for unit, estimate in zip(units, estimates):
+            rows = f'{unit['estimated_rows']:,} rows' if unit['estimated_rows'] is not None else ''
+            print(f'  {'cached' if unit['cached'] else 'run':<6}  {unit['unit']:<{width}}  '
+                  f'{format_bytes(unit['input_bytes']):>9}  {rows:>18}  ~{format_duration(estimate)}')
+
+        total_seconds += source_seconds
+        total_units += len(units_to_run)
+        units_without_estimate += sum(1 for unit, estimate in zip(units, estimates)
+                                      if not unit['cached'] and estimate is None)
+
+    print(f'\nTotal: {total_units} units to run (~{format_duration(total_seconds)} if the source runners run one at a time)')
+    if units_without_estimate:
+        print(f'       {units_without_estimate} units have no estimate because they did not run in the previous run.')
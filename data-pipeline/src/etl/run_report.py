@@ -0,0 +1,431 @@
+import functools
+import json
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Iterator, Optional, TypedDict
+
+from etl.heartbeat import send_heartbeat
+
+sample_interval = 0.5  # seconds between resident memory samples
+
+# the size of a block reported by getrusage (ru_inblock and ru_oublock)
+rusage_block_size = 512
+
+page_size = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+class StageRecord:
+    """
+    Measurements for a single stage of the pipeline.
+
+    Wall time, CPU time, peak resident memory, and bytes read and written are
+    measured automatically. CPU time and bytes read and written include the child
+    processes that finished during the stage. Peak resident memory includes all
+    child processes that were running during the stage.
+
+    The number of rows that a stage reads and writes cannot be measured
+    automatically, so stages should set `rows_in` and `rows_out` (or
+    use `add_rows_in` and `add_rows_out`) when the counts are known.
+    """
+
+    def __init__(self, name: str, parents: list[str]) -> None:
+        self.name = name
+        self.path = '/'.join([*parents, name])
+        self.parent = '/'.join(parents) or None
+        self.pid = os.getpid()
+        self.status = 'running'
+        self.started_at = time.time()
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.peak_rss_bytes: Optional[int] = None
+        self.rows_in: Optional[int] = None
+        self.rows_out: Optional[int] = None
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def add_rows_in(self, count: int) -> None:
+        self.rows_in = (self.rows_in or 0) + int(count)
+
+    def add_rows_out(self, count: int) -> None:
+        self.rows_out = (self.rows_out or 0) + int(count)
+
+    def observe_rss(self, rss_bytes: Optional[int]) -> None:
+        if rss_bytes is not None and (self.peak_rss_bytes is None or rss_bytes > self.peak_rss_bytes):
+            self.peak_rss_bytes = rss_bytes
+
+    @property
+    def formatted_wall_time(self) -> str:
+        """The wall time formatted as HH:MM:SS."""
+        return time.strftime("%H:%M:%S", time.gmtime(self.wall_seconds))
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            'name': self.name,
+            'path': self.path,
+            'parent': self.parent,
+            'pid': self.pid,
+            'status': self.status,
+            'started_at': self.started_at,
+            'wall_seconds': round(self.wall_seconds, 3),
+            'cpu_seconds': round(self.cpu_seconds, 3),
+            'peak_rss_bytes': self.peak_rss_bytes,
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+        }
+
+
+# the stages that are currently open in this process (across all threads)
+_active_records: list[StageRecord] = []
+_active_records_lock = threading.Lock()
+_sampler_pid: Optional[int] = None
+
+# the open stages for the current thread so that nested stages know their parents
+_local = threading.local()
+
+
+def _reset_after_fork() -> None:
+    global _active_records_lock, _sampler_pid
+    _active_records.clear()
+    _active_records_lock = threading.Lock()
+    _sampler_pid = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _open_records() -> list[StageRecord]:
+    if not hasattr(_local, 'records'):
+        _local.records = []
+    return _local.records
+
+
+def open_stage_names() -> list[str]:
+    """The names of the stages that are open in the current thread (outermost first)."""
+    return [*getattr(_local, 'continued_names', []), *(record.name for record in _open_records())]
+
+
+@contextmanager
+def continue_stages(names: list[str]) -> Iterator[None]:
+    """
+    Treat the given stages (see `open_stage_names`) as open in the current thread
+    so that stages opened inside of it are recorded as their sub-stages.
+
+    Use this in processes that are not forked from the process that opened the
+    stages (e.g., worker pool processes), which do not inherit its open stages.
+    """
+    previous_names = getattr(_local, 'continued_names', [])
+    _local.continued_names = list(names)
+    try:
+        yield
+    finally:
+        _local.continued_names = previous_names
+
+
+def current_stage() -> Optional[StageRecord]:
+    """The innermost stage that is open in the current thread (if any)."""
+    records = _open_records()
+    return records[-1] if records else None
+
+
+def report_rows(rows_in: Optional[int] = None, rows_out: Optional[int] = None) -> None:
+    """
+    Add to the rows read and written by the innermost open stage. Does nothing
+    if no stage is open, so it is safe to call from code that is not measured.
+    """
+    record = current_stage()
+    if record is None:
+        return
+    if rows_in is not None:
+        record.add_rows_in(rows_in)
+    if rows_out is not None:
+        record.add_rows_out(rows_out)
+
+
+def report_progress(done: int, total: Optional[int] = None, record: Optional[StageRecord] = None) -> None:
+    """
+    Report the units of work that are done in the innermost open stage so that
+    the stall watchdog knows the runner is making progress.
+
+    Call this from long loops, especially ones that do not open stages for
+    each unit of work. Threads do not share open stages, so pass the `record`
+    of the stage when reporting progress from another thread.
+    """
+    record = record or current_stage()
+    send_heartbeat(record.path if record is not None else '', done, total)
+
+
+def _read_process_tree_rss(pid: int) -> Optional[int]:
+    """
+    Read the resident memory of a process and all of its descendants from /proc.
+
+    Returns None if /proc is not available (e.g., on macOS).
+    """
+    try:
+        with open(f'/proc/{pid}/statm', 'r') as file:
+            rss = int(file.read().split()[1]) * page_size
+    except (OSError, IndexError, ValueError):
+        return None
+
+    try:
+        children: list[int] = []
+        for task in os.listdir(f'/proc/{pid}/task'):
+            with open(f'/proc/{pid}/task/{task}/children', 'r') as file:
+                children += [int(child) for child in file.read().split()]
+    except OSError:
+        children = []
+
+    for child in children:
+        rss += _read_process_tree_rss(child) or 0
+    return rss
+
+
+def _sample_rss() -> Optional[int]:
+    rss = _read_process_tree_rss(os.getpid())
+    if rss is not None:
+        return rss
+
+    # fall back to the peak resident memory reported by the operating system
+    # (kilobytes on Linux, bytes on macOS)
+    multiplier = 1 if os.uname().sysname == 'Darwin' else 1024
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * multiplier
+
+
+def _ensure_sampler() -> None:
+    """Start a background thread that samples the resident memory of this process tree."""
+    global _sampler_pid
+    if _sampler_pid == os.getpid():
+        return
+    _sampler_pid = os.getpid()
+
+    def sample() -> None:
+        while _sampler_pid == os.getpid():
+            time.sleep(sample_interval)
+            with _active_records_lock:
+                records = list(_active_records)
+            if not records:
+                continue
+            rss = _sample_rss()
+            for record in records:
+                record.observe_rss(rss)
+
+    threading.Thread(target=sample, daemon=True, name='run-report-rss-sampler').start()
+
+
+def _usage() -> tuple[float, int, int]:
+    """The CPU seconds and bytes read and written by this process and its waited-for children."""
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu_seconds = (self_usage.ru_utime + self_usage.ru_stime +
+                   children_usage.ru_utime + children_usage.ru_stime)
+    bytes_read = (self_usage.ru_inblock + children_usage.ru_inblock) * rusage_block_size
+    bytes_written = (self_usage.ru_oublock + children_usage.ru_oublock) * rusage_block_size
+    return cpu_seconds, bytes_read, bytes_written
+
+
+def get_run_report_path() -> Optional[Path]:
+    """
+    The path to the run report for this pipeline run, which is set by
+    `main.py` in the `RUN_REPORT_PATH` environment variable.
+    """
+    path = os.getenv('RUN_REPORT_PATH')
+    return Path(path) if path else None
+
+
+def _records_path(report_path: Path) -> Path:
+    # stage records are appended here as they finish (from any process)
+    # and are combined into the report by write_run_report
+    return report_path.with_suffix('.jsonl')
+
+
+@contextmanager
+def stage(name: str) -> Iterator[StageRecord]:
+    """
+    Measure a stage of the pipeline.
+
+    Stages may be nested. A stage opened inside of another stage (including
+    in a child process started inside of another stage) is recorded as
+    a sub-stage of that stage.
+
+    When the stage finishes, its measurements are appended to the run report
+    for this pipeline run (if there is one).
+
+    Example:
+        ```
+        with stage('population') as record:
+            df = read_population()
+            record.rows_in = len(df)
+        ```
+    """
+    open_records = _open_records()
+    record = StageRecord(name, open_stage_names())
+    open_records.append(record)
+    send_heartbeat(record.path)
+
+    _ensure_sampler()
+    with _active_records_lock:
+        _active_records.append(record)
+    record.observe_rss(_sample_rss())
+
+    start_wall = time.perf_counter()
+    start_cpu, start_read, start_written = _usage()
+    try:
+        yield record
+        if record.status == 'running':
+            record.status = 'ok'
+    except BaseException:
+        record.status = 'error'
+        raise
+    finally:
+        end_cpu, end_read, end_written = _usage()
+        record.wall_seconds = time.perf_counter() - start_wall
+        record.cpu_seconds = end_cpu - start_cpu
+        record.bytes_read = end_read - start_read
+        record.bytes_written = end_written - start_written
+        record.observe_rss(_sample_rss())
+
+        with _active_records_lock:
+            if record in _active_records:
+                _active_records.remove(record)
+        open_records.pop()
+        send_heartbeat(record.parent or record.path)
+
+        report_path = get_run_report_path()
+        if report_path is not None:
+            report_path.parent.mkdir(parents=True, exist_ok=True)
+            # a single small append is atomic, so processes do not interleave records
+            with open(_records_path(report_path), 'a') as file:
+                file.write(json.dumps(record.to_dict()) + '\n')
+
+
+def instrument(name: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """
+    Decorator that measures every call of the decorated function as a stage.
+    """
+    def decorator(func: Callable[..., Any]) -> Callable[..., Any]:
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _load_previous_stages(logs_folder: str | os.PathLike[str]) -> list[dict[str, Any]]:
+    """
+    Read the stages that finished successfully in the most recent run report
+    (excluding the report for the current run).
+    """
+    current_report_path = get_run_report_path()
+    report_paths = [
+        path for path in Path(logs_folder).glob('run-report-*.json')
+        if current_report_path is None or path.resolve() != current_report_path.resolve()
+    ]
+    if not report_paths:
+        return []
+
+    latest_report_path = max(report_paths, key=lambda path: path.stat().st_mtime)
+    try:
+        with open(latest_report_path, 'r') as file:
+            report = json.load(file)
+    except (OSError, json.JSONDecodeError):
+        return []
+
+    return [record for record in report.get('stages', []) if record.get('status') == 'ok']
+
+
+def load_stage_durations(logs_folder: str | os.PathLike[str] = './data/logs') -> dict[str, float]:
+    """
+    Read the wall time of each stage that finished successfully in the most
+    recent run report (excluding the report for the current run).
+
+    Returns:
+        A dictionary mapping stage paths to their wall time in seconds. If a
+        stage ran more than once, the longest wall time is used.
+    """
+    durations: dict[str, float] = {}
+    for record in _load_previous_stages(logs_folder):
+        durations[record['path']] = max(durations.get(record['path'], 0.0), record['wall_seconds'])
+    return durations
+
+
+def load_stage_peak_memory(logs_folder: str | os.PathLike[str] = './data/logs') -> dict[str, int]:
+    """
+    Read the peak resident memory of each stage that finished successfully in
+    the most recent run report (excluding the report for the current run).
+
+    Returns:
+        A dictionary mapping stage paths to their peak resident memory in bytes.
+        If a stage ran more than once, the highest peak is used.
+    """
+    peaks: dict[str, int] = {}
+    for record in _load_previous_stages(logs_folder):
+        if record.get('peak_rss_bytes') is not None:
+            peaks[record['path']] = max(peaks.get(record['path'], 0), record['peak_rss_bytes'])
+    return peaks
+
+
+class StageTotals(TypedDict):
+    wall_seconds: float
+    rows_in: Optional[int]
+    runs: int
+
+
+def load_stage_totals(logs_folder: str | os.PathLike[str] = './data/logs') -> dict[str, StageTotals]:
+    """
+    Read the total wall time and rows read by each stage that finished
+    successfully in the most recent run report (excluding the report for the
+    current run). Unlike `load_stage_durations`, stages that ran more than once
+    are summed so that the time per row read can be calculated.
+
+    Returns:
+        A dictionary mapping stage paths to their totals. `rows_in` is None if
+        the stage did not report the rows it read.
+    """
+    totals: dict[str, StageTotals] = {}
+    for record in _load_previous_stages(logs_folder):
+        total = totals.setdefault(record['path'], StageTotals(wall_seconds=0.0, rows_in=None, runs=0))
+        total['wall_seconds'] += record['wall_seconds']
+        total['runs'] += 1
+        if record.get('rows_in') is not None:
+            total['rows_in'] = (total['rows_in'] or 0) + record['rows_in']
+    return totals
+
+
+def write_run_report(report_path: Optional[Path] = None) -> Optional[Path]:
+    """
+    Combine the stage records for this pipeline run into the run report.
+
+    Returns:
+        The path to the run report or None if there is no run report for this run.
+    """
+    report_path = report_path or get_run_report_path()
+    if report_path is None:
+        return None
+
+    records_path = _records_path(report_path)
+    stages: list[dict[str, Any]] = []
+    if records_path.exists():
+        with open(records_path, 'r') as file:
+            stages = [json.loads(line) for line in file if line.strip()]
+    stages.sort(key=lambda record: record['started_at'])
+
+    report = {
+        'started_at': stages[0]['started_at'] if stages else None,
+        'finished_at': time.time(),
+        'stages': stages,
+    }
+    report_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(report_path, 'w') as file:
+        json.dump(report, file, indent=2)
+
+    if records_path.exists():
+        records_path.unlink()
+    return report_path
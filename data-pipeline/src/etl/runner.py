@@ -1,32 +1,139 @@
+import ast
+import graphlib
 import importlib
 import os
 import sys
-from typing import Optional
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Optional, TypedDict
 
 from etl.finalize import finalize
+from etl.manifest import BuildManifest, source_code_paths
+from etl.memory_budget import MemorySize, configure as configure_memory_budget, reserve_memory
+from etl.run_report import stage, write_run_report
 
 # get the absolute path to the directory containing the source runners
 sources_dir = os.path.join(os.path.dirname(__file__), 'sources')
 
-# Add the sources directory to the system path
-# This allows Python to find the modules within the subdirectories
-sys.path.append(sources_dir)
+# the module-level variables that declare how a source runner is scheduled
+declaration_names = ('after', 'inputs', 'outputs', 'parameters', 'peak_memory')
 
 
-def load_source_runners():
+class BuildDeclaration(TypedDict):
     """
-    Dynamically imports the 'source_runner' function from each runner.py
-    file in the subdirectories of src/etl/sources.
+    Declares what a source runner reads and writes so that it can be
+    skipped when nothing has changed since its last successful run.
+    """
+    inputs: list[str]  # files or folders read by the source runner
+    outputs: list[str]  # files or folders written by the source runner
+    parameters: list[str]  # names of environment variables that affect the outputs
+
+
+class SourceRunner:
+    """
+    The 'source_runner' function (or another function) of a runner.py file,
+    which is imported the first time it is called.
+
+    Runner modules import heavy dependencies (e.g., dask, polars, and
+    pandas_gbq), so they are only imported by the source runners that run.
+    Source runners are called in their own process, so the imports never
+    slow down the main process.
+    """
+
+    def __init__(self, source_name: str, function_name: str = 'source_runner') -> None:
+        self.source_name = source_name
+        self.module_name = f"{source_name}.runner"
+        self.function_name = function_name
+
+    def __call__(self) -> object:
+        # Add the sources directory to the system path
+        # This allows Python to find the modules within the subdirectories
+        added_to_path = sources_dir not in sys.path
+        if added_to_path:
+            sys.path.append(sources_dir)
+        try:
+            module = importlib.import_module(self.module_name)
+        finally:
+            if added_to_path:
+                sys.path.remove(sources_dir)
+
+        return getattr(module, self.function_name)()
+
+    def __repr__(self) -> str:
+        return f"<{self.function_name} from {self.module_name}>"
+
+
+def read_runner_declarations(runner_file: str) -> tuple[set[str], dict[str, Any]]:
+    """
+    Reads the declarations of a runner.py file without importing it.
+
+    Declarations must be assigned literal values (e.g., lists of strings) at
+    the top level of the module so that they can be read statically.
+
+    @param runner_file: The path to the runner.py file.
+    @return: A tuple of the names of the functions that the module defines
+        (e.g., 'source_runner' and 'source_plan') and a dictionary mapping
+        declaration names (see `declaration_names`) to their values.
+    @raises ValueError: If a declaration is not assigned a literal value.
+    """
+    with open(runner_file, 'r') as file:
+        tree = ast.parse(file.read(), filename=runner_file)
+
+    function_names: set[str] = set()
+    declarations: dict[str, Any] = {}
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            function_names.add(node.name)
+            continue
+
+        if isinstance(node, ast.Assign):
+            targets, value = node.targets, node.value
+        elif isinstance(node, ast.AnnAssign) and node.value is not None:
+            targets, value = [node.target], node.value
+        else:
+            continue
+
+        for target in targets:
+            if not isinstance(target, ast.Name):
+                continue
+            if target.id in ('source_runner', 'source_plan'):
+                function_names.add(target.id)
+            elif target.id in declaration_names:
+                try:
+                    declarations[target.id] = ast.literal_eval(value)
+                except ValueError as e:
+                    raise ValueError(
+                        f"{runner_file}: '{target.id}' must be assigned a literal value "
+                        f"(line {node.lineno}) so that it can be read without importing the module.") from e
+
+    return function_names, declarations
+
+
+def load_source_runners() -> tuple[dict[str, SourceRunner | Callable[[], object]], dict[str, list[str]], dict[str, BuildDeclaration], dict[str, MemorySize]]:
+    """
+    Finds the 'source_runner' function in each runner.py file in the
+    subdirectories of src/etl/sources.
+
+    The runner.py files are parsed instead of imported (see `SourceRunner` and
+    `read_runner_declarations`), so loading the source runners is fast and
+    only the source runners that run import their dependencies.
 
     Returns:
-        a dictionary where keys are the subdirectory names and values
-        are the imported 'source_runner' functions.
+        a tuple of four dictionaries. The first maps subdirectory names to their
+        'source_runner' functions (see `SourceRunner`) and 'finalize' to the
+        `finalize` function (in dependency order). The second maps
+        subdirectory names to their 'after' declarations (the source runner names
+        that must finish before that source runner starts). The third maps
+        subdirectory names to their build declarations (only for source runners
+        that declare their `outputs`). The fourth maps subdirectory names to their
+        declared peak memory (only for source runners that declare `peak_memory`).
     """
-    source_runners = {}
+    source_runners: dict[str, SourceRunner | Callable[[], object]] = {}
     after_declarations: dict[str, list[str]] = {}
+    build_declarations: dict[str, BuildDeclaration] = {}
+    memory_declarations: dict[str, MemorySize] = {}
 
     # Iterate through the subdirectories in the sources directory
-    for source_name in os.listdir(sources_dir):
+    for source_name in sorted(os.listdir(sources_dir)):
         source_path = os.path.join(sources_dir, source_name)
 
         # Check if it's a directory and contains a runner.py file
@@ -34,92 +141,286 @@ def load_source_runners():
             runner_file = os.path.join(source_path, 'runner.py')
             if os.path.exists(runner_file):
                 try:
-                    # Construct the module name relative to the added path
-                    module_name = f"{source_name}.runner"
-                    module = importlib.import_module(module_name)
+                    function_names, declarations = read_runner_declarations(runner_file)
 
                     # if the module has the source_runner function, load it
-                    if hasattr(module, 'source_runner') and callable(module.source_runner):
-                        source_runners[source_name] = module.source_runner
+                    if 'source_runner' in function_names:
+                        source_runners[source_name] = SourceRunner(source_name)
                     else:
                         print(
-                            f"Warning: {module_name} does not have a 'source_runner' function.")
+                            f"Warning: {source_name}.runner does not have a 'source_runner' function.")
 
                     # if the module has the after variable, load it
-                    if hasattr(module, 'after'):
+                    if 'after' in declarations:
                         # an after declaration is a list of source runner names that MUST run before this source runner
-                        after_declarations[source_name] = module.after
-
-                except ImportError as e:
-                    print(f"Error importing module {source_name}/runner: {e}")
+                        after_declarations[source_name] = list(declarations['after'])
+
+                    # if the module declares its outputs, it can be skipped when its
+                    # inputs, code, and parameters have not changed since the last run
+                    if 'outputs' in declarations:
+                        build_declarations[source_name] = {
+                            'inputs': list(declarations.get('inputs', [])),
+                            'outputs': list(declarations['outputs']),
+                            'parameters': list(declarations.get('parameters', [])),
+                        }
+
+                    # if the module declares its peak memory, it is used instead of the
+                    # peak memory measured in the previous run to admit the source runner
+                    if 'peak_memory' in declarations:
+                        memory_declarations[source_name] = declarations['peak_memory']
+
+                except (SyntaxError, ValueError) as e:
+                    print(f"Error reading {source_name}/runner: {e}")
                     raise
                 except Exception as e:
                     print(
                         f"An unexpected error occurred while processing {source_name}/runner: {e}")
                     raise
 
-    # Remove the sources directory from the system path after importing
-    sys.path.remove(sources_dir)
-
-    # sort the source runners such that the ones with after declarations are run after their dependencies
-    source_runners = dict(sorted(source_runners.items(), key=lambda item: (
-        after_declarations.get(item[0], []), item[0])))
-
     # add the finalize function as a special source runner that runs last
     source_runners['finalize'] = finalize  # compress/package the data for deployment
+    after_declarations['finalize'] = [name for name in source_runners if name != 'finalize']
+
+    # order the source runners such that each one is listed after its dependencies
+    run_order = resolve_run_order(after_declarations, list(source_runners.keys()))
+    source_runners = {name: source_runners[name] for name in run_order}
+
+    return source_runners, after_declarations, build_declarations, memory_declarations
+
+
+def build_dependency_graph(after_declarations: dict[str, list[str]], runner_names: list[str]) -> dict[str, set[str]]:
+    """
+    Builds a dependency graph from the after declarations of the source runners.
+
+    Args:
+        after_declarations: A dictionary mapping source runner names to the names
+            of the source runners that must finish before they start.
+        runner_names: The names of all available source runners.
+
+    Returns:
+        A dictionary mapping each source runner name to the set of source runner
+        names that it depends on.
+
+    Raises:
+        ValueError: If a source runner depends on a source runner that does not exist.
+    """
+    graph: dict[str, set[str]] = {name: set(after_declarations.get(name, []))
+                                  for name in runner_names}
+
+    missing_dependencies = {
+        name: sorted(dependencies - graph.keys())
+        for name, dependencies in graph.items()
+        if dependencies - graph.keys()
+    }
+    if missing_dependencies:
+        details = '; '.join(f"{name} requires {', '.join(missing)}"
+                            for name, missing in missing_dependencies.items())
+        raise ValueError(f"Source runners depend on source runners that do not exist: {details}.")
 
-    return source_runners
+    return graph
 
 
-def etl_runner(etls: Optional[list[str]] = None) -> None:
+def resolve_run_order(after_declarations: dict[str, list[str]], runner_names: list[str]) -> list[str]:
+    """
+    Finds an order in which the source runners can run one after another such
+    that every source runner runs after its dependencies.
+
+    Raises:
+        ValueError: If a dependency is missing or if the dependencies contain a cycle.
+    """
+    graph = build_dependency_graph(after_declarations, runner_names)
+    try:
+        # static_order is deterministic for a given insertion order
+        return list(graphlib.TopologicalSorter(graph).static_order())
+    except graphlib.CycleError as e:
+        raise ValueError(
+            f"Source runner dependencies contain a cycle: {' -> '.join(e.args[1])}.") from e
+
+
+def etl_runner(etls: Optional[list[str]] = None, max_workers: Optional[int] = None,
+               max_memory: Optional[MemorySize] = None) -> None:
     """
     Run the ETL (extract, transform, and load) pipeline for each source.
 
+    Source runners start as soon as every source runner in their `after`
+    declaration has finished. Source runners without dependencies between
+    them run at the same time. `finalize` always runs last.
+
+    If a source runner is not selected, it is treated as already finished so
+    that the source runners that depend on it can still run (their inputs are
+    expected to already exist in the data folder).
+
+    If a source runner declares its `inputs`, `outputs`, and `parameters`, it is
+    skipped when its inputs, code, and parameters are unchanged since its last
+    successful run and its outputs have not been modified. Set the
+    `FORCE_REBUILD` environment variable to `1` to run it anyway.
+
+    Each source runner is measured as a stage of the run report, which is
+    written when the pipeline finishes (even if a source runner fails).
+
+    If there is a memory budget, a source runner that is ready only starts when
+    its peak memory fits in the budget alongside the source runners (and heavy
+    stages inside of them) that are already running. The peak memory of a source
+    runner is its `peak_memory` declaration or the peak memory measured in the
+    previous run report. Source runners that reserve memory for their own heavy
+    stages (e.g., replica) declare only the memory they need outside of them.
+
     @param etls: List of ETL source names to run. If None, all sources will be run.
+    @param max_workers: The maximum number of source runners to run at the same
+        time. If None, every source runner that is ready will start immediately.
+    @param max_memory: The memory budget for the pipeline (e.g., `48G`). If None,
+        source runners are not limited by memory.
     """
     print("Starting ETL pipeline...")
-    loaded_runners = load_source_runners()
+    loaded_runners, after_declarations, build_declarations, memory_declarations = load_source_runners()
+    manifest = BuildManifest()
 
-    print("\nLoaded source runners:")
-    for source_name, runner_func in loaded_runners.items():
-        will_run = source_name in etls if etls else True
-        print(f"- {source_name}: {runner_func} {'✓' if will_run else '✗'}")
+    # the budget must be configured before any source runner process is started so that they share it
+    configure_memory_budget(max_memory)
 
-    # run the source runners
+    print("\nLoaded source runners:")
     for source_name, runner_func in loaded_runners.items():
         will_run = source_name in etls if etls else True
+        after = ', '.join(after_declarations.get(source_name, [])) if source_name != 'finalize' else 'all'
+        print(f"- {source_name}: {runner_func} {'✓' if will_run else '✗'}"
+              f"{f' (after: {after})' if after else ''}")
+
+    graph = build_dependency_graph(after_declarations, list(loaded_runners.keys()))
+    sorter = graphlib.TopologicalSorter(graph)
+    sorter.prepare()  # raises a CycleError if the dependencies contain a cycle
+
+    if max_workers is None:
+        max_workers = len(loaded_runners)
+    if max_workers < 1:
+        raise ValueError(f"The number of workers must be at least 1. Got: {max_workers}.")
+    print(f"\nRunning up to {max_workers} source runner{'' if max_workers == 1 else 's'} at a time"
+          f"{f' within a memory budget of {max_memory}' if max_memory is not None else ''}.")
+
+    def run(source_name: str) -> None:
+        declaration = build_declarations.get(source_name)
+        fingerprint = None
+        if declaration is not None:
+            fingerprint = runner_fingerprint(manifest, source_name, declaration)
+            if manifest.is_fresh(f'runner/{source_name}', fingerprint):
+                print(f"\033[32m\nSkipping ETL for {source_name} (inputs, code, and parameters are unchanged)...\033[0m")
+                return
+
+        with reserve_memory(source_name, declared=memory_declarations.get(source_name)):
+            print(f"\033[32m\nRunning ETL for {source_name}...\033[0m")
+            with_restart_when_stalled(measured(source_name, loaded_runners[source_name]), source_name)()
+        print(f"\033[32m\nFinished ETL for {source_name}.\033[0m")
+
+        if declaration is not None and fingerprint is not None:
+            manifest.record(f'runner/{source_name}', fingerprint, declaration['outputs'])
+
+    # run the source runners as soon as their dependencies have finished
+    errors: list[tuple[str, BaseException]] = []
+    try:
+        with stage('pipeline') as pipeline_record:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                running: dict[Future[None], str] = {}
+
+                while sorter.is_active() and not errors:
+                    for source_name in sorter.get_ready():
+                        will_run = source_name in etls if etls else True
+
+                        # if the source is not in the list of ETLs to run, skip it
+                        if not will_run:
+                            print(f"Skipping ETL for {source_name}...")
+                            sorter.done(source_name)
+                            continue
+
+                        running[executor.submit(run, source_name)] = source_name
+
+                    # skipped source runners may have made other source runners ready
+                    if not running:
+                        continue
+
+                    finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        source_name = running.pop(future)
+                        error = future.exception()
+                        if error is not None:
+                            print(f"\033[31mError running ETL for {source_name}: {error}\033[0m")
+                            errors.append((source_name, error))
+                        else:
+                            sorter.done(source_name)
+
+                # do not start anything new after a failure, but let the running source runners finish
+                if errors and running:
+                    print(f"Waiting for {len(running)} running source runner(s) to finish before stopping...")
+                    for future in wait(running).done:
+                        error = future.exception()
+                        if error is not None:
+                            source_name = running[future]
+                            print(f"\033[31mError running ETL for {source_name}: {error}\033[0m")
+                            errors.append((source_name, error))
+
+            if errors:
+                pipeline_record.status = 'error'
+    finally:
+        report_path = write_run_report()
+        if report_path is not None:
+            print(f"\nRun report written to {report_path}")
+
+    if errors:
+        raise errors[0][1]
+
+
+def runner_fingerprint(manifest: BuildManifest, source_name: str, declaration: BuildDeclaration) -> str:
+    """
+    Compute the build manifest fingerprint of a source runner from its
+    declared inputs and parameters and its code.
+    """
+    return manifest.fingerprint(
+        inputs=declaration['inputs'],
+        parameters={name: os.getenv(name) for name in declaration['parameters']},
+        code=source_code_paths(source_name),
+    )
 
-        # if the source is not in the list of ETLs to run, skip it
-        if not will_run:
-            print(f"Skipping ETL for {source_name}...")
-            continue
-
-        # run the source runner
-        print(f"\033[32m\nRunning ETL for {source_name}...\033[0m")
-        try:
-            with_restart_when_stalled(runner_func)()
-        except Exception as e:
-            print(f"\033[31mError running ETL for {source_name}: {e}\033[0m")
-            raise
 
+def measured(source_name: str, func: Callable[[], object]) -> Callable[[], None]:
+    """
+    Wraps a source runner so that it is measured as a stage of the run report.
 
-def with_restart_when_stalled(func):
+    The stage is opened inside of the function (instead of around it) so that it
+    measures the process that runs the source runner rather than the process
+    that waits for it.
     """
-    Decorator to restart the ETL process if it stalls for more than 8 minutes.
+    def wrapper() -> None:
+        with stage(source_name):
+            func()
+    return wrapper
 
-    Monitors the log file directory for activity. If the file has not written
-    anything for 5 minutes, show a notice. If it has been another 3 minutes since
-    the notice, restart the ETL process.
 
-    The log files are expected to be in the ./data/logs directory. The most recent
-    directory is monitored for activity, not a specific log file.
+def with_restart_when_stalled(func, name: Optional[str] = None):
+    """
+    Decorator to restart the ETL process if it stops making progress.
+
+    The ETL process sends heartbeats to a watchdog when it enters or leaves a stage
+    of the run report and when it reports progress (units done out of the total) from
+    long loops. The watchdog decides how long a stage may go without progress from
+    the progress rate so far and the duration of the stage in the previous run
+    report (see `etl.heartbeat.StallWatchdog`). When that time passes, a notice is
+    shown. If there is still no progress after a few more minutes, the ETL process
+    and all of its child processes are terminated and the ETL process is restarted.
+
+    A restarted ETL process resumes from its last checkpoint: work that already
+    finished is recorded in the build manifest (and in the caches and markers
+    written by each stage), so it is skipped instead of being done again.
+
+    @param func: The ETL process to run.
+    @param name: The name of the ETL process to show in messages.
     """
 
     import multiprocessing
+    import signal
     import threading
     import time
     import traceback
-    from pathlib import Path
+
+    from etl.heartbeat import StallWatchdog, connect, create_channel, descendant_pids
+    from etl.run_report import load_stage_durations
 
     class ProcessManager:
         """
@@ -127,9 +428,11 @@ def with_restart_when_stalled(func):
         It allows starting, stopping, and checking the status of the process.
         """
 
-        def __init__(self):
+        def __init__(self, channel):
             self.process = None
             self.attempts = 0
+            self.channel = channel
+            self.stalled = False
 
         def is_alive(self):
             return self.process is not None and self.process.is_alive()
@@ -138,16 +441,30 @@ def with_restart_when_stalled(func):
             if self.process is not None:
                 pid = self.process.pid
                 print(f'{' ' * indent}◘Terminating process with PID: {pid}')
+
+                # child processes (e.g., dask workers) are not terminated with their
+                # parent, so terminate them first so that they do not keep running
+                if pid is not None:
+                    for descendant_pid in reversed(descendant_pids(pid)):
+                        try:
+                            os.kill(descendant_pid, signal.SIGTERM)
+                        except ProcessLookupError:
+                            pass
+
                 self.process.terminate()
                 self.process.join()
                 self.process = None
-                print(f'{' ' * indent}Process terminated (PID: ${pid}).')
+                print(f'{' ' * indent}Process terminated (PID: {pid}).')
 
         def start(self):
             if self.process:
                 print('Process already exists. Try terminating it first.')
 
-            self.process = multiprocessing.Process(target=func)
+            def target():
+                connect(self.channel)
+                func()
+
+            self.process = multiprocessing.Process(target=target)
             self.process.start()
 
         def join(self):
@@ -161,14 +478,19 @@ def with_restart_when_stalled(func):
             while self.attempts < 5:
                 if self.process:
                     self.attempts += 1
-                    self.process.join()
+                    process = self.process
+                    process.join()
+
+                    # the process was terminated by the stall monitor, which restarts it
+                    if self.stalled:
+                        break
 
                     # if the process exited successfully, break the loop
-                    if self.process.exitcode == 0:
+                    if process.exitcode == 0:
                         break
 
                     # the process failed with an error; try it again (up to 5 times)
-                    print(f'\033[31m\n\nProcess exited with code {self.process.exitcode}.\033[0m')
+                    print(f'\033[31m\n\nProcess exited with code {process.exitcode}.\033[0m')
                     if self.attempts < 5:
                         print(f'\033[33m  Terminating...\033[0m')
                         time.sleep(1)
@@ -181,69 +503,61 @@ def with_restart_when_stalled(func):
                     else:
                         print('\033[41m\033[37mMaximum attempts reached. Not restarting.\033[0m')
                         raise RuntimeError(
-                            f'Process exited with non-zero exit code: {self.process.exitcode}.')
+                            f'Process exited with non-zero exit code: {process.exitcode}.')
 
                 else:
                     print('No process to join.')
                     break
 
     def wrapper():
-        log_dir = Path("./data/logs")
-        if not log_dir.exists():
-            print('Log directory does not exist. Cannot monitor for stalling.')
-            func()
-            return
+        # heartbeats are read often so that the channel never fills up,
+        # but the stall is only decided when the allowance has passed
+        check_interval = 5  # seconds
+        restart_threshold = 180  # 3 more minutes after the notice
 
-        log_files = list(log_dir.glob('*.log'))
-        if not log_files:
-            print('No log files found in the log directory. Cannot monitor for stalling.')
-            func()
-            return
-
-        log_file = max(log_files, key=lambda f: f.stat().st_mtime)
-
-        check_interval = 60  # seconds
-        inactive_threshold = 300  # 5 minutes
-        restart_threshold = 180  # 3 more minutes
-
-        pm = ProcessManager()
-
-        restart_flag = {'value': False}
+        channel = create_channel()
+        watchdog = StallWatchdog(channel, load_stage_durations())
+        pm = ProcessManager(channel)
+        label = f' for {name}' if name else ''
 
-        def monitor_log():
-            nonlocal restart_flag
-            last_modified = log_file.stat().st_mtime
+        def monitor_heartbeats(finished: threading.Event):
             notice_shown = False
 
-            while True:
-                time.sleep(check_interval)
-                current_modified = log_file.stat().st_mtime
+            while not finished.wait(check_interval):
+                watchdog.receive()
+                idle_seconds = watchdog.idle_seconds()
+                allowance = watchdog.allowance()
 
-                if current_modified == last_modified:
-                    if not notice_shown and time.time() - last_modified > inactive_threshold:
-                        print(
-                            f'◘No activity for {inactive_threshold}s. Will restart in {restart_threshold}s if still idle.'
-                        )
-                        notice_shown = True
-                    elif time.time() - last_modified > inactive_threshold + restart_threshold:
-                        print('Restarting ETL process due to inactivity...')
-                        restart_flag['value'] = True
-                        pm.terminate()  # terminate the current process so that the consumer knows it has to restart
-                        break  # exit the loop to end the monitoring thread
-                else:
-                    last_modified = current_modified
+                if idle_seconds <= allowance:
                     notice_shown = False
+                elif not notice_shown:
+                    print(
+                        f'◘No progress{label} in {watchdog.describe()} for {int(idle_seconds)}s. '
+                        f'Will restart in {restart_threshold}s if there is still no progress.'
+                    )
+                    notice_shown = True
+                elif idle_seconds > allowance + restart_threshold:
+                    print(f'Restarting ETL process{label} because it stalled in {watchdog.describe()}...')
+                    pm.stalled = True
+                    pm.terminate()  # terminate the current process so that the consumer knows it has to restart
+                    break  # exit the loop to end the monitoring thread
 
         # keep starting the ETL process until it finishes normally
         while True:
-            restart_flag['value'] = False
+            pm.stalled = False
+            watchdog.reset()
+            finished = threading.Event()
             pm.start()
-            t = threading.Thread(target=monitor_log, daemon=True)
+            t = threading.Thread(target=monitor_heartbeats, args=(finished,), daemon=True)
             t.start()
-            pm.join()  # wait for the process to finish or be terminated
-
-            # if the process was not restarted due to inactivity, break the loop
-            if not restart_flag['value']:
+            try:
+                pm.join()  # wait for the process to finish or be terminated
+            finally:
+                finished.set()
+                t.join()
+
+            # if the process was not restarted due to a stall, break the loop
+            if not pm.stalled:
                 break
 
             # otherwise, wait a few seconds before restarting so that there
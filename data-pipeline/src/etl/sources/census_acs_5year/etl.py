@@ -7,6 +7,7 @@ import pandas
 
 from etl.convert import convert_string_columns_to_numeric
 from etl.downloader import Downloader
+from etl.manifest import BuildManifest, source_code_paths
 from etl.sources.census_acs_5year.constants import (CensusDataTableInfo,
                                                     CensusDataTableName,
                                                     tables)
@@ -23,17 +24,35 @@ class CensusACS5YearEstimatesETL:
     api_key: str = os.getenv('CENSUS_API_KEY') or ''
     time_series_file_path: str
 
+    # whether the table folder already contains the time series for the same
+    # table info, years, and code (from a previous run)
+    is_up_to_date: bool = False
+
     def __init__(self, table: CensusDataTableName):
         self.table = table
         self.table_info = tables[table]
         self.table_folder_path = f'{self.download_directory}/{self.table}'
         self.time_series_file_path = f'{self.table_folder_path}/time_series.json'
+        self.manifest = BuildManifest()
+        self.manifest_key = f'census_acs_5year/{self.table}'
 
     def run(self, years: Optional[list[int]] = None) -> Self:
         if years is None:
             years = self.table_info['years']
         self.years = years
 
+        # the downloaded files are modified in place by prune_tables and
+        # to_time_series, so the whole chain is skipped when the table
+        # was already processed with the same fingerprint
+        self.fingerprint = self.manifest.fingerprint(
+            parameters={'table_info': self.table_info, 'years': self.years, 'api_key': self.api_key},
+            code=source_code_paths('census_acs_5year'),
+        )
+        self.is_up_to_date = self.manifest.is_fresh(self.manifest_key, self.fingerprint)
+        if self.is_up_to_date:
+            print(f"Census data for {self.table} is up to date. Skipping download.")
+            return self
+
         self._download()
         self._get_variable_labels()
 
@@ -140,6 +159,9 @@ class CensusACS5YearEstimatesETL:
         data files unless a path is specified.
         The time series file is named time_series.json by default.
         """
+        if self.is_up_to_date:
+            return self
+
         time_series_file_path = f'{self.table_folder_path}/time_series.json'
 
         with open(time_series_file_path, 'w') as file:
@@ -174,12 +196,18 @@ class CensusACS5YearEstimatesETL:
             file.write(']\n')
 
         print(f"Time series data written to {time_series_file_path}")
+
+        # the time series is the last step for a table, so record that
+        # the table folder is complete
+        self.manifest.record(self.manifest_key, self.fingerprint, [self.table_folder_path])
         return self
 
     def prune_tables(self) -> Self:
         """
         Remove columns except the ones specified in the table info.
         """
+        if self.is_up_to_date:
+            return self
 
         if tables[self.table]['columns'] is None:
             print(f"Table {self.table} has no columns to prune.")
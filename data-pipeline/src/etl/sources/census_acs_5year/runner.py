@@ -4,6 +4,10 @@ from etl.merge import merge_json_array_files
 from etl.sources.census_acs_5year.etl import CensusACS5YearEstimatesETL
 from etl.sources.census_acs_5year.tract_etl import CensusIntersectAreasETL
 
+inputs = ['./input/replica_interest_area_polygons']
+outputs = ['./data/census_acs_5year']
+parameters = ['CENSUS_API_KEY']
+
 
 def source_runner():
     # get Census ACS 5-Year Estimates data
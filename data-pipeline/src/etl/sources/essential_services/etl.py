@@ -7,12 +7,16 @@ from typing import Any, Generator, Iterator, Literal, Self
 
 import geopandas
 import pandas
+import pyarrow.parquet
 import pyogrio
 from pyproj import CRS
 from tqdm import tqdm
 from tqdm.contrib.logging import logging_redirect_tqdm
 
 from etl.geodesic import geodesic_buffer_series
+from etl.planner import PlannedUnit, count_parquet_rows, path_bytes
+from etl.run_report import report_rows, stage
+from etl.sources.replica.transformers.area_index import area_column, area_filters
 
 logger = logging.getLogger('essential_services_etl')
 logger.setLevel(logging.DEBUG)
@@ -177,7 +181,8 @@ class EssentialServicesETL:
             ]
 
             for name, calculation_func in tqdm(access_calculations, desc="Calculating access metrics"):
-                calculation_func(day='thursday')
+                with stage(f'{name}_access'):
+                    calculation_func(day='thursday')
 
             # flatten the stats dictionary to a list of dictionaries for easier processing
             logger.info('Flattening stats dictionary for easier processing...')
@@ -234,39 +239,100 @@ class EssentialServicesETL:
 
             return self
 
+    def plan(self, day: Literal['saturday', 'thursday'] = 'thursday') -> list[PlannedUnit]:
+        """
+        List the units of work that `run` would do without doing them (see
+        `etl.planner`): one for each POI category and area-season of trip data
+        that has POI data in a nearby season. Nothing is cached between runs.
+        """
+        poi_data = {
+            'childcare': self.childcare_data,
+            'grocery_store': self.grocery_store_data,
+            'commercial_zone': self.zoning_data,
+            'dental': self.dental_data,
+            'eye_care': self.eye_care_data,
+            'family_medicine': self.family_medicine_data,
+            'free_clinics': self.free_clinics_data,
+            'hospitals': self.hospitals_data,
+            'internal_medicine': self.internal_medicine_data,
+            'urgent_care': self.urgent_care_data,
+        }
+
+        # the trip files are the same for every category
+        area_seasons: list[tuple[Path, str, list[Path]]] = []
+        for area in self.areas:
+            for season, trip_files in self.get_trip_data(area, day):
+                area_seasons.append((area, season, list(trip_files)))
+
+        units: list[PlannedUnit] = []
+        for name, data_dict in poi_data.items():
+            for area, season, trip_files in area_seasons:
+                closest_poi_season = self.find_closest_season(season, list(data_dict.keys()))
+                if closest_poi_season is None:
+                    continue
+                units.append(PlannedUnit(
+                    stage=f'{name}_access',
+                    unit=f'{name} {area.name} {season} (POI data from {closest_poi_season})',
+                    cached=False,
+                    input_bytes=path_bytes([data_dict[closest_poi_season], *trip_files]),
+                    estimated_rows=count_parquet_rows(trip_files),
+                ))
+        return units
+
     def get_trip_data(self, area: Path, day: Literal['saturday', 'thursday'] = 'thursday', *, season: str | None = None) -> Generator[tuple[str, Iterator[Path]], Any, None]:
         """
         Generator that yields paths to trip data files for a given area and day for each season in the south atlantic region.
+
+        Every area uses the full area trip data files, which flag the trips in each area. Read
+        the files with the filters from `get_trip_filters` to only read the trips in the area.
         """
+        if area.name != 'full_area':
+            for trip_season, trip_files in self.get_trip_data(self.replica_folder / 'full_area', day, season=season):
+                yield (trip_season, self._flagged_trip_files(area, trip_files))
+            return
+
         trip_folder = area / f'{day}_trip'
         if not trip_folder.exists():
             return
 
-        folder_to_iterate_over = trip_folder / '_chunks' if area.name == 'full_area' else trip_folder
-
-        season_folders = [path for path in folder_to_iterate_over.iterdir() if path.is_dir()]
+        season_folders = [path for path in (trip_folder / '_chunks').iterdir() if path.is_dir()]
         seasons = [path.name.replace(f'_{day}_trip', '')[-7:len(path.name)]
                    for path in season_folders]
 
-        if area.name == 'full_area':
-            if season is not None:
-                yield (season, (area / f'{day}_trip' / '_chunks' / ('south_atlantic_' + season + f'_{day}_trip')).glob('*.parquet'))
-
-            else:
-                for season in seasons:
-                    season_parquet_files = (
-                        area / f'{day}_trip' / '_chunks' / ('south_atlantic_' + season + f'_{day}_trip')).glob('*.parquet')
-                    yield (season, season_parquet_files)
-
         if season is not None:
-            yield (season, (area / f'{day}_trip' / ('south_atlantic_' + season) / '_chunks').glob('*.parquet'))
+            yield (season, (area / f'{day}_trip' / '_chunks' / ('south_atlantic_' + season + f'_{day}_trip')).glob('*.parquet'))
 
         else:
             for season in seasons:
                 season_parquet_files = (
-                    area / f'{day}_trip' / ('south_atlantic_' + season) / '_chunks').glob('*.parquet')
+                    area / f'{day}_trip' / '_chunks' / ('south_atlantic_' + season + f'_{day}_trip')).glob('*.parquet')
                 yield (season, season_parquet_files)
 
+    def _flagged_trip_files(self, area: Path, trip_files: Iterator[Path]) -> Iterator[Path]:
+        """
+        Check that each full area trip data file flags the trips in an area.
+
+        Raises:
+            ValueError: If a file does not have the area's column, which means that the
+                replica processing has not flagged the trips of the area in it yet (e.g.,
+                after a download-only run). Skipping the file would silently leave out its trips.
+        """
+        column = area_column(area.name)
+        for path in trip_files:
+            if column not in pyarrow.parquet.read_schema(path).names:
+                logger.error(f'Trip data file {path} does not flag the trips in {area.name}.')
+                raise ValueError(
+                    f"Trip data file {path} has no '{column}' column. Run the replica processing "
+                    f"(phase 2) for the current areas before running the essential services ETL.")
+            yield path
+
+    def get_trip_filters(self, area: Path) -> list[tuple[str, str, Any]]:
+        """
+        Get the Parquet filters that select the trips in an area from the files
+        from `get_trip_data` (none for the full area).
+        """
+        return area_filters(area.name) or []
+
     def get_synthetic_population_data(self, area: Path, location: Literal['home', 'school', 'work'], *, season: str | None = None) -> Generator[tuple[str, Path], Any, None]:
         """
         Generator that yields paths to trip data files for a given area and day for each season in the south atlantic region.
@@ -472,9 +538,10 @@ class EssentialServicesETL:
 
                 # count the time taken for each public transit trip to a POI
                 for trip_file in trip_files:
+                    report_rows(rows_in=count_parquet_rows([trip_file]))
                     dest_columns = ['mode', 'travel_purpose', 'duration_minutes']
                     dest_gdf = read_as_point_geometry(trip_file, xy_columns=(
-                        'end_lng', 'end_lat'), xy_crs='EPSG:4326', columns=dest_columns, filters=[('mode', '==', 'PUBLIC_TRANSIT')])
+                        'end_lng', 'end_lat'), xy_crs='EPSG:4326', columns=dest_columns, filters=[('mode', '==', 'PUBLIC_TRANSIT'), *self.get_trip_filters(area)])
 
                     # TODO: move this logic to the ETL where it is first downloaded
                     dest_gdf['mode'] = dest_gdf['mode'].astype('category')
@@ -1,7 +1,14 @@
 from etl.sources.essential_services.etl import EssentialServicesETL
 
-after = ['greenlink_gtfs', 'geocoder']
+after = ['greenlink_gtfs', 'geocoder', 'replica', 'passthrough']
+inputs = ['./data/replica', './data/greenlink_gtfs', './data/geocoded', './input/zoning']
+outputs = ['./data/essential_services']
+parameters = ['INCLUDE_FULL_AREA_IN_AREAS']
 
 
 def source_runner():
     EssentialServicesETL().run()
+
+
+def source_plan():
+    return EssentialServicesETL().plan()
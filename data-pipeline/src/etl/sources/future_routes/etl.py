@@ -10,9 +10,14 @@ import dask.dataframe
 import geopandas
 import pandas
 import pyogrio
+import shapely
 import tqdm
+from shapely.geometry.base import BaseGeometry
 
 from etl.geodesic import geodesic_area_series, geodesic_length_series
+from etl.geometry_cache import dissolved_geometry, prepared_union
+from etl.planner import PlannedUnit, count_parquet_rows, path_bytes
+from etl.run_report import instrument, report_rows, stage
 from etl.sources.replica.process_etl import (
     Season, count_destination_building_use_in_service_area,
     count_destination_building_use_in_service_area_by_tour_type,
@@ -90,20 +95,23 @@ class FutureRoutesETL:
 
             stats: dict[str, Any] = {}
 
-            # find convertable trips for the scenario
-            stats['possible_conversions'] = self.find_convertable_trips(
-                scenario_folder, day='thursday')
+            with stage(scenario_folder.name):
+                report_rows(rows_in=count_parquet_rows([self.trips_chunks_folder('thursday')]))
 
-            # find travel methods, median commute time, and destination building use for trips in the scenario
-            trip_stats = self.calculate_trip_statistics(
-                day='thursday', scenario_input_folder=scenario_folder)
-            for key, value in trip_stats.items():
-                stats[key] = value
+                # find convertable trips for the scenario
+                stats['possible_conversions'] = self.find_convertable_trips(
+                    scenario_folder, day='thursday')
 
-            # measure coverage for the scenario
-            coverage_stats = self.measure_coverage(scenario_input_folder=scenario_folder)
-            for key, value in coverage_stats.items():
-                stats[key] = value
+                # find travel methods, median commute time, and destination building use for trips in the scenario
+                trip_stats = self.calculate_trip_statistics(
+                    day='thursday', scenario_input_folder=scenario_folder)
+                for key, value in trip_stats.items():
+                    stats[key] = value
+
+                # measure coverage for the scenario
+                coverage_stats = self.measure_coverage(scenario_input_folder=scenario_folder)
+                for key, value in coverage_stats.items():
+                    stats[key] = value
 
             # copy all input files to the output folder
             for file in scenario_folder.glob('*.geojson'):
@@ -121,6 +129,30 @@ class FutureRoutesETL:
 
         return self
 
+    def plan(self) -> list[PlannedUnit]:
+        """
+        List the units of work that `run` would do without doing them (see
+        `etl.planner`): one for each valid scenario. Nothing is cached between runs.
+        """
+        if not self.input_folder.exists():
+            return []
+
+        trips_chunks_folder_path = self.trips_chunks_folder('thursday')
+        input_bytes = path_bytes([trips_chunks_folder_path])
+        estimated_rows = count_parquet_rows([trips_chunks_folder_path])
+        return [
+            PlannedUnit(stage=scenario_folder.name, unit=scenario_folder.name, cached=False,
+                        input_bytes=input_bytes + path_bytes([scenario_folder]), estimated_rows=estimated_rows)
+            for scenario_folder in self.validate_scenarios()
+        ]
+
+    def trips_chunks_folder(self, day: Literal['saturday', 'thursday']) -> Path:
+        """
+        Get the folder containing the unfiltered trip chunks for the season.
+        """
+        season_str = f'{self.season['region']}_{self.season["year"]}_{self.season["quarter"]}'
+        return self.replica_output_folder / 'full_area' / f'{day}_trip' / '_chunks' / f'{season_str}_{day}_trip'
+
     def validate_scenarios(self) -> list[Path]:
         """
         Validates the scenarios by checking if the required files exist.
@@ -150,33 +182,32 @@ class FutureRoutesETL:
                         f'No GeoJSON files found in {scenario_folder.name}. Skipping this scenario.')
         return valid_scenarios
 
+    @instrument('find_convertable_trips')
     def find_convertable_trips(self, scenario_input_folder: Path, day: Literal['saturday', 'thursday']) -> dict[str, int]:
         walk_service_area_path = scenario_input_folder / self.required_scenario_files['walkshed']
         bike_service_area_path = scenario_input_folder / self.required_scenario_files['bikeshed']
-        season_str = f'{self.season['region']}_{self.season["year"]}_{self.season["quarter"]}'
 
         if not walk_service_area_path.exists() or not bike_service_area_path.exists():
             logger.warning(
                 f'Missing walk or bike service area files in {scenario_input_folder.name}. Skipping trip conversion.')
             return {}
 
-        scenario_route_walk_service_area = geopandas.read_file(
-            walk_service_area_path, columns=['geometry'])
-        overall_walk_service_area = geopandas.read_file(
-            self.overall_walk_service_area_path, columns=['geometry'])
-        walk_service_area = cast(geopandas.GeoDataFrame, pandas.concat(
-            [scenario_route_walk_service_area, overall_walk_service_area]))
-        # walk_service_area.geometry = geodesic_buffer_series(walk_service_area.geometry, 1000)
-
-        scenario_bike_service_area = geopandas.read_file(
-            bike_service_area_path, columns=['geometry'])
-        overall_bike_service_area = geopandas.read_file(
-            self.overall_bike_service_area_path, columns=['geometry'])
-        bike_service_area = cast(geopandas.GeoDataFrame, pandas.concat(
-            [scenario_bike_service_area, overall_bike_service_area]))
-
-        trips_chunks_folder_path = self.replica_output_folder / 'full_area' / \
-            f'{day}_trip' / '_chunks' / f'{season_str}_{day}_trip'
+        # dissolve and prepare the service areas once instead of for every chunk (the overall
+        # service areas are cached on their own so that they are only dissolved once across
+        # scenarios, and each scenario only adds its own service area to them)
+        scenario_route_walk_service_area = dissolved_geometry(walk_service_area_path, crs='EPSG:4326')
+        walk_service_area = prepared_union(shapely.union_all([
+            scenario_route_walk_service_area,
+            dissolved_geometry(self.overall_walk_service_area_path, crs='EPSG:4326'),
+        ]))
+
+        scenario_bike_service_area = dissolved_geometry(bike_service_area_path, crs='EPSG:4326')
+        bike_service_area = prepared_union(shapely.union_all([
+            scenario_bike_service_area,
+            dissolved_geometry(self.overall_bike_service_area_path, crs='EPSG:4326'),
+        ]))
+
+        trips_chunks_folder_path = self.trips_chunks_folder(day)
         chunk_paths = list(sorted(trips_chunks_folder_path.glob('*.parquet')))
 
         count_bar = tqdm.tqdm(
@@ -205,7 +236,7 @@ class FutureRoutesETL:
             output_walk_convertable_trips_path.parent.mkdir(parents=True, exist_ok=True)
             output_bike_convertable_trips_path.parent.mkdir(parents=True, exist_ok=True)
 
-            def count(scenario_route_service_area: geopandas.GeoDataFrame, full_network_service_area: geopandas.GeoDataFrame, output_file_path: Path) -> int:
+            def count(scenario_route_service_area: BaseGeometry, full_network_service_area: BaseGeometry, output_file_path: Path) -> int:
 
                 # get the trips that start in the new service area
                 start_points = geopandas.points_from_xy(
@@ -213,13 +244,13 @@ class FutureRoutesETL:
                 start_gdf = geopandas.GeoDataFrame(
                     area_convertable_df, geometry=start_points, crs='EPSG:4326')
                 trips_starting_in_scenario_gdf = start_gdf[start_gdf.geometry.intersects(
-                    scenario_route_service_area.union_all())]
+                    scenario_route_service_area)]
 
                 # filter the start trips to only include those that also end in the combined, full service area
                 start_point_destinations = geopandas.points_from_xy(
                     trips_starting_in_scenario_gdf['end_lng'], trips_starting_in_scenario_gdf['end_lat'], crs='EPSG:4326')
                 trips_starting_in_scenario_and_ending_in_whole_service_area_gdf = trips_starting_in_scenario_gdf[start_point_destinations.intersects(
-                    full_network_service_area.union_all())]
+                    full_network_service_area)]
 
                 # get the trips that end in the new service area
                 end_points = geopandas.points_from_xy(
@@ -227,13 +258,13 @@ class FutureRoutesETL:
                 end_gdf = geopandas.GeoDataFrame(
                     area_convertable_df, geometry=end_points, crs='EPSG:4326')
                 trips_ending_in_scenario_gdf = end_gdf[end_gdf.geometry.intersects(
-                    scenario_route_service_area.union_all())]
+                    scenario_route_service_area)]
 
                 # filter the start trips to only include those that also start in the combined, full service area
                 end_point_origins = geopandas.points_from_xy(
                     trips_ending_in_scenario_gdf['start_lng'], trips_ending_in_scenario_gdf['start_lat'], crs='EPSG:4326')
                 trips_ending_in_scenario_and_starting_in_whole_service_area_gdf = trips_ending_in_scenario_gdf[end_point_origins.intersects(
-                    full_network_service_area.union_all())]
+                    full_network_service_area)]
 
                 # get the union of the two sets of trips with duplicate activity_ids removed
                 walk_convertable_gdf = cast(geopandas.GeoDataFrame, pandas.concat(
@@ -274,28 +305,17 @@ class FutureRoutesETL:
 
         count_bar.close()
 
-        del scenario_route_walk_service_area
-        del scenario_bike_service_area
-        del overall_walk_service_area
-        del overall_bike_service_area
-
         return {
             'via_walk': walk_sum,
             'via_bike': bike_sum,
         }
 
+    @instrument('calculate_trip_statistics')
     def calculate_trip_statistics(self, day: Literal['saturday', 'thursday'], scenario_input_folder: Path) -> dict[str, Any]:
         walk_service_area_path = scenario_input_folder / self.required_scenario_files['walkshed']
         bike_service_area_path = scenario_input_folder / self.required_scenario_files['bikeshed']
-        season_str = f'{self.season['region']}_{self.season["year"]}_{self.season["quarter"]}'
 
-        full_area_gdf = geopandas.read_file(
-            './input/replica_interest_area_polygons/full_area.geojson', columns=['geometry']).dissolve()
-        walk_gdf = geopandas.read_file(walk_service_area_path, columns=['geometry'])
-        bike_gdf = geopandas.read_file(bike_service_area_path, columns=['geometry'])
-
-        trips_chunks_folder_path = self.replica_output_folder / 'full_area' / \
-            f'{day}_trip' / '_chunks' / f'{season_str}_{day}_trip'
+        trips_chunks_folder_path = self.trips_chunks_folder(day)
         trips_chunks_ddf = cast(dask.dataframe.DataFrame,
                                 dask.dataframe.read_parquet(trips_chunks_folder_path, columns=['tour_type', 'mode', 'duration_minutes', 'destination_building_use_l1', 'destination_building_use_l2', 'end_lng', 'end_lat']))
         logger.debug(f'Computing DataFrame...')
@@ -324,17 +344,22 @@ class FutureRoutesETL:
                 f'Missing walk or bike service area files in {scenario_input_folder.name}. Skipping building use analysis.')
             return statistics
 
+        full_area = dissolved_geometry('./input/replica_interest_area_polygons/full_area.geojson')
+        walk_service_area = dissolved_geometry(walk_service_area_path)
+        bike_service_area = dissolved_geometry(bike_service_area_path)
+
         # get destination building uses for all trips
         logger.debug('    Counting destination building uses...')
         statistics['destination_building_use'] = count_destination_building_use_in_service_area(
-            trips_df, crs, full_area_gdf, walk_gdf, bike_gdf)
+            trips_df, crs, full_area, walk_service_area, bike_service_area)
 
         # get desintation building use by tour type for all trips
         statistics['destination_building_use__by_tour_type'] = count_destination_building_use_in_service_area_by_tour_type(
-            trips_df, crs, full_area_gdf, walk_gdf, bike_gdf)
+            trips_df, crs, full_area, walk_service_area, bike_service_area)
 
         return statistics
 
+    @instrument('measure_coverage')
     def measure_coverage(self, scenario_input_folder: Path) -> dict[str, Any]:
         walk_service_area_path = scenario_input_folder / self.required_scenario_files['walkshed']
         bike_service_area_path = scenario_input_folder / self.required_scenario_files['bikeshed']
@@ -346,6 +371,8 @@ class FutureRoutesETL:
             f'Reading service areas from {walk_service_area_path} and {bike_service_area_path}...')
         walk_gdf = geopandas.read_file(walk_service_area_path, columns=['geometry'])
         bike_gdf = geopandas.read_file(bike_service_area_path, columns=['geometry'])
+        walk_service_area = dissolved_geometry(walk_service_area_path)
+        bike_service_area = dissolved_geometry(bike_service_area_path)
 
         # get the total bounds for the walk and bike service areas
         logger.debug('Calculating total bounds for service areas...')
@@ -358,8 +385,9 @@ class FutureRoutesETL:
             max(walk_bounds[3], bike_bounds[3])
         ]
 
+        # the geometry of the population download is the home location
         population_home_path = self.replica_output_folder / \
-            'full_area' / 'population' / f'{season_str}_home.parquet'
+            'full_area' / 'population' / f'{season_str}.parquet'
         logger.debug(
             f'Reading population home data from {population_home_path} with bbox {total_bounds}...')
         population_home_gdf = geopandas.read_parquet(
@@ -375,20 +403,23 @@ class FutureRoutesETL:
         # count households and population covered by the service areas (home-based)
         logger.debug('Counting households and population in future service areas...')
 
+        is_in_walk_service_area = population_home_gdf.intersects(walk_service_area)
+        is_in_bike_service_area = population_home_gdf.intersects(bike_service_area)
+
         statistics['synthetic_demographics']['households_in_service_area'] = {}
         statistics['synthetic_demographics']['households_in_service_area']['walk'] = population_home_gdf[
-            population_home_gdf.intersects(walk_gdf.union_all())
+            is_in_walk_service_area
         ]['household_id'].nunique()
         statistics['synthetic_demographics']['households_in_service_area']['bike'] = population_home_gdf[
-            population_home_gdf.intersects(bike_gdf.union_all())
+            is_in_bike_service_area
         ]['household_id'].nunique()
 
         statistics['synthetic_demographics']['population_in_service_area'] = {}
         statistics['synthetic_demographics']['population_in_service_area']['walk'] = population_home_gdf[
-            population_home_gdf.intersects(walk_gdf.union_all())
+            is_in_walk_service_area
         ]['person_id'].nunique()
         statistics['synthetic_demographics']['population_in_service_area']['bike'] = population_home_gdf[
-            population_home_gdf.intersects(bike_gdf.union_all())
+            is_in_bike_service_area
         ]['person_id'].nunique()
 
         # calculate the distance of the routes in meters
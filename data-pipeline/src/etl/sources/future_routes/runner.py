@@ -4,8 +4,15 @@ from pathlib import Path
 
 from etl.sources.future_routes.etl import FutureRoutesETL
 
-after = ['replica', 'greenlink_gtfs']
+after = ['replica', 'greenlink_gtfs', 'passthrough']
+inputs = ['./data/replica/full_area', './data/greenlink_gtfs', './input/future_routes',
+          './input/replica_interest_area_polygons/full_area.geojson']
+outputs = ['./data/future_routes']
 
 
 def source_runner():
     FutureRoutesETL().run()
+
+
+def source_plan():
+    return FutureRoutesETL().plan()
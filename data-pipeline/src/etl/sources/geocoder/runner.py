@@ -1,5 +1,8 @@
 from .etl import GeocoderETL
 
+inputs = ['./input/to_geocode']
+outputs = ['./data/geocoded']
+
 def source_runner():
     geocoder = GeocoderETL()
     success = geocoder.run()
@@ -1,3 +1,4 @@
+import json
 import os
 import shutil
 from pathlib import Path
@@ -11,6 +12,7 @@ from shapely import LineString
 from etl.downloader import Downloader
 from etl.geodesic import (geodesic_area_series, geodesic_buffer_series,
                           geodesic_length_series)
+from etl.manifest import BuildManifest, source_code_paths
 
 type Quarter = Literal['Q2', 'Q4']
 type Season = tuple[int, Quarter]
@@ -36,6 +38,12 @@ class GreenlinkGtfsETL:
     # so the next available season can be used instead
     pending_substitutions: list[Season] = []
 
+    # the files that remain in a season's folder after the GTFS feed
+    # is downloaded and converted
+    feed_file_names = ['stops.geojson', 'shapes.geojson', 'routes.geojson', 'stop_times.csv']
+    service_area_file_names = ['walk_service_area.geojson',
+                               'bike_service_area.geojson', 'paratransit_service_area.geojson']
+
     def __init__(self, seasons: Optional[list[Season]] = None, area_geojson_paths: Optional[list[str] | list[Path]] = None):
         """
         Initialize the GreentlinkGtfsETL with the seasons to process.
@@ -74,14 +82,18 @@ class GreenlinkGtfsETL:
         # create folder if it does not exist
         os.makedirs(self.folder_path, exist_ok=True)
 
+        self.manifest = BuildManifest()
+        self.code_paths = source_code_paths('greenlink_gtfs')
+
     def run(self, transitland_api_key: Optional[str] = None) -> None:
         last_already_existed = False
         for season in self.seasons:
             year, quarter = season
             folder_path = f'{self.folder_path}/{year}/{quarter}'
 
-            # only download if the folder does not already exist
-            if os.path.exists(folder_path):
+            # only download if the feed for this season has not already been
+            # downloaded and converted (and has not been modified since)
+            if self._feed_is_complete(season):
                 if not last_already_existed:
                     print('')
                 print(
@@ -89,6 +101,25 @@ class GreenlinkGtfsETL:
                 last_already_existed = True
                 continue
 
+            # keep feed files that were modified since they were downloaded (e.g., corrected by hand)
+            feed_file_paths = self._feed_file_paths(season)
+            if all(os.path.exists(path) for path in feed_file_paths):
+                print(f"\nWarning: the GTFS data for {year} {quarter} changed since it was downloaded. "
+                      f"Keeping the changed files. Delete {folder_path} to download it again.")
+                self._record_feed(season)
+                last_already_existed = False
+                continue
+
+            # the live feed only has the current season, so an incomplete historical
+            # season can only be downloaded again from Transitland
+            if os.path.exists(folder_path) and not transitland_api_key:
+                missing_file_names = [os.path.basename(path) for path in feed_file_paths if not os.path.exists(path)]
+                print(f"\nWarning: the GTFS data for {year} {quarter} is missing {', '.join(missing_file_names)}, "
+                      "but it cannot be downloaded again without a Transitland API key. Skipping download.")
+                last_already_existed = False
+                continue
+
+            # (the download replaces the remains of an incomplete download or conversion)
             print(f"\nDownloading GTFS data for {year} {quarter}...")
             last_already_existed = False
             should_continue_parsing = self.download(
@@ -100,6 +131,7 @@ class GreenlinkGtfsETL:
             # convert the GTFS data
             self.to_csv(season)
             self.convert_to_geojson(season)
+            self._record_feed(season)
 
             # if there are any pending substitutions, copy the result for this
             # season to the pending seasons
@@ -111,20 +143,56 @@ class GreenlinkGtfsETL:
                         os.makedirs(pending_folder_parent_path, exist_ok=True)
                     # copy the current season's folder to the pending season's folder
                     pending_folder_path = f'{pending_folder_parent_path}/{pending_quarter}'
+                    if os.path.exists(pending_folder_path):
+                        shutil.rmtree(pending_folder_path)
                     shutil.copytree(folder_path, pending_folder_path)
+                    self._record_feed(pending_season)
                 # clear the pending substitutions list
                 self.pending_substitutions.clear()
 
         # generate service areas
         print("\nGenerating service areas...")
         for season in self.seasons:
+            year, quarter = season
+            inputs = self._service_area_input_paths(season)
+            fingerprint = self.manifest.fingerprint(inputs=inputs, code=self.code_paths)
+            key = f'greenlink_gtfs/service_areas/{year}_{quarter}'
+            if self.manifest.is_fresh(key, fingerprint):
+                print(f"Service areas for {year} {quarter} are up to date.")
+                continue
+
             self.generate_service_areas(season)
+            self.manifest.record(key, fingerprint, [
+                f'{self.folder_path}/{year}/{quarter}/{file_name}' for file_name in self.service_area_file_names
+            ])
 
         # calculate service distance and coverage stats
         print("\nCalculating service coverage stats...")
         service_coverage_stats = []
         for season in self.seasons:
+            year, quarter = season
+            season_folder_path = f'{self.folder_path}/{year}/{quarter}'
+            inputs = [
+                f'{season_folder_path}/{file_name}'
+                for file_name in ['routes.geojson', 'stops.geojson', *self.service_area_file_names]
+            ] + [area_geojson_path for area_geojson_path, _ in self.areas]
+            fingerprint = self.manifest.fingerprint(
+                inputs=inputs,
+                parameters={'areas': [area_name for _, area_name in self.areas]},
+                code=self.code_paths
+            )
+            key = f'greenlink_gtfs/service_coverage/{year}_{quarter}'
+            cache_path = f'{season_folder_path}/service_coverage_stats.json.tmp'
+            if self.manifest.is_fresh(key, fingerprint):
+                print(f"Service coverage stats for {year} {quarter} are up to date.")
+                with open(cache_path, 'r') as file:
+                    service_coverage_stats += json.load(file)
+                continue
+
             stats = self.calculate_service_coverage(season)
+            with open(cache_path, 'w') as file:
+                json.dump(stats, file)
+            self.manifest.record(key, fingerprint, [cache_path])
             service_coverage_stats += stats
 
         # save the service coverage stats to a json file
@@ -132,6 +200,47 @@ class GreenlinkGtfsETL:
         pandas.DataFrame(service_coverage_stats)\
             .to_json(stats_file_path, orient='records')
 
+    def _feed_is_complete(self, season: Season) -> bool:
+        """
+        Whether the GTFS feed for the season has already been downloaded and
+        converted and has not been modified since.
+
+        Seasons that were downloaded before the build manifest existed have
+        no record. They are accepted as long as all of the converted feed
+        files exist so that historical feeds are not downloaded again.
+        """
+        year, quarter = season
+        key = f'greenlink_gtfs/feed/{year}_{quarter}'
+        fingerprint = self.manifest.fingerprint(parameters={'season': season})
+        if self.manifest.is_fresh(key, fingerprint):
+            return True
+
+        feed_file_paths = self._feed_file_paths(season)
+        if not self.manifest.has_record(key) and all(os.path.exists(path) for path in feed_file_paths):
+            self._record_feed(season)
+            return True
+
+        return False
+
+    def _record_feed(self, season: Season) -> None:
+        year, quarter = season
+        fingerprint = self.manifest.fingerprint(parameters={'season': season})
+        self.manifest.record(f'greenlink_gtfs/feed/{year}_{quarter}',
+                             fingerprint, self._feed_file_paths(season))
+
+    def _feed_file_paths(self, season: Season) -> list[str]:
+        year, quarter = season
+        return [f'{self.folder_path}/{year}/{quarter}/{file_name}' for file_name in self.feed_file_names]
+
+    def _service_area_input_paths(self, season: Season) -> list[str]:
+        year, quarter = season
+        return [
+            f'{self.folder_path}/{year}/{quarter}/stops.geojson',
+            f'{self.folder_path}/{year}/{quarter}/routes.geojson',
+            f'{self.service_area_overrides_folder}/walkshed_{year}_{quarter}.geojson',
+            f'{self.service_area_overrides_folder}/bikeshed_{year}_{quarter}.geojson',
+        ]
+
     def download(self, season: Season, transitland_api_key: Optional[str] = None) -> bool:
         year, quarter = season
         folder_path = f'{self.folder_path}/{year}/{quarter}'
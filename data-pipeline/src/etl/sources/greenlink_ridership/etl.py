@@ -5,6 +5,8 @@ from typing import Self
 import geopandas
 import pandas
 
+from etl.geometry_cache import dissolved_geometry
+
 
 class GreenlinkRidershipETL:
     input_folder = Path('./input/greenlink_ridership')
@@ -172,11 +174,12 @@ class GreenlinkRidershipETL:
 
             # Assign an area's name to each stop that falls within the area's polygon
             for polygon_file in area_polygon_files:
-                area_gdf = geopandas.read_file(polygon_file)
+                # The dissolved area is cached, so it is only read once for every season
+                area_polygon = dissolved_geometry(polygon_file)
 
                 # Read the stops geojson and filter it to the polygon area
                 stops_gdf = geopandas.read_file(stops_path)
-                area_stops_mask = stops_gdf.within(area_gdf.union_all())
+                area_stops_mask = stops_gdf.within(area_polygon)
                 area_stops_gdf = stops_gdf[area_stops_mask]
 
                 # Identify the stops ids in the polygon area and save the area's name to the
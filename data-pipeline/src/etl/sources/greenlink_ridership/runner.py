@@ -1,6 +1,8 @@
 from .etl import GreenlinkRidershipETL
 
-after = ['greenlink_gtfs']
+after = ['greenlink_gtfs', 'passthrough']
+inputs = ['./input/greenlink_ridership', './data/greenlink_gtfs', './input/replica_interest_area_polygons']
+outputs = ['./data/greenlink_ridership']
 
 
 def source_runner():
@@ -1,12 +1,62 @@
+import os
 import shutil
 
+# the copied files replace the files with the same path in the output folder, so the source
+# runners that wrote to it before this one in the original run order must finish first
+# (and the others run after it)
+after = ['census_acs_5year', 'geocoder', 'greenlink_gtfs']
+inputs = ['./input/passthrough_data']
+outputs = ['./data/passthrough_files.txt']
+
+input_folder = './input/passthrough_data'
+output_folder = './data'
+
+# the files that were copied by the last run (relative to the output folder), so that
+# files that have been removed from the input folder can be removed from the output folder
+copied_files_path = './data/passthrough_files.txt'
+
+# files and folders in the output folder that hold the pipeline's own state, which must survive
+# from one run to the next (e.g., so that interrupted downloads resume), so they are never replaced
+# (the logs folder also holds the log and run report of the run that is in progress)
+pipeline_state_paths = ['./data/build_manifest.sqlite', './data/checkpoints.sqlite', './data/logs']
+
+
+def is_pipeline_state(relative_path: str) -> bool:
+    output_path = os.path.normpath(os.path.join(output_folder, relative_path))
+    return any(
+        output_path == os.path.normpath(state_path)
+        or output_path.startswith(os.path.normpath(state_path) + os.sep)
+        for state_path in pipeline_state_paths
+    )
+
 
 def source_runner():
-    input_folder = './input/passthrough_data'
-    output_folder = './data'
+    # only replace the files that this runner copies instead of clearing the output folder,
+    # which also holds the outputs of the other source runners and the pipeline's own state
+    # (e.g., the build manifest)
+    relative_paths = sorted(
+        os.path.relpath(os.path.join(root, name), input_folder)
+        for root, _, names in os.walk(input_folder)
+        for name in names
+    )
+    for relative_path in [path for path in relative_paths if is_pipeline_state(path)]:
+        print(f"Warning: skipping {relative_path} because it would replace the pipeline's own state.")
+        relative_paths.remove(relative_path)
 
-    # clear existing output folder contents
-    shutil.rmtree(output_folder, ignore_errors=True)
+    # remove the files that the last run copied but that are no longer in the input folder
+    if os.path.exists(copied_files_path):
+        with open(copied_files_path, 'r') as file:
+            previous_paths = file.read().splitlines()
+        for relative_path in set(previous_paths).difference(relative_paths):
+            output_path = os.path.join(output_folder, relative_path)
+            if os.path.isfile(output_path):
+                os.remove(output_path)
 
     # copy the input/passthrough_data folder contents to the output folder
-    shutil.copytree(input_folder, output_folder, dirs_exist_ok=True)
+    for relative_path in relative_paths:
+        output_path = os.path.join(output_folder, relative_path)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        shutil.copy2(os.path.join(input_folder, relative_path), output_path)
+
+    with open(copied_files_path, 'w') as file:
+        file.write('\n'.join(relative_paths))
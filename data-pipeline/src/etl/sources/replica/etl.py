@@ -1,33 +1,55 @@
+import functools
 import gc
+import hashlib
 import json
 import logging
-import multiprocessing
+import math
 import os
 import re
 import shutil
 import time
-from concurrent.futures import Future, ThreadPoolExecutor
+import traceback
+from concurrent.futures import (FIRST_COMPLETED, Future, ThreadPoolExecutor,
+                                as_completed, wait)
 from pathlib import Path
-from typing import Any, Literal, Optional, cast
+from typing import TYPE_CHECKING, Any, Literal, Optional, cast
 
 import dask.dataframe
 import geopandas
-import numpy
 import pandas
 import pandas_gbq
 import polars
+import pyarrow
+import pyarrow.parquet
 import shapely
 import shapely.wkt
+from shapely.geometry.base import BaseGeometry
 from tqdm import tqdm
 from tqdm.contrib.logging import logging_redirect_tqdm
 
+from etl.checkpoints import CheckpointStore, partial_path, replace_with_partial
+from etl.memory_budget import reserve_memory
+from etl.planner import PlannedUnit
+from etl.worker_pool import WorkerPool
+from etl.run_report import current_stage, instrument, report_progress, stage
+from etl.sources.replica.readers.arrow_batches import (
+    ArrowBatchReader, BigQueryStorageReader, encode_id_lists, is_id_list, stream_to_parquet, unify_id_lists,
+    with_geometry)
 from etl.sources.replica.readers.partitions_to_gdf import partitions_to_gdf
 from etl.sources.replica.transformers.as_points import as_points
 from etl.sources.replica.transformers.count_segment_frequency import \
     count_segment_frequency
+from etl.sources.replica.transformers.deduplicate_by_key import \
+    deduplicate_by_key
+from etl.sources.replica.transformers.network_segment_store import \
+    NetworkSegmentStore
+from etl.sources.replica.transformers.optimize_query_polygons import \
+    optimize_query_polygons
 from etl.sources.replica.transformers.to_vector_tiles import to_vector_tiles
-from etl.sources.replica.transformers.trips_as_lines import (
-    create_network_segments_lookup, trips_as_lines)
+from etl.sources.replica.transformers.trips_as_lines import trips_as_lines
+
+if TYPE_CHECKING:
+    from etl.sources.replica.process_etl import ReplicaProcessETL, Season
 
 gbq_logger = logging.getLogger('pandas_gbq')
 gbq_logger.setLevel(logging.INFO)
@@ -37,6 +59,36 @@ logger = logging.getLogger('replica_etl')
 logger.setLevel(logging.DEBUG)
 
 
+def use_bigquery_credentials(credentials: Any) -> None:
+    """Use the given credentials for BigQuery queries in this process (e.g., a worker process)."""
+    if credentials is not None:
+        pandas_gbq.context.credentials = credentials
+
+
+def save_trip_lines(trips_gdf: geopandas.GeoDataFrame, output_path: str) -> None:
+    """Save a chunk of trip lines, writing to a partial file first so that an interrupted write does not leave a corrupt chunk."""
+    has_bbox_column = 'bbox' in trips_gdf.columns
+    trips_gdf.to_parquet(partial_path(output_path), write_covering_bbox=not has_bbox_column,
+                         geometry_encoding='WKB', schema_version='1.1.0', compression='snappy')
+    replace_with_partial(output_path)
+
+
+def form_trip_lines_chunk(trips_df: pandas.DataFrame, store_folder: str, output_path: str) -> int:
+    """
+    Form the trip lines for a chunk of trips and save them. Runs in a worker
+    process (see `ReplicaETL._form_trip_lines_in_workers`).
+
+    Returns:
+        The number of trips in the chunk.
+    """
+    # the store is memory-mapped, so every worker shares the same copy of the segments
+    store = NetworkSegmentStore.open(store_folder)
+    with tqdm(total=len(trips_df), disable=True) as bar:
+        trips_gdf = trips_as_lines(trips_df, store, 'EPSG:4326', bar)
+    save_trip_lines(trips_gdf, output_path)
+    return len(trips_gdf)
+
+
 class ReplicaETL:
     project_id = 'replica-customer'
     region = 'south_atlantic'
@@ -47,6 +99,64 @@ class ReplicaETL:
     use_bqstorage_api = os.getenv('USE_BIGQUERY_STORAGE_API', '0') == '1'
     include_full_area_in_areas = os.getenv('INCLUDE_FULL_AREA_IN_AREAS', '0') == '1'
 
+    # the memory to reserve for a BigQuery download that has not been measured in a previous
+    # run (pandas_gbq turns ~4 GB of uncompressed data into ~35 GB of RAM usage)
+    query_process_memory = '35G'
+
+    # stream downloads from the BigQuery Storage Read API as Arrow record batches straight into
+    # parquet files instead of building pandas DataFrames with pandas_gbq, which keeps the memory
+    # of each download bounded so that downloads do not need their own processes
+    # (requires the google-cloud-bigquery-storage package and permission to create read sessions)
+    stream_downloads = os.getenv('REPLICA_STREAM_DOWNLOADS', '0') == '1'
+
+    # the number of rows in each parquet row group written by a streamed download
+    # (about one row group is held in memory at a time)
+    download_batch_rows = int(os.getenv('REPLICA_DOWNLOAD_BATCH_ROWS', '250000'))
+
+    # the memory to reserve for a streamed download that has not been measured in a previous run
+    stream_query_memory = '4G'
+
+    # download each trip table by selecting the trips in the area once on the server and then
+    # downloading the selected trips in evenly sized shards (by a hash of activity_id) in parallel
+    # instead of running a query for each group of area polygons
+    sharded_extraction = os.getenv('REPLICA_SHARDED_EXTRACTION', '0') == '1'
+
+    # the number of rows to aim for in each shard and the number of shards to download at the same time
+    shard_target_rows = int(os.getenv('REPLICA_SHARD_TARGET_ROWS', '2000000'))
+    shard_concurrency = int(os.getenv('REPLICA_SHARD_CONCURRENCY', '4'))
+
+    # the number of worker processes that form trip lines at the same time (if 1, they are formed
+    # in the process that downloads the trips) and the number of chunks that may be in memory at once
+    trip_line_workers = int(os.getenv('REPLICA_TRIP_LINE_WORKERS', '1'))
+    trip_line_chunks_in_flight = int(os.getenv('REPLICA_TRIP_LINE_CHUNKS_IN_FLIGHT',
+                                               str(2 * int(os.getenv('REPLICA_TRIP_LINE_WORKERS', '1')))))
+
+    # merge, simplify, and sort the interest area polygons before they are used in queries so that the
+    # queries are shorter and faster (see `optimize_query_polygons`); the polygons are buffered outward
+    # by the tolerance so that they still cover everything that the original polygons cover
+    optimize_query_geometry = os.getenv('REPLICA_OPTIMIZE_QUERY_GEOMETRY', '0') == '1'
+    query_geometry_tolerance_meters = float(os.getenv('REPLICA_QUERY_GEOMETRY_TOLERANCE_METERS', '25'))
+
+    # trip columns that are lists of ids and the type of their ids, which are stored as lists instead of
+    # comma-separated strings (network link ids are stable edge ids, which are stored as integers when
+    # every id of a download is an integer and as dictionary-encoded strings otherwise; see `encode_id_lists`)
+    trips_id_list_columns = {'transit_route_ids': pyarrow.string(), 'network_link_ids': pyarrow.int64()}
+
+    # only download the network segments that the downloaded trips use (the segments
+    # tables cover the whole region) instead of every segment (see `_download_referenced_network_segments`)
+    segments_semi_join = os.getenv('REPLICA_SEGMENTS_SEMI_JOIN', '0') == '1'
+
+    # the number of segment ids to send in each query of a semi-join download
+    segment_ids_per_query = 50000
+
+    # reads the results of queries for streamed downloads (replace with a `LocalArrowReader`
+    # to run the download path without BigQuery); if None, a `BigQueryStorageReader` is used
+    batch_reader: Optional[ArrowBatchReader] = None
+
+    # the number of BigQuery downloads a worker process runs before it is replaced
+    # (pandas_gbq never releases its memory until the process exits)
+    query_worker_max_tasks = int(os.getenv('REPLICA_QUERY_WORKER_MAX_TASKS', '1'))
+
     years_filter: Optional[list[int]] = None
     quarters_filter: Optional[list[Literal['Q2', 'Q4']]] = None
 
@@ -67,6 +177,10 @@ class ReplicaETL:
         if not os.path.exists(self.folder_path):
             os.makedirs(self.folder_path)
 
+        # completed downloads and chunks are recorded here so that
+        # interrupted runs can resume where they left off
+        self.checkpoints = CheckpointStore()
+
         # get the schema for the replica dataset
         self.tables_to_download_df = self.query_schema(years, quarters)
 
@@ -134,97 +248,142 @@ class ReplicaETL:
             print(f"\n\nSuccessfully downloaded data for {area_name}.")
 
         if mode == 'process':
-            # determine the requested seasons
-            # (get a dataframe of each unique set of region, year, and quarter)
-            seasons = self.infer_schema(self.years_filter, self.quarters_filter).drop(
-                columns=['table_name', 'dataset']).drop_duplicates().reset_index(drop=True)
-
-            # require that the expected parquet files exist
-            expected_parquet_files = self._getExpectedParquetFilePaths()
-            for season in seasons.itertuples():
-                for expected_filename_template in expected_parquet_files:
-                    expected_filename = expected_filename_template.format(
-                        region=season.region, year=season.year, quarter=season.quarter)
-                    full_expected_path = os.path.join(
-                        self.folder_path, expected_filename)
-                    if not os.path.exists(full_expected_path):
-                        raise FileNotFoundError(
-                            f"Expected output file {full_expected_path} does not exist. Please run in 'download' mode first.")
-
-            # get all geojson file names from the input folder
-            # so we can filter/process the full_area data to each geojson file extent
-            input_filenames = os.listdir(self.input_folder_path)
-            geojson_filenames = list(sorted([
-                filename for filename in input_filenames if filename.endswith('.geojson') and filename != full_area_filename
-            ]))
-            geojson_filepaths = [
-                os.path.join(self.input_folder_path, filename) for filename in geojson_filenames]
-
-            # import locally so that it does not cause circular import issues
-            from etl.sources.replica.process_etl import (ReplicaProcessETL,
-                                                         Season)
-
-            # reformat seasons to a list of Season dictionaries
-            seasons_dicts: list[Season] = []
-            for season in seasons.itertuples():
-                seasons_dicts.append(Season(
-                    region=str(season.region),
-                    year=int(str(season.year)),
-                    quarter=str(season.quarter),
-                ))
-            seasons_dicts = sorted(
-                seasons_dicts,
-                key=lambda s: (s['region'], s['year'], int(s['quarter'].strip("Q")))
-            )
+            seasons = self._process_seasons()
 
-            # if the full_area should be included, add it to the area paths
-            if self.include_full_area_in_areas:
-                geojson_filepaths.append(full_area_path)
+            # require that every dataset has been downloaded
+            for season_name, dataset in self._missing_downloads(seasons):
+                raise FileNotFoundError(
+                    f"Expected {dataset} data for {season_name} has not been downloaded. Please run in 'download' mode first.")
 
             # process the data for each season and area
-            ReplicaProcessETL(
-                self,
-                seasons_dicts,
-                geojson_filepaths,
-                {
-                    'population_home': expected_parquet_files[1],
-                    'population_school': expected_parquet_files[2],
-                    'population_work': expected_parquet_files[3],
-                    'bike_service_area': os.path.join(
-                        self.greenlink_gtfs_folder_path,
-                        '{year}/{quarter}/bike_service_area.geojson',
-                    ),
-                    'walk_service_area': os.path.join(
-                        self.greenlink_gtfs_folder_path,
-                        '{year}/{quarter}/walk_service_area.geojson',
-                    ),
-                    'thursday_trip': (Path(os.path.join(
-                        expected_parquet_files[4]
-                    )).parent / '_chunks' / '{region}_{year}_{quarter}_thursday_trip').as_posix(),
-                    'saturday_trip': '',  # saturday trip data is not currently processed
-                    # 'saturday_trip':  (Path(os.path.join(
-                    #     expected_parquet_files[5]
-                    # )).parent / '_chunks' / '{region}_{year}_{quarter}_saturday_trip').as_posix(),
-                },
-                days=['thursday']
-            ).process()
+            self._create_process_etl(seasons).process()
+
+    def plan(self) -> list['PlannedUnit']:
+        """
+        List the units of work that process mode would do without doing them
+        (see `etl.planner`). Downloads that are missing are listed first.
+        """
+        seasons = self._process_seasons()
+        units = [
+            PlannedUnit(stage='download', unit=f'download {dataset} {season_name}', cached=False,
+                        input_bytes=0, estimated_rows=None)
+            for season_name, dataset in self._missing_downloads(seasons)
+        ]
+
+        process_etl = self._create_process_etl(seasons)
+        return units + process_etl.plan_network_segments(process_etl.days)
+
+    def _process_seasons(self) -> list['Season']:
+        """Get the seasons to process (the downloaded seasons that match the season filters)."""
+        # import locally so that it does not cause circular import issues
+        from etl.sources.replica.process_etl import Season
+
+        # get a dataframe of each unique set of region, year, and quarter
+        seasons = self.infer_schema(self.years_filter, self.quarters_filter).drop(
+            columns=['table_name', 'dataset']).drop_duplicates().reset_index(drop=True)
+
+        # reformat seasons to a list of Season dictionaries
+        seasons_dicts: list[Season] = []
+        for season in seasons.itertuples():
+            seasons_dicts.append(Season(
+                region=str(season.region),
+                year=int(str(season.year)),
+                quarter=str(season.quarter),
+            ))
+        return sorted(
+            seasons_dicts,
+            key=lambda s: (s['region'], s['year'], int(s['quarter'].strip("Q")))
+        )
+
+    def _missing_downloads(self, seasons: list['Season']) -> list[tuple[str, str]]:
+        """Get the (season name, dataset) pairs that have not been completely downloaded for the seasons."""
+        missing: list[tuple[str, str]] = []
+        for season in seasons:
+            season_name = f"{season['region']}_{season['year']}_{season['quarter']}"
+            for dataset in self._downloaded_datasets():
+                checkpoint = self.checkpoints.get(f'download/{dataset}', season=season_name, area='full_area')
+                # a download of only the segments that some trips use is not enough without `segments_semi_join`
+                if checkpoint is None or (dataset == 'network_segments' and checkpoint['tag'] == 'referenced'
+                                          and not self.segments_semi_join):
+                    missing.append((season_name, dataset))
+        return missing
+
+    def _create_process_etl(self, seasons: list['Season']) -> 'ReplicaProcessETL':
+        """Create the ETL that filters the full_area data to each area of interest and processes it."""
+        # import locally so that it does not cause circular import issues
+        from etl.sources.replica.process_etl import ReplicaProcessETL
+
+        full_area_filename = 'full_area.geojson'
+        full_area_path = os.path.join(
+            self.input_folder_path, full_area_filename)
+
+        # get all geojson file names from the input folder
+        # so we can filter/process the full_area data to each geojson file extent
+        input_filenames = os.listdir(self.input_folder_path)
+        geojson_filenames = list(sorted([
+            filename for filename in input_filenames if filename.endswith('.geojson') and filename != full_area_filename
+        ]))
+        geojson_filepaths = [
+            os.path.join(self.input_folder_path, filename) for filename in geojson_filenames]
+
+        # if the full_area should be included, add it to the area paths
+        if self.include_full_area_in_areas:
+            geojson_filepaths.append(full_area_path)
+
+        expected_parquet_files = self._getExpectedParquetFilePaths()
+        return ReplicaProcessETL(
+            self,
+            seasons,
+            geojson_filepaths,
+            {
+                'population': expected_parquet_files[1],
+                'bike_service_area': os.path.join(
+                    self.greenlink_gtfs_folder_path,
+                    '{year}/{quarter}/bike_service_area.geojson',
+                ),
+                'walk_service_area': os.path.join(
+                    self.greenlink_gtfs_folder_path,
+                    '{year}/{quarter}/walk_service_area.geojson',
+                ),
+                'thursday_trip': expected_parquet_files[2],
+                'saturday_trip': '',  # saturday trip data is not currently processed
+                # 'saturday_trip': expected_parquet_files[3],
+            },
+            days=['thursday']
+        )
 
     def _getExpectedParquetFilePaths(self) -> list[str]:
         """Get the expected parquet file paths for the replica data.
 
+        The trip data are a folder of parquet chunks. The geometry of the population
+        data is the home location (the work and school locations are coordinate columns).
+
         Returns:
             list[str]: A list of expected parquet file paths.
         """
         expected_parquet_files = [
             'full_area/network_segments/{region}_{year}_{quarter}.parquet',
-            'full_area/population/{region}_{year}_{quarter}_home.parquet',
-            'full_area/population/{region}_{year}_{quarter}_school.parquet',
-            'full_area/population/{region}_{year}_{quarter}_work.parquet',
-            'full_area/thursday_trip/{region}_{year}_{quarter}.success',
-            # 'full_area/saturday_trip/{region}_{year}_{quarter}.success',
+            'full_area/population/{region}_{year}_{quarter}.parquet',
+            'full_area/thursday_trip/_chunks/{region}_{year}_{quarter}_thursday_trip',
+            # 'full_area/saturday_trip/_chunks/{region}_{year}_{quarter}_saturday_trip',
         ]
         return expected_parquet_files
 
+    def _downloaded_datasets(self) -> list[str]:
+        """Get the names of the datasets that are downloaded for each season (e.g., `population`)."""
+        return list(dict.fromkeys(
+            template.split('/')[1] for template in self._getExpectedParquetFilePaths()
+        ))
+
+    def _download_output_paths(self, region: str, year: int | str, quarter: str, dataset: str) -> list[str]:
+        """Get the paths to the downloaded files for a dataset in a season."""
+        return [
+            os.path.join(self.folder_path, template.format(region=region, year=year, quarter=quarter))
+            for template in self._getExpectedParquetFilePaths()
+            if template.split('/')[1] == dataset
+        ]
+
+    @instrument('download_network_segments')
     def _run_for_network_segments(self, area_name: str) -> None:
         """Loop through network segments tables and run queries to get the data.
 
@@ -242,21 +401,97 @@ class ReplicaETL:
         if schema_df is None or schema_df.empty:
             return
 
+        # when only the segments that the trips use are downloaded, they are downloaded
+        # with the trips (unless the trips of the season are not being downloaded)
+        if self.segments_semi_join:
+            trip_seasons = self.tables_to_download_df[self.tables_to_download_df['table_name'].str.endswith(
+                'trip')][['year', 'quarter']].astype(str).agg('_'.join, axis=1)
+            schema_df = schema_df[~schema_df[['year', 'quarter']].astype(str).agg(
+                '_'.join, axis=1).isin(trip_seasons)]
+            if schema_df.empty:
+                print('\nThe network segments will be downloaded with the trips that use them.')
+                return
+
+        results_count = 0
+        with self._query_worker_pool() as pool:
+            for season in schema_df.itertuples():
+                # run in a separate process because pandas_gbq uses a rediculous amount of RAM and
+                # never releases it unless the process is killed (~4 GB uncompressed data becomes
+                # ~35 GB RAM usage), so wait until that much memory is available
+                # (streamed downloads use bounded memory, so they run in this process)
+                table_name = str(season.table_name)
+                with reserve_memory(table_name, default=self._query_memory()):
+                    try:
+                        run = self._download_network_segments if self.stream_downloads else \
+                            functools.partial(pool.run, self._download_network_segments)
+                        run(area_name, table_name, f'{self.region}_{season.year}_{season.quarter}')
+                    except Exception as error:
+                        print(f'Process for {table_name} failed: {error!r}')
+                        traceback.print_exception(error)
+                results_count += 1
+
+        print(
+            f"\nSuccessfully obtained data from {results_count} network segments table{'' if results_count == 1 else 's'}.")
+
+    def _query_memory(self) -> str:
+        """The memory to reserve for a download that has not been measured in a previous run."""
+        return self.stream_query_memory if self.stream_downloads else self.query_process_memory
+
+    def _batch_reader(self) -> ArrowBatchReader:
+        """The reader for streamed downloads (see `stream_downloads`)."""
+        if self.batch_reader is not None:
+            return self.batch_reader
+        return BigQueryStorageReader(self.project_id, pandas_gbq.context.credentials)
+
+    def _query_worker_pool(self) -> WorkerPool:
+        """A worker pool for BigQuery downloads that uses the same credentials as this process."""
+        return WorkerPool(
+            max_tasks_per_worker=self.query_worker_max_tasks,
+            initializer=use_bigquery_credentials,
+            initargs=(pandas_gbq.context.credentials,),
+        )
+
+    def _download_network_segments(self, area_name: str, table_name: str, season_name: str) -> None:
+        """Download a network segments table and save it for the area.
+
+        Runs in a worker pool process (see `_run_for_network_segments`).
+        """
         # check if the etl is running in GitHub Actions
         is_running_in_workflow = os.getenv('IS_GH_WORKFLOW', 'false').lower() == 'true'
 
-        def get_segments(table_name: str) -> None:
-            # Set full_table_path be equal to the table_name column in the schema_df
-            full_table_path = f"{self.project_id}.{self.region}.{table_name}"
+        # Set full_table_path be equal to the table_name column in the schema_df
+        full_table_path = f"{self.project_id}.{self.region}.{table_name}"
 
+        with stage(table_name) as record:
             print(f'\nRunning query for {full_table_path}...')
 
+            # run query to get network segments table
+            segments_query = f'''
+            SELECT stableEdgeId, streetName, geometry, osmid FROM {full_table_path};
+            '''
+
+            if self.stream_downloads and not is_running_in_workflow:
+                # convert the WKT geometry of each row group as it is written
+                output_path = self._output_path(area_name, table_name, 'network_segments') + '.parquet'
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                record.rows_out = stream_to_parquet(
+                    self._batch_reader().read_batches(segments_query),
+                    {output_path: lambda table: with_geometry(
+                        table.drop_columns(['geometry']),
+                        shapely.from_wkt(table.column('geometry').to_numpy(zero_copy_only=False), on_invalid='ignore'),
+                        geometry_types=[],
+                    )},
+                    batch_rows=self.download_batch_rows,
+                    empty_schema=pyarrow.schema([('stableEdgeId', pyarrow.string()), ('streetName', pyarrow.string()),
+                                                 ('geometry', pyarrow.string()), ('osmid', pyarrow.int64())]),
+                )
+                self.checkpoints.commit('download/network_segments', season=season_name,
+                                        area=area_name, outputs=[output_path])
+                print(f"\nSuccessfully obtained data from {full_table_path}.")
+                return
+
             segments_gdf: geopandas.GeoDataFrame | None = None
             if not is_running_in_workflow:
-                # run query to get network segments table
-                segments_query = f'''
-                SELECT stableEdgeId, streetName, geometry, osmid FROM {full_table_path};
-                '''
                 with logging_redirect_tqdm():
                     segments_df = pandas_gbq.read_gbq(
                         segments_query,
@@ -287,33 +522,21 @@ class ReplicaETL:
                 )
 
             # save to file
+            record.rows_out = len(segments_gdf)
             print(f'  Saving...')
-            self._save(
+            output_paths = self._save(
                 segments_gdf,
                 area_name,
                 table_name,
                 'network_segments',
                 'geoparquet'
             )
+            self.checkpoints.commit('download/network_segments', season=season_name,
+                                    area=area_name, outputs=output_paths)
 
             print(f"\nSuccessfully obtained data from {full_table_path}.")
 
-        results_count = 0
-        for season in schema_df.itertuples():
-            # run in a separate process because pandas_gbq uses a rediculous amount of RAM and
-            # never releases it unless the process is killed (~4 GB uncompressed data becomes
-            # ~35 GB RAM usage)
-            process = multiprocessing.Process(target=get_segments, args=(season.table_name,))
-            process.start()
-            process.join()  # wait for the process to finish
-            if process.exitcode != 0:
-                print(f'Process for {season.table_name} exited with code {process.exitcode}.')
-            process.close()
-            results_count += 1
-
-        print(
-            f"\nSuccessfully obtained data from {results_count} network segments table{'' if results_count == 1 else 's'}.")
-
+    @instrument('download_population')
     def _run_for_pop_(self, gdf: geopandas.GeoDataFrame, area_name: str) -> list[pandas.DataFrame]:
         """Loop through population tables and run queries to get the data.
 
@@ -334,69 +557,87 @@ class ReplicaETL:
         if schema_df is None or schema_df.empty:
             return result_dfs
 
-        for table_name in schema_df['table_name']:
-            # Set full_table_path be equal to the table_name column in the schema_df
-            full_table_path = f"{self.project_id}.{self.region}.{table_name}"
+        for season in schema_df.itertuples():
+            table_name = str(season.table_name)
+            with reserve_memory(table_name, default=self._query_memory()), stage(table_name) as record:
+                # Set full_table_path be equal to the table_name column in the schema_df
+                full_table_path = f"{self.project_id}.{self.region}.{table_name}"
 
-            print(f'Running query for {full_table_path}...')
-            geoseries = geopandas.GeoSeries(gdf['geometry'], crs="EPSG:4326")
-            query_geometry = self._prepare_query_geometry(geoseries)
+                print(f'Running query for {full_table_path}...')
+                geoseries = self._query_polygons(geopandas.GeoSeries(gdf['geometry'], crs="EPSG:4326"))
+                query_geometry = self._prepare_query_geometry(geoseries)
 
-            # skip when the query geometry is empty
-            if query_geometry is None:
-                continue
+                # skip when the query geometry is empty
+                if query_geometry is None:
+                    continue
 
-            # Run query to get netowrk segments tables
-            pop_query = f'''
-            SELECT * FROM {full_table_path} AS pop
-            WHERE EXISTS( -- ensure that the subquery returns at least one row
-                SELECT 1 -- check for at least one row that satisifes the spatial condition (stop after 1 row for efficiency)
-                FROM {query_geometry}
-                WHERE
-                    ST_COVERS(query_geometry, ST_GEOGPOINT(pop.lng, pop.lat))
-            );
-            '''
-            with logging_redirect_tqdm():
-                population_df = pandas_gbq.read_gbq(
-                    pop_query,
-                    project_id=self.project_id,
-                    dialect='standard',
-                    use_bqstorage_api=self.use_bqstorage_api
-                )
-            if population_df is None:
-                population_df = pandas.DataFrame()
-            result_dfs.append(population_df)
-
-            # for each case, convert the lat-lng to a geometry column
-            # and save to file
-            population_cases = [
-                ['home', 'lat', 'lng'],
-                ['work', 'lat_work', 'lng_work'],
-                ['school', 'lat_school', 'lng_school'],
-            ]
-            for [case, lat_column, lng_column] in population_cases:
-                print(
-                    f'Converting geoemtry for population {case} coordinates...')
+                # Run query to get netowrk segments tables
+                pop_query = f'''
+                SELECT * FROM {full_table_path} AS pop
+                WHERE EXISTS( -- ensure that the subquery returns at least one row
+                    SELECT 1 -- check for at least one row that satisifes the spatial condition (stop after 1 row for efficiency)
+                    FROM {query_geometry}
+                    WHERE
+                        ST_COVERS(query_geometry, ST_GEOGPOINT(pop.lng, pop.lat))
+                );
+                '''
+
+                # the home location is saved as the geometry, and the work and school
+                # locations stay as coordinate columns that are converted to points when they are used
+                # (instead of saving every column again for each location)
+                if self.stream_downloads:
+                    # write the file as each row group arrives (the results are not returned)
+                    output_path = self._output_path(area_name, table_name, 'population') + '.parquet'
+                    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                    record.rows_out = stream_to_parquet(
+                        self._batch_reader().read_batches(pop_query),
+                        {output_path: lambda table: with_geometry(table, shapely.points(
+                            table.column('lng').to_numpy(zero_copy_only=False),
+                            table.column('lat').to_numpy(zero_copy_only=False),
+                        ), geometry_types=['Point'])},
+                        batch_rows=self.download_batch_rows,
+                    )
+                    self.checkpoints.commit('download/population', season=f'{self.region}_{season.year}_{season.quarter}',
+                                            area=area_name, outputs=[output_path])
+                    print(f"\nSuccessfully obtained data from {full_table_path}.")
+                    continue
+
+                with logging_redirect_tqdm():
+                    population_df = pandas_gbq.read_gbq(
+                        pop_query,
+                        project_id=self.project_id,
+                        dialect='standard',
+                        use_bqstorage_api=self.use_bqstorage_api
+                    )
+                if population_df is None:
+                    population_df = pandas.DataFrame()
+                result_dfs.append(population_df)
+                record.rows_out = len(population_df)
+
+                print(f'Converting geoemtry for population home coordinates...')
                 population_gdf = geopandas.GeoDataFrame(
                     population_df,
-                    geometry=geopandas.points_from_xy(
-                        population_df[lng_column], population_df[lat_column]),
+                    geometry=geopandas.points_from_xy(population_df['lng'], population_df['lat']),
                     crs="EPSG:4326"
                 )
 
-                print(f'Saving geometry for population ({case})...')
-                self._save(
+                print(f'Saving population...')
+                output_paths = self._save(
                     population_gdf,
                     area_name,
-                    table_name + case,
+                    table_name,
                     'population',
                     'geoparquet'
                 )
 
-            print(f"\nSuccessfully obtained data from {full_table_path}.")
+                self.checkpoints.commit('download/population', season=f'{self.region}_{season.year}_{season.quarter}',
+                                        area=area_name, outputs=output_paths)
+
+                print(f"\nSuccessfully obtained data from {full_table_path}.")
 
         return result_dfs
 
+    @instrument('download_trips')
     def _run_for_trips(self, gdf: geopandas.GeoDataFrame, area_name: str) -> None:
         """Loop through trip tables and run queries to get the data. This gets trip data for thursday and saturday trips.
 
@@ -417,9 +658,33 @@ class ReplicaETL:
         if schema_df is None or schema_df.empty:
             return
 
-        def get_trips() -> None:
-            table_name = str(season.table_name)
+        # loop through each trip dataset in the schema_df
+        # and download it in a worker process that is replaced
+        # afterwards so that any holds on memory that python creates
+        # are released (downloading and processing trip data is memory
+        # intensive and pandas_gbq appears hold on to memory)
+        with self._query_worker_pool() as pool:
+            for season in schema_df.itertuples():
+                table_name = str(season.table_name)
+                with reserve_memory(table_name, default=self.query_process_memory):
+                    try:
+                        pool.run(self._download_trips, gdf, area_name, table_name,
+                                 int(str(season.year)), str(season.quarter))
+                    except Exception as error:
+                        print(f'Process for {table_name} failed: {error!r}')
+                        traceback.print_exception(error)
+                results_count += 1
 
+        print(
+            f"\nSuccessfully obtained data from {results_count} trip tables.")
+
+    def _download_trips(self, gdf: geopandas.GeoDataFrame, area_name: str, table_name: str,
+                        year: int, quarter: str) -> None:
+        """Download a trip table, form the trip lines, and save them in chunks for the area.
+
+        Runs in a worker pool process (see `_run_for_trips`).
+        """
+        with stage(table_name) as record:
             # Set full_table_path be equal to the table_name column in the schema_df
             full_table_path = f"{self.project_id}.{self.region}.{table_name}"
             # Determine which columns to use based on the table name
@@ -433,7 +698,8 @@ class ReplicaETL:
                 origin_lat_col = "start_lat"
                 dest_lng_col = "end_lng"
                 dest_lat_col = "end_lat"
-            table_ddf = self._run_with_queue(
+            run_queries = self._run_sharded if self.sharded_extraction else self._run_with_queue
+            table_ddf = run_queries(
                 gdf, full_table_path=full_table_path,
                 origin_lng_col=origin_lng_col, origin_lat_col=origin_lat_col,
                 dest_lng_col=dest_lng_col, dest_lat_col=dest_lat_col
@@ -441,7 +707,7 @@ class ReplicaETL:
             table_partitions = table_ddf.to_delayed()
             print('Obtained data for table:', table_name)
 
-            network_segments_lookup: dict[str, shapely.LineString] | None = None
+            network_segments_lookup: NetworkSegmentStore | None = None
 
             # Determine trip type (e.g., thursday_trip, saturday_trip) from table_name
             # this regex will match the trip type
@@ -460,113 +726,323 @@ class ReplicaETL:
             )
             os.makedirs(output_folder, exist_ok=True)
 
-            def save_geodataframe(trips_gdf: geopandas.GeoDataFrame, output_path: str) -> None:
-                has_bbox_column = 'bbox' in gdf.columns
-                trips_gdf.to_parquet(output_path, write_covering_bbox=not has_bbox_column,
-                                     geometry_encoding='WKB', schema_version='1.1.0', compression='snappy')
-                # tqdm.write(f'  Saved chunk to {output_path}')
-
             print(f'Forming trip lines for {table_name}...')
             chunk_count = len(table_partitions)
             features_to_process = table_ddf.shape[0].compute()
+            record.rows_in = features_to_process
             bar = tqdm(
                 total=features_to_process,
                 desc=f'Forming trip lines for {table_name}',
                 unit="features"
             )
-            with logging_redirect_tqdm(), ThreadPoolExecutor(max_workers=1) as executor:
-                futures: list[Future[None]] = []
+            if self.trip_line_workers > 1:
+                if self.segments_semi_join:
+                    self._download_referenced_network_segments(table_ddf, year, quarter)
+                self._network_segment_store(year, quarter)
+                with logging_redirect_tqdm():
+                    record.add_rows_out(self._form_trip_lines_in_workers(
+                        table_partitions, table_name, self._network_segment_store_path(year, quarter),
+                        output_folder, bar))
+                bar.close()
+            else:
+                with logging_redirect_tqdm(), ThreadPoolExecutor(max_workers=1) as executor:
+                    futures: list[Future[None]] = []
+
+                    for chunk_index, delayed_partition in enumerate(table_partitions):
+                        chunk_index = chunk_index + 1  # start chunk index from 1 for more friendly output
+
+                        # convert the partition to a DataFrame
+                        bar.write(f'  Converting chunk {chunk_index}/{chunk_count} to DataFrame...')
+                        table_df = self._prepare_trips_chunk(delayed_partition.compute(), table_name)
+
+                        if network_segments_lookup is None:
+                            bar.write(f'  Opening the network segments...')
+                            if self.segments_semi_join:
+                                self._download_referenced_network_segments(table_ddf, year, quarter)
+                            network_segments_lookup = self._network_segment_store(year, quarter)
+
+                        bar.write(f'  Processing chunk {chunk_index}/{chunk_count}...')
+                        trips_gdf = trips_as_lines(table_df, network_segments_lookup, 'EPSG:4326', bar)
+                        record.add_rows_out(len(trips_gdf))
+                        report_progress(chunk_index, chunk_count)
+                        del table_df
+                        gc.collect()
+
+                        # bar.write(
+                        #     f'  Saving {trip_type} data for {table_name} chunk {chunk_index}/{chunk_count} in the background...')
+
+                        # Define the output path
+                        output_path = os.path.join(output_folder, f'chunk_{chunk_index}.parquet')
+
+                        # Save the GeoDataFrame to a parquet file in a separate thread
+                        future = executor.submit(save_trip_lines, trips_gdf, output_path)
+                        futures.append(future)
+
+                        # since the separate thread has its own reference to trips_gdf that it will
+                        # clean up when finished, we can go ahead and delete it here
+                        del trips_gdf
+                        gc.collect()
+
+                    del network_segments_lookup
+                    gc.collect()
+
+                    # wait for all submitted futures to complete saving
+                    for index, future in enumerate(futures):
+                        try:
+                            future.result()  # this will block until the future is completed
+                        except Exception as e:
+                            print(f"Error saving for chunk {index}: {e}")
+                    bar.close()
 
+            # record that the chunks have been successfully created
+            print(f'Flagging {table_name} chunks as complete...')
+            self.checkpoints.commit(f'download/{trip_type}', season=f'{self.region}_{year}_{quarter}',
+                                    area=area_name, outputs=[output_folder])
+
+            print(f'  Finished processing {table_name}.')
+            return None
+
+    @staticmethod
+    def _prepare_trips_chunk(table_df: pandas.DataFrame, table_name: str) -> pandas.DataFrame:
+        """Rename the coordinate columns of a chunk of trips to the names that `trips_as_lines` expects and add its source table."""
+        if 'origin_lng' in table_df.columns:
+            # rename the columns to match the expected columns
+            table_df.rename(columns={
+                'origin_lng': 'start_lng',
+                'origin_lat': 'start_lat',
+                'destination_lng': 'end_lng',
+                'destination_lat': 'end_lat'
+            }, inplace=True)
+
+        if not table_df.empty:
+            # add a source_table column with the table name so we can identify the source of the data
+            table_df['source_table'] = table_name
+        return table_df
+
+    def _form_trip_lines_in_workers(self, table_partitions: list[Any], table_name: str, store_folder: str,
+                                    output_folder: str, bar: tqdm) -> int:
+        """
+        Form the trip lines for each partition in `trip_line_workers` worker
+        processes and save them as `chunk_{index}.parquet` in the output folder.
+
+        The partitions are read in this process while the workers form and save
+        the lines of earlier partitions. At most `trip_line_chunks_in_flight`
+        partitions are read but not yet saved, which bounds the memory used.
+
+        Returns:
+            The number of trips.
+        """
+        chunk_count = len(table_partitions)
+        rows_out = 0
+        completed_count = 0
+        pending: set[Future[int]] = set()
+
+        def wait_for_chunks(max_pending: int) -> None:
+            nonlocal rows_out, completed_count
+            while len(pending) > max_pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.remove(future)
+                    chunk_rows = future.result()  # raises the error if the chunk failed
+                    rows_out += chunk_rows
+                    completed_count += 1
+                    bar.update(chunk_rows)
+                    report_progress(completed_count, chunk_count)
+
+        bar.write(f'  Forming trip lines in {self.trip_line_workers} worker processes...')
+        with WorkerPool(max_workers=self.trip_line_workers) as pool:
+            try:
                 for chunk_index, delayed_partition in enumerate(table_partitions):
                     chunk_index = chunk_index + 1  # start chunk index from 1 for more friendly output
 
-                    # convert the partition to a DataFrame
+                    # wait until there is room for another chunk before reading it
+                    wait_for_chunks(max(1, self.trip_line_chunks_in_flight) - 1)
                     bar.write(f'  Converting chunk {chunk_index}/{chunk_count} to DataFrame...')
-                    table_df: pandas.DataFrame = delayed_partition.compute()
-
-                    if 'origin_lng' in table_df.columns:
-                        # rename the columns to match the expected columns
-                        table_df.rename(columns={
-                            'origin_lng': 'start_lng',
-                            'origin_lat': 'start_lat',
-                            'destination_lng': 'end_lng',
-                            'destination_lat': 'end_lat'
-                        }, inplace=True)
-
-                    if not table_df.empty:
-                        # add a source_table column with the table name so we can identify the source of the data
-                        table_df['source_table'] = table_name
-
-                    if network_segments_lookup is None:
-                        bar.write(
-                            f'  Creating a lookup table for network segments (this may take a while)...')
-                        network_segments_path = os.path.join(
-                            self.folder_path,
-                            f'full_area/network_segments/{self.region}_{season.year}_{season.quarter}.parquet'
-                        )
-                        network_segments_df = geopandas.read_parquet(network_segments_path)
-                        network_segments_lookup = create_network_segments_lookup(
-                            network_segments_df)
-                        del network_segments_df
-                        gc.collect()
+                    table_df = self._prepare_trips_chunk(delayed_partition.compute(), table_name)
 
-                    bar.write(f'  Processing chunk {chunk_index}/{chunk_count}...')
-                    trips_gdf = trips_as_lines(table_df, network_segments_lookup, 'EPSG:4326', bar)
+                    output_path = os.path.join(output_folder, f'chunk_{chunk_index}.parquet')
+                    pending.add(pool.submit(form_trip_lines_chunk, table_df, store_folder, output_path))
                     del table_df
-                    gc.collect()
 
-                    # bar.write(
-                    #     f'  Saving {trip_type} data for {table_name} chunk {chunk_index}/{chunk_count} in the background...')
+                wait_for_chunks(0)
+            finally:
+                for future in pending:
+                    future.cancel()
+
+        return rows_out
 
-                    # Define the output path
-                    output_path = os.path.join(output_folder, f'chunk_{chunk_index}.parquet')
+    def _network_segment_store_path(self, year: int, quarter: str) -> str:
+        """Get the folder of the segment store for the season's network segments (see `_network_segment_store`)."""
+        return os.path.join(self.folder_path, f'full_area/network_segments/_stores/{self.region}_{year}_{quarter}')
 
-                    # Save the GeoDataFrame to a parquet file in a separate thread
-                    future = executor.submit(save_geodataframe, trips_gdf, output_path)
-                    futures.append(future)
+    def _referenced_network_segments_path(self, year: int, quarter: str) -> str:
+        """
+        Get the path of the segments that the trips use, pruned from a download
+        of every segment of the season (see `_download_referenced_network_segments`).
+        """
+        return os.path.join(self.folder_path,
+                            f'full_area/network_segments/_referenced/{self.region}_{year}_{quarter}.parquet')
 
-                    # since the separate thread has its own reference to trips_gdf that it will
-                    # clean up when finished, we can go ahead and delete it here
-                    del trips_gdf
-                    gc.collect()
+    def _network_segment_store(self, year: int, quarter: str) -> NetworkSegmentStore:
+        """
+        Open the segment store for the season's network segments, building it
+        first if the network segments have changed since it was built.
 
-                del network_segments_lookup
-                gc.collect()
+        With `segments_semi_join`, the store is built from the segments that were
+        pruned from a download of every segment, if they are up to date.
 
-                # wait for all submitted futures to complete saving
-                for index, future in enumerate(futures):
-                    try:
-                        future.result()  # this will block until the future is completed
-                    except Exception as e:
-                        print(f"Error saving for chunk {index}: {e}")
-                bar.close()
+        The store is memory-mapped, so every process that forms trip lines for
+        the season shares one copy of the segments instead of building its own lookup.
+        """
+        season_name = f'{self.region}_{year}_{quarter}'
+        network_segments_path = os.path.join(
+            self.folder_path, f'full_area/network_segments/{season_name}.parquet')
+        store_path = self._network_segment_store_path(year, quarter)
+
+        segments_stat = os.stat(network_segments_path)
+        segments_tag = f'{segments_stat.st_size}:{segments_stat.st_mtime_ns}'
+        if self.segments_semi_join and self.checkpoints.is_complete(
+                'network_segments/referenced', season=season_name, area='full_area', tag=segments_tag):
+            network_segments_path = self._referenced_network_segments_path(year, quarter)
+            segments_stat = os.stat(network_segments_path)
+        # (include the file so that switching between the full and pruned segments rebuilds the store)
+        segments_tag = (f'{os.path.basename(os.path.dirname(network_segments_path))}:'
+                        f'{segments_stat.st_size}:{segments_stat.st_mtime_ns}')
+        if self.checkpoints.is_complete('network_segments/store', season=season_name, area='full_area',
+                                        tag=segments_tag):
+            return NetworkSegmentStore.open(store_path)
+
+        print(f'  Building the segment store for {season_name}...')
+        with reserve_memory('network_segment_store', default=self.query_process_memory):
+            segments_gdf = geopandas.read_parquet(network_segments_path, columns=['stableEdgeId', 'geometry'])
+            store = NetworkSegmentStore.build(segments_gdf, store_path)
+            del segments_gdf
+            gc.collect()
+        self.checkpoints.commit('network_segments/store', season=season_name, area='full_area',
+                                tag=segments_tag, outputs=[store_path])
+        return store
+
+    def _download_referenced_network_segments(self, trips_ddf: dask.dataframe.DataFrame,
+                                              year: int, quarter: str) -> None:
+        """
+        Make sure that the season's network segments include every segment that
+        the trips use (their `network_link_ids`).
+
+        If every segment of the season was already downloaded, the download is
+        pruned locally to the segments that the trips use instead (see
+        `_prune_network_segments`). Otherwise, only the segments that the trips use and that have not
+        been downloaded for other trips are downloaded (in queries of
+        `segment_ids_per_query` segment ids) and added to the season's network
+        segments, so that they can be reused.
+        """
+        season_name = f'{self.region}_{year}_{quarter}'
+        network_segments_path = os.path.join(
+            self.folder_path, f'full_area/network_segments/{season_name}.parquet')
+
+        print(f'  Finding the network segments that the {season_name} trips use...')
+        # (the segment ids are strings even when the trips store them as integers)
+        link_ids_series = cast(pandas.Series, trips_ddf['network_link_ids'].explode().dropna().unique().compute())
+        link_ids = sorted({str(link_id) for link_id in link_ids_series.tolist()})
+        print(f'  The trips use {len(link_ids)} network segments.')
+
+        # a download of every segment has every segment that the trips use, so prune it instead
+        segments_checkpoint = self.checkpoints.get('download/network_segments', season=season_name, area='full_area')
+        if segments_checkpoint is not None and segments_checkpoint['tag'] != 'referenced':
+            self._prune_network_segments(link_ids, year, quarter)
+            return
 
-            # create a .success file to indicate that the chunks have been successfully created
-            print(f'Flagging {table_name} chunks as complete...')
-            success_file_path = os.path.join(
-                self.folder_path, f'{area_name}/{trip_type}/{self.region}_{season.year}_{season.quarter}.success')
-            with open(success_file_path, 'w') as success_file:
-                success_file.write('\n')
+        # only download the segments that previous semi-join downloads do not have
+        downloaded_gdf: geopandas.GeoDataFrame | None = None
+        if segments_checkpoint is not None:
+            downloaded_gdf = geopandas.read_parquet(network_segments_path)
+            link_ids = sorted(set(link_ids).difference(downloaded_gdf['stableEdgeId']))
+            if not link_ids:
+                return
 
-            print(f'  Finished processing {table_name}.')
-            return None
+        full_table_path = f'{self.project_id}.{self.region}.{season_name}_network_segments'
+        print(f'  Downloading the network segments that the trips use from {full_table_path}...')
+        segments_dfs: list[pandas.DataFrame] = []
+        for start in range(0, len(link_ids), self.segment_ids_per_query):
+            segments_query = f'''
+            SELECT stableEdgeId, streetName, geometry, osmid FROM {full_table_path}
+            WHERE stableEdgeId IN UNNEST(@edge_ids);
+            '''
+            edge_ids = link_ids[start:start + self.segment_ids_per_query]
+            with logging_redirect_tqdm():
+                segments_df = pandas_gbq.read_gbq(
+                    segments_query,
+                    project_id=self.project_id,
+                    dialect='standard',
+                    use_bqstorage_api=self.use_bqstorage_api,
+                    configuration={'query': {
+                        'parameterMode': 'NAMED',
+                        'queryParameters': [{
+                            'name': 'edge_ids',
+                            'parameterType': {'type': 'ARRAY', 'arrayType': {'type': 'STRING'}},
+                            'parameterValue': {'arrayValues': [{'value': edge_id} for edge_id in edge_ids]},
+                        }],
+                    }},
+                    progress_bar_type=None,
+                )
+            if segments_df is not None:
+                segments_dfs.append(segments_df)
+
+        segments_df = pandas.concat(segments_dfs, ignore_index=True) if segments_dfs else pandas.DataFrame(
+            {'stableEdgeId': [], 'streetName': [], 'geometry': [], 'osmid': []})
+        segments_gdf = geopandas.GeoDataFrame(
+            segments_df, geometry=geopandas.GeoSeries.from_wkt(segments_df['geometry']), crs="EPSG:4326")
+        if downloaded_gdf is not None:
+            segments_gdf = geopandas.GeoDataFrame(
+                pandas.concat([downloaded_gdf, segments_gdf], ignore_index=True), crs="EPSG:4326")
+        print(f'  Downloaded {len(segments_gdf) - (len(downloaded_gdf) if downloaded_gdf is not None else 0)} '
+              'network segments.')
+        output_paths = self._save(segments_gdf, 'full_area', f'{season_name}_network_segments',
+                                  'network_segments', 'geoparquet')
+        self.checkpoints.commit('download/network_segments', season=season_name, area='full_area',
+                                tag='referenced', outputs=output_paths)
+
+    def _prune_network_segments(self, link_ids: list[str], year: int, quarter: str) -> None:
+        """
+        Add the given segments from the download of every segment of the season
+        to the season's pruned segments (see `_referenced_network_segments_path`),
+        reading only the segments that the pruned segments do not already have.
 
-        # loop through each trip dataset in the schema_df
-        # and run the get_trips function in a separate process
-        # so that any holds on memory that python creates are
-        # released (downloading and processing trip data is memory
-        # intensive and pandas_gbq appears hold on to memory)
-        for season in schema_df.itertuples():
-            process = multiprocessing.Process(target=get_trips)
-            process.start()
-            process.join()  # wait for the process to finish
-            if process.exitcode != 0:
-                print(f'Process for {season.table_name} exited with code {process.exitcode}.')
-            process.close()
-            results_count += 1
+        The pruned segments are kept for as long as the full download does not change.
+        """
+        season_name = f'{self.region}_{year}_{quarter}'
+        network_segments_path = os.path.join(
+            self.folder_path, f'full_area/network_segments/{season_name}.parquet')
+        pruned_path = self._referenced_network_segments_path(year, quarter)
+
+        segments_stat = os.stat(network_segments_path)
+        segments_tag = f'{segments_stat.st_size}:{segments_stat.st_mtime_ns}'
+
+        # only read the segments that the pruned segments do not have
+        pruned_gdf: geopandas.GeoDataFrame | None = None
+        if self.checkpoints.is_complete('network_segments/referenced', season=season_name, area='full_area',
+                                        tag=segments_tag):
+            pruned_gdf = geopandas.read_parquet(pruned_path)
+            link_ids = sorted(set(link_ids).difference(pruned_gdf['stableEdgeId'].astype(str)))
+            if not link_ids:
+                return
 
-        print(
-            f"\nSuccessfully obtained data from {results_count} trip tables.")
+        print(f'  Pruning the {season_name} network segments to the segments that the trips use...')
+        with reserve_memory('network_segment_store', default=self.query_process_memory):
+            segments_gdf = geopandas.read_parquet(network_segments_path,
+                                                  filters=[('stableEdgeId', 'in', link_ids)])
+            if pruned_gdf is not None:
+                segments_gdf = geopandas.GeoDataFrame(
+                    pandas.concat([pruned_gdf, segments_gdf], ignore_index=True), crs=pruned_gdf.crs)
+            print(f'  Kept {len(segments_gdf)} network segments.')
+
+            os.makedirs(os.path.dirname(pruned_path), exist_ok=True)
+            has_bbox_column = 'bbox' in segments_gdf.columns
+            segments_gdf.to_parquet(partial_path(pruned_path), write_covering_bbox=not has_bbox_column,
+                                    geometry_encoding='WKB', schema_version='1.1.0', compression='snappy')
+            del segments_gdf, pruned_gdf
+            gc.collect()
+        self.checkpoints.commit('network_segments/referenced', season=season_name, area='full_area',
+                                tag=segments_tag, outputs=[pruned_path])
 
     def _prepare_query_geometry(self, geometry_series: geopandas.GeoSeries) -> str | None:
         """
@@ -592,8 +1068,7 @@ class ReplicaETL:
         dissolved_gdf = gdf.dissolve()
 
         # get the WKT representation of the dissolved geometry
-        wkt_list = dissolved_gdf['geometry'].apply(
-            lambda x: shapely.wkt.dumps(x)).tolist()
+        wkt_list = dissolved_gdf['geometry'].apply(self._query_wkt).tolist()
 
         # return early if the geoemtry is empty
         if len(wkt_list) == 0:
@@ -612,6 +1087,22 @@ class ReplicaETL:
             ]) AS query_geometry
         '''
 
+    def _query_polygons(self, geometry_series: geopandas.GeoSeries) -> geopandas.GeoSeries:
+        """Optimize the polygons for queries if `optimize_query_geometry` is enabled."""
+        if not self.optimize_query_geometry:
+            return geometry_series
+        return optimize_query_polygons(geometry_series, self.query_geometry_tolerance_meters)
+
+    def _query_wkt(self, geometry: BaseGeometry) -> str:
+        """
+        Get the WKT of a geometry for a query. When the query geometry is optimized,
+        coordinates are rounded to 6 decimal places (about 0.1 m), which is much
+        less than the distance that the polygons were buffered by.
+        """
+        if self.optimize_query_geometry:
+            return shapely.wkt.dumps(geometry, rounding_precision=6, trim=True)
+        return shapely.wkt.dumps(geometry)
+
     def _build_query(self, wkt_list: list[str], full_table_path: str, origin_lng_col: str, origin_lat_col: str,
                      dest_lng_col: str, dest_lat_col: str) -> str | None:
         '''
@@ -639,6 +1130,13 @@ class ReplicaETL:
                         origin_lat_col: str, dest_lng_col: str, dest_lat_col: str, max_query_chars: int = 150000) -> dask.dataframe.DataFrame:
         download_cache_folderpath = os.path.join(self.folder_path, 'full_area/download')
 
+        # queue the optimized polygons in order so that nearby polygons are in the same query
+        if self.optimize_query_geometry:
+            query_polygons = self._query_polygons(geopandas.GeoSeries(gdf_upload['geometry'], crs="EPSG:4326"))
+            gdf_upload = geopandas.GeoDataFrame(geometry=query_polygons, crs="EPSG:4326")
+            gdf_upload['geometry_wkt'] = query_polygons.apply(self._query_wkt)
+            print(f'Optimized the query geometry for {full_table_path} to {len(gdf_upload)} polygons.')
+
         queue: list[str] = []
         queue_length = 0
         queries: list[str] = []
@@ -710,49 +1208,32 @@ class ReplicaETL:
                 download_cache_filename = f'{full_table_path}__{index + 1}_{num_queries}.parquet'
                 download_cache_filepath = os.path.join(
                     download_cache_folderpath, download_cache_filename)
-                download_cache_success_filepath = download_cache_filepath.replace(
-                    '.parquet', '.success')
+                query_hash = hashlib.md5(query.encode('utf-8')).hexdigest()
 
                 # ensure the cache folder exists
                 os.makedirs(download_cache_folderpath, exist_ok=True)
 
-                # check if the a cached version is available
-                if os.path.exists(download_cache_filepath) and os.path.exists(download_cache_success_filepath):
+                # check if the a cached version is available (including
+                # caches that were marked with a .success file by older versions)
+                self.checkpoints.adopt_marker(download_cache_filepath.replace('.parquet', '.success'),
+                                              'download/query', chunk=download_cache_filename, tag=query_hash,
+                                              outputs=[download_cache_filepath])
+                if self.checkpoints.is_complete('download/query', chunk=download_cache_filename, tag=query_hash):
                     print(f'Using cached data from {download_cache_filename}')
+                    self._upgrade_trips_cache(download_cache_filepath)
                     ldf = polars.scan_parquet(download_cache_filepath)
                     result_ldfs.append(ldf)
                     chunk_paths.append(download_cache_filepath)
                     return
 
-                # otherwise, download the data from BigQuery
-                with logging_redirect_tqdm():
-                    df = pandas_gbq.read_gbq(
-                        query,
-                        project_id=self.project_id,
-                        dialect='standard',
-                        use_bqstorage_api=self.use_bqstorage_api
-                    )
-                if df is None:
-                    df = pandas.DataFrame()
-
-                # convert list types to csv strings (numpy arrays are not supported by parquet)
-                columns_to_convert_to_csv = ['transit_route_ids', 'network_link_ids']
-                for column in columns_to_convert_to_csv:
-                    if column in df.columns:
-                        df[column] = df[column].apply(
-                            lambda x: ','.join(map(str, x)) if isinstance(x, numpy.ndarray) else x)
-
-                # save a backup/cache of the data upon download that we can use to restore downloaded data
-                pandas.DataFrame.to_parquet(
-                    df,
-                    os.path.join(download_cache_filepath),
-                    compression='snappy'
-                )
+                # otherwise, download the data from BigQuery and save a backup/cache
+                # of the data upon download that we can use to restore downloaded data
+                self._download_trips_query(query, download_cache_filepath)
 
-                # once the data is saved, write an empty .success file with the same name
-                # to indicate that the download was successful
-                with open(download_cache_success_filepath, 'w') as f:
-                    f.write('')
+                # once the data is saved, move it into place and record
+                # that the download was successful
+                self.checkpoints.commit('download/query', chunk=download_cache_filename, tag=query_hash,
+                                        outputs=[download_cache_filepath])
 
                 # prepare a lazy data frame from polars
                 # so that the data does not need to be fully loaded into memory
@@ -765,10 +1246,16 @@ class ReplicaETL:
                 print('Failed to execute query')
                 raise e
 
+        # the callbacks run in the worker threads, which do not know the current stage
+        query_stage = current_stage()
+        completed_queries = [0]
+
         def handle_query_error(future: Future[None]) -> None:
             """Handle errors that occur during query execution."""
             try:
                 future.result()  # This will raise an exception if the query failed
+                completed_queries[0] += 1
+                report_progress(completed_queries[0], len(queries), query_stage)
             except Exception as e:
                 # stop all processing that has not begun if an error occurs
                 for future in futures:
@@ -789,15 +1276,207 @@ class ReplicaETL:
         # wait for all futures to finish
         executor.shutdown(wait=True)
 
+        # trips whose origin and destination are in polygons of different queries are
+        # downloaded by each of those queries, so keep only one row for each activity_id
+        chunk_paths.sort(key=lambda path: int(path.rsplit('__', 1)[1].split('_')[0]))
+        unify_id_lists(chunk_paths, self.trips_id_list_columns)
+        # (when no trips were downloaded, there are no de-duplicated files, so use the empty chunks)
+        deduplicated_paths = self._deduplicate_trips(full_table_path, chunk_paths) or chunk_paths
+
         # repartition each chunk to 100 MB each
         print('Repartitioning chunks to 100 MB each...')
-        chunks_ddf = cast(dask.dataframe.DataFrame, dask.dataframe.read_parquet(chunk_paths))
+        chunks_ddf = cast(dask.dataframe.DataFrame, dask.dataframe.read_parquet(deduplicated_paths))
         repartitioned_ddf = cast(dask.dataframe.DataFrame,
                                  chunks_ddf.repartition(partition_size='100MB'))
 
         # return all results
         return repartitioned_ddf
 
+    def _deduplicate_trips(self, full_table_path: str, chunk_paths: list[str]) -> list[str]:
+        """
+        Write the downloaded chunks of a trip table again so that each trip
+        (`activity_id`) appears only once (see `deduplicate_by_key`).
+
+        The de-duplicated files are reused until the chunks change.
+
+        Returns:
+            The paths of the de-duplicated files.
+        """
+        deduplicated_folderpath = os.path.join(self.folder_path, 'full_area/download',
+                                               f'{full_table_path}__deduplicated')
+        chunks_signature = '\n'.join(
+            f'{os.path.basename(path)}:{os.stat(path).st_size}:{os.stat(path).st_mtime_ns}' for path in chunk_paths)
+        chunks_hash = hashlib.md5(chunks_signature.encode('utf-8')).hexdigest()
+
+        if not self.checkpoints.is_complete('download/deduplicate', chunk=full_table_path, tag=chunks_hash):
+            print(f'Removing trips that were downloaded by more than one query for {full_table_path}...')
+            # only one bucket of trips (about 256 MB compressed) is held in memory at a time
+            with reserve_memory('deduplicate_trips', default='4G'), stage('deduplicate_trips'):
+                _, duplicate_count = deduplicate_by_key(
+                    chunk_paths, partial_path(deduplicated_folderpath), 'activity_id', log_space='  ')
+                self.checkpoints.commit('download/deduplicate', chunk=full_table_path, tag=chunks_hash,
+                                        outputs=[deduplicated_folderpath], result={'duplicate_count': duplicate_count})
+
+        return sorted(path.as_posix() for path in Path(deduplicated_folderpath).glob('part_*.parquet'))
+
+    def _run_sharded(self, gdf_upload: geopandas.GeoDataFrame, full_table_path: str, origin_lng_col: str,
+                     origin_lat_col: str, dest_lng_col: str, dest_lat_col: str) -> dask.dataframe.DataFrame:
+        """
+        Download the trips in the area from a trip table in evenly sized shards.
+
+        The trips are selected once on the server into a temporary table (the
+        table that BigQuery stores the results of every query in for 24 hours).
+        The temporary table is then downloaded in shards in parallel, where each
+        trip belongs to the shard given by a hash of its `activity_id`. The number
+        of shards is the number of selected trips divided by `shard_target_rows`,
+        rounded up to a multiple of `shard_concurrency` so that every group of
+        downloads that run at the same time is full.
+
+        Each shard is recorded in the checkpoint store when it is downloaded, so
+        an interrupted download resumes with the shards that are missing. Every
+        trip is selected by one query and belongs to one shard, so unlike
+        `_run_with_queue`, the trips do not need to be de-duplicated.
+        """
+        download_cache_folderpath = os.path.join(self.folder_path, 'full_area/download')
+        os.makedirs(download_cache_folderpath, exist_ok=True)
+
+        query_geometry = self._prepare_query_geometry(
+            self._query_polygons(geopandas.GeoSeries(gdf_upload['geometry'], crs="EPSG:4326")))
+        if query_geometry is None:
+            raise ValueError(f'The query geometry for {full_table_path} is empty.')
+        filter_query = f'''
+        SELECT {self.columns_to_select}, {origin_lng_col}, {origin_lat_col}, {dest_lng_col}, {dest_lat_col}
+        FROM {full_table_path}
+        WHERE EXISTS( -- ensure that the subquery returns at least one row
+            SELECT 1 -- check for at least one row that satisifes the spatial condition (stop after 1 row for efficiency)
+            FROM {query_geometry}
+            WHERE
+                ST_COVERS(query_geometry, ST_GEOGPOINT({origin_lng_col}, {origin_lat_col}))
+                OR ST_COVERS(query_geometry, ST_GEOGPOINT({dest_lng_col}, {dest_lat_col}))
+        );
+        '''
+        filter_hash = hashlib.md5(filter_query.encode('utf-8')).hexdigest()
+
+        # the number of shards is recorded so that a resumed download uses the same shards
+        filtered_table: str | None = None
+        shards_checkpoint = self.checkpoints.get('download/shards', chunk=full_table_path, tag=filter_hash)
+        if shards_checkpoint is not None:
+            shard_count = int(shards_checkpoint['result']['shard_count'])
+        else:
+            print(f'Selecting the trips in the area from {full_table_path}...')
+            filtered_table, row_count = self._query_to_temporary_table(filter_query)
+            shard_count = max(1, math.ceil(row_count / self.shard_target_rows))
+            shard_count = math.ceil(shard_count / self.shard_concurrency) * self.shard_concurrency
+            self.checkpoints.commit('download/shards', chunk=full_table_path, tag=filter_hash,
+                                    result={'shard_count': shard_count, 'row_count': row_count})
+            print(f'Selected {row_count} trips from {full_table_path} ({shard_count} shards).')
+
+        shard_paths = [
+            os.path.join(download_cache_folderpath, f'{full_table_path}__shard_{index + 1}_{shard_count}.parquet')
+            for index in range(shard_count)
+        ]
+        missing_shards = [
+            index for index, shard_path in enumerate(shard_paths)
+            if not self.checkpoints.is_complete('download/shard', chunk=os.path.basename(shard_path), tag=filter_hash)
+        ]
+
+        # the temporary table may have expired since the shards were counted, so select the trips again
+        # (BigQuery returns the cached results if the temporary table still exists)
+        if missing_shards and filtered_table is None:
+            filtered_table, _ = self._query_to_temporary_table(filter_query)
+
+        print(f'Downloading {len(missing_shards)} of {shard_count} shards of {full_table_path}...')
+
+        def download_shard(index: int) -> None:
+            # use a positive remainder because FARM_FINGERPRINT returns negative values too
+            shard_query = f'''
+            SELECT * FROM `{filtered_table}`
+            WHERE MOD(MOD(FARM_FINGERPRINT(CAST(activity_id AS STRING)), {shard_count}) + {shard_count}, {shard_count}) = {index};
+            '''
+            self._download_trips_query(shard_query, shard_paths[index])
+            self.checkpoints.commit('download/shard', chunk=os.path.basename(shard_paths[index]), tag=filter_hash,
+                                    outputs=[shard_paths[index]])
+
+        # the threads do not know the current stage
+        shards_stage = current_stage()
+        gbq_logger.setLevel(logging.WARNING)
+        try:
+            with ThreadPoolExecutor(max_workers=self.shard_concurrency) as executor:
+                futures = [executor.submit(download_shard, index) for index in missing_shards]
+                for completed_count, future in enumerate(as_completed(futures)):
+                    future.result()  # raises the error if the download failed
+                    report_progress(completed_count + 1, len(futures), shards_stage)
+        finally:
+            gbq_logger.setLevel(logging.INFO)
+
+        for shard_path in shard_paths:
+            self._upgrade_trips_cache(shard_path)
+        unify_id_lists(shard_paths, self.trips_id_list_columns)
+
+        # repartition the shards to 100 MB each
+        print('Repartitioning shards to 100 MB each...')
+        shards_ddf = cast(dask.dataframe.DataFrame, dask.dataframe.read_parquet(shard_paths))
+        return cast(dask.dataframe.DataFrame, shards_ddf.repartition(partition_size='100MB'))
+
+    def _query_to_temporary_table(self, query: str) -> tuple[str, int]:
+        """
+        Run a query and get the temporary table that BigQuery stores its results
+        in (for 24 hours) and the number of rows in it.
+        """
+        # only import the BigQuery libraries when data are downloaded
+        from google.cloud import bigquery
+
+        client = bigquery.Client(project=self.project_id, credentials=pandas_gbq.context.credentials)
+        try:
+            job = client.query(query)
+            job.result()
+            destination = job.destination
+            table = client.get_table(destination)
+            return f'{destination.project}.{destination.dataset_id}.{destination.table_id}', int(table.num_rows or 0)
+        finally:
+            client.close()
+
+    def _download_trips_query(self, query: str, output_path: str) -> None:
+        """
+        Download the results of a trips query to the partial path of `output_path`
+        (see `partial_path`). Commit the output to move it into place.
+        """
+        if self.stream_downloads:
+            # encode the id lists as each row group is written
+            stream_to_parquet(
+                self._batch_reader().read_batches(query),
+                {output_path: lambda table: encode_id_lists(table, self.trips_id_list_columns)},
+                batch_rows=self.download_batch_rows,
+            )
+            return
+
+        with logging_redirect_tqdm():
+            df = pandas_gbq.read_gbq(
+                query,
+                project_id=self.project_id,
+                dialect='standard',
+                use_bqstorage_api=self.use_bqstorage_api
+            )
+        if df is None:
+            df = pandas.DataFrame()
+
+        table = encode_id_lists(pyarrow.Table.from_pandas(df, preserve_index=False), self.trips_id_list_columns)
+        pyarrow.parquet.write_table(table, partial_path(output_path), compression='snappy')
+
+    def _upgrade_trips_cache(self, path: str) -> None:
+        """
+        Rewrite a trips download from before the id lists were stored as lists
+        (they were comma-separated strings) so that every download has the same schema.
+        """
+        schema = pyarrow.parquet.read_schema(path)
+        if all(is_id_list(schema.field(column).type, id_type)
+               for column, id_type in self.trips_id_list_columns.items() if column in schema.names):
+            return
+        print(f'Converting the id lists of {os.path.basename(path)} to lists...')
+        table = encode_id_lists(pyarrow.parquet.read_table(path), self.trips_id_list_columns)
+        pyarrow.parquet.write_table(table, partial_path(path), compression='snappy')
+        replace_with_partial(path)
+
     def _run_schema_query(self) -> pandas.DataFrame:
         """
         Returns the schema for the replica dataset.
@@ -878,87 +1557,45 @@ class ReplicaETL:
     def infer_schema(self, years_filter: Optional[list[int]] = None, quarters_filter: Optional[list[Literal['Q2', 'Q4']]] = None, strict: bool = False) -> pandas.DataFrame:
         """Infer the schema table from the downloaded full_area files.
 
+        Downloads are recorded in the checkpoint store when they finish, so only
+        datasets that were completely downloaded are included.
+
+        Args:
+            strict (bool): Whether to also confirm that the downloaded files still exist.
+
         Returns:
             pandas.DataFrame: A pandas data frame containing columns `table_name`, `region`, `year`, `quarter`, `dataset`
         """
-        full_area_path = os.path.join(self.folder_path, 'full_area')
-        if not os.path.exists(full_area_path):
-            return pandas.DataFrame(columns=['table_name', 'region', 'year', 'quarter', 'dataset'])
+        self._adopt_downloaded_files()
 
-        # find the available tables in the full_area folder
+        # find the available tables from the recorded downloads
         inferred_schema_rows = []
-        for root, _, files in os.walk(full_area_path):
-            for filename in files:
-                if root.endswith('download') or '_chunks' in root:
-                    # skip the download cache folder or any chunks folders
+        for dataset in self._downloaded_datasets():
+            for checkpoint in self.checkpoints.query(f'download/{dataset}', area='full_area'):
+                [region, year, quarter] = checkpoint['season'].rsplit('_', 2)
+
+                if years_filter is not None and int(year) not in years_filter:
+                    continue
+
+                if quarters_filter is not None and quarter not in quarters_filter:
                     continue
 
-                if filename.endswith('.parquet') or filename.endswith('.success'):
-
-                    # extract the table info from the file path
-                    relative_path = os.path.relpath(
-                        os.path.join(root, filename), full_area_path)
-                    [dataset, partial_table_name] = relative_path.split(os.sep)
-
-                    # remove suffixes
-                    partial_table_name = partial_table_name\
-                        .replace('.parquet', '')\
-                        .replace('.success', '')\
-                        .replace('_home', '')\
-                        .replace('_school', '')\
-                        .replace('_work', '')\
-                        .replace('_dest', '')\
-                        .replace('_origin', '')
-
-                    # extract the parts of the table name
-                    parts = partial_table_name.split('_')
-                    quarter = parts[-1]
-                    year = parts[-2]
-                    region = '_'.join(parts[0:-2])
-
-                    if years_filter is not None and int(year) not in years_filter:
-                        continue
-
-                    if quarters_filter is not None and quarter not in quarters_filter:
-                        continue
-
-                    inferred_schema_rows.append({
-                        'table_name': f'{region}_{year}_{quarter}_{dataset}',
-                        'region': region,
-                        'year': year,
-                        'quarter': quarter,
-                        'dataset': dataset,
-                    })
+                # if a file is missing, the dataset must be downloaded again
+                if strict and not all(os.path.exists(path) for path in checkpoint['outputs']):
+                    continue
+
+                inferred_schema_rows.append({
+                    'table_name': f'{region}_{year}_{quarter}_{dataset}',
+                    'region': region,
+                    'year': year,
+                    'quarter': quarter,
+                    'dataset': dataset,
+                })
 
         # convert the found table information to a DataFrame
         if inferred_schema_rows:
             inferred_schema_df = pandas.DataFrame(inferred_schema_rows).drop_duplicates([
                 'table_name']).reset_index(drop=True)
-
-            inferred_seasons = inferred_schema_df\
-                .drop(columns=['table_name', 'dataset'])\
-                .drop_duplicates()\
-                .reset_index(drop=True)
-
-            # ensure that all parquet files exist for each dataset
-            # (used when we need to know which seasons have all data available)
-            if strict:
-                expected_parquet_files = self._getExpectedParquetFilePaths()
-                for season in inferred_seasons.itertuples():
-                    for expected_filename_template in expected_parquet_files:
-                        expected_filename = expected_filename_template.format(
-                            region=season.region, year=season.year, quarter=season.quarter)
-                        full_expected_path = os.path.join(
-                            self.folder_path, expected_filename)
-
-                        # if a file is missing, remove the season from the inferred schema
-                        if not os.path.exists(full_expected_path):
-                            dataset = expected_filename.split(os.sep)[-2]
-                            table_name = f'{season.region}_{season.year}_{season.quarter}_{dataset}'
-                            inferred_schema_df = inferred_schema_df[
-                                inferred_schema_df['table_name'] != table_name
-                            ].reset_index(drop=True)
-
         else:
             # If no files found, return an empty DataFrame with the expected columns
             inferred_schema_df = pandas.DataFrame(
@@ -966,28 +1603,106 @@ class ReplicaETL:
 
         return inferred_schema_df
 
-    def _save(self, gdf: geopandas.GeoDataFrame | pandas.DataFrame, area_name: str, full_table_name: str, table_alias: str, format: Literal['geoparquet', 'json', 'geojson'] | list[Literal['geoparquet', 'json', 'geojson']], log_prefix: str = '') -> None:
-        # if format is a list, call this function for each format in the list
-        if isinstance(format, list):
-            for fmt in format:
-                self._save(gdf, area_name, full_table_name, table_alias, fmt)
+    def _adopt_downloaded_files(self) -> None:
+        """
+        Record downloads that are not in the checkpoint store, such as downloads
+        from before the checkpoint store existed or `full_area` files that were
+        copied into the data folder so that the ETL can run without authenticating.
+
+        Only the top level of each dataset folder is listed. Trip data are only
+        recorded if they were marked as complete with a .success file.
+        """
+        self._migrate_population_downloads()
+
+        full_area_path = os.path.join(self.folder_path, 'full_area')
+        for dataset in self._downloaded_datasets():
+            dataset_path = os.path.join(full_area_path, dataset)
+            if not os.path.isdir(dataset_path):
+                continue
+
+            for filename in os.listdir(dataset_path):
+                if not (filename.endswith('.parquet') or filename.endswith('.success')):
+                    continue
+
+                # extract the season from the file name
+                partial_table_name = filename\
+                    .replace('.parquet', '')\
+                    .replace('.success', '')\
+                    .replace('_home', '')\
+                    .replace('_school', '')\
+                    .replace('_work', '')
+                [region, year, quarter] = partial_table_name.rsplit('_', 2)
+                season_name = f'{region}_{year}_{quarter}'
+
+                stage_name = f'download/{dataset}'
+                if self.checkpoints.query(stage_name, season=season_name, area='full_area'):
+                    continue
+
+                output_paths = self._download_output_paths(region, year, quarter, dataset)
+                if filename.endswith('.success'):
+                    self.checkpoints.adopt_marker(os.path.join(dataset_path, filename), stage_name,
+                                                  season=season_name, area='full_area', outputs=output_paths)
+                elif all(os.path.exists(path) for path in output_paths):
+                    self.checkpoints.commit(stage_name, season=season_name, area='full_area', outputs=output_paths)
+
+    def _migrate_population_downloads(self) -> None:
+        """
+        Population data used to be downloaded as three files (`_home`, `_school`,
+        and `_work`) that only differed in their geometry. The `_home` file has the
+        same contents as the single file that replaced them, so copy it instead of
+        downloading the population again. The old files are left in place.
+        """
+        population_path = os.path.join(self.folder_path, 'full_area', 'population')
+        if not os.path.isdir(population_path):
             return
 
-        # build the output name
+        for filename in os.listdir(population_path):
+            if not filename.endswith('_home.parquet'):
+                continue
+            [region, year, quarter] = filename.removesuffix('_home.parquet').rsplit('_', 2)
+            season_name = f'{region}_{year}_{quarter}'
+            [output_path] = self._download_output_paths(region, year, quarter, 'population')
+
+            if not os.path.exists(output_path):
+                print(f'Copying {filename} to {os.path.basename(output_path)}...')
+                shutil.copyfile(os.path.join(population_path, filename), partial_path(output_path))
+                replace_with_partial(output_path)
+
+            # record the new file for downloads that recorded the old files
+            for checkpoint in self.checkpoints.query('download/population', season=season_name, area='full_area'):
+                if checkpoint['outputs'] != [output_path]:
+                    self.checkpoints.commit('download/population', season=season_name, area='full_area',
+                                            tag=checkpoint['tag'], outputs=[output_path])
+
+    def _output_path(self, area_name: str, full_table_name: str, table_alias: str) -> str:
+        """Get the path (without an extension) that `_save` saves a table to."""
         output_name = full_table_name\
             .replace('.', ' ')\
             .replace(table_alias, '')\
             .replace('_', ' ')\
             .strip()\
             .replace(' ', '_')
+        return os.path.join(self.folder_path, area_name, table_alias, output_name)
+
+    def _save(self, gdf: geopandas.GeoDataFrame | pandas.DataFrame, area_name: str, full_table_name: str, table_alias: str, format: Literal['geoparquet', 'json', 'geojson'] | list[Literal['geoparquet', 'json', 'geojson']], log_prefix: str = '') -> list[str]:
+        """Save the data to the area folder.
+
+        Each file is written to a partial file first and then moved into place
+        so that an interrupted write never leaves an incomplete file.
+
+        Returns:
+            list[str]: The paths to the saved files.
+        """
+        # if format is a list, call this function for each format in the list
+        if isinstance(format, list):
+            saved_paths: list[str] = []
+            for fmt in format:
+                saved_paths += self._save(gdf, area_name, full_table_name, table_alias, fmt)
+            return saved_paths
 
         # ensure output folder exists
-        output_folder = os.path.join(
-            self.folder_path,
-            area_name,
-            table_alias
-        )
-        os.makedirs(output_folder, exist_ok=True)
+        output_path = self._output_path(area_name, full_table_name, table_alias)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
 
         # require geodataframe for goeparquet and geojson formats
         if format in ['geoparquet', 'geojson'] and not isinstance(gdf, geopandas.GeoDataFrame):
@@ -997,16 +1712,22 @@ class ReplicaETL:
             )
 
         # save to file
-        output_path = os.path.join(output_folder, output_name)
+        saved_path: str | None = None
         if format == 'geoparquet' and isinstance(gdf, geopandas.GeoDataFrame):
+            saved_path = output_path + '.parquet'
             has_bbox_column = 'bbox' in gdf.columns
-            gdf.to_parquet(output_path + '.parquet',
+            gdf.to_parquet(partial_path(saved_path),
                            write_covering_bbox=not has_bbox_column, geometry_encoding='WKB', schema_version='1.1.0', compression='snappy')
-            logger.info(f'{log_prefix}Saved results to {output_path}.parquet')
         if format == 'geojson' and isinstance(gdf, geopandas.GeoDataFrame):
-            gdf.to_crs('EPSG:4326').to_file(output_path + '.geojson', driver='GeoJSON')
-            logger.info(f'{log_prefix}Saved results to {output_path}.parquet')
+            saved_path = output_path + '.geojson'
+            gdf.to_crs('EPSG:4326').to_file(partial_path(saved_path), driver='GeoJSON')
         if format == 'json':
+            saved_path = output_path + '.json'
             df = pandas.DataFrame(gdf.drop(columns='geometry', errors='ignore'))
-            df.to_json(output_path + '.json', orient='records', indent=2)
-            logger.info(f'{log_prefix}Saved results to {output_path}.json')
+            df.to_json(partial_path(saved_path), orient='records', indent=2)
+
+        if saved_path is None:
+            return []
+        replace_with_partial(saved_path)
+        logger.info(f'{log_prefix}Saved results to {saved_path}')
+        return [saved_path]
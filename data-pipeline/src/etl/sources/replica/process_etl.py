@@ -5,33 +5,42 @@ import hashlib
 import itertools
 import json
 import logging
-import math
-import multiprocessing
 import os
 import shutil
 import tarfile
-import tempfile
-import time
-from multiprocessing.managers import DictProxy, ValueProxy
 from pathlib import Path
 from typing import Any, Literal, Optional, TypedDict, cast
 
-import dask.dataframe
 import dask_geopandas
 import geopandas
+import numpy
 import pandas
+import pyarrow.dataset
+import pyarrow.parquet
+import shapely
 import tqdm
 from pyproj import CRS
 from shapely.geometry.base import BaseGeometry
 from tqdm.contrib.logging import logging_redirect_tqdm
 
+from etl.checkpoints import CheckpointStore, partial_path, replace_with_partial
+from etl.geometry_cache import dissolved_geometry, prepared_union
+from etl.manifest import BuildManifest, source_code_paths
+from etl.memory_budget import reserve_memory
+from etl.planner import PlannedUnit, count_parquet_rows, path_bytes
+from etl.run_report import instrument, report_progress, report_rows, stage
 from etl.sources.replica.etl import ReplicaETL
 from etl.sources.replica.readers.partitions_to_gdf import partitions_to_gdf
+from etl.sources.replica.transformers.area_index import (
+    AreaIndex, area_column, area_filters, write_area_membership)
 from etl.sources.replica.transformers.as_points import as_points
-from etl.sources.replica.transformers.count_segment_frequency import \
-    count_segment_frequency_multi_input
+from etl.sources.replica.transformers.count_segment_frequency import (
+    count_edge_frequencies, edge_frequencies_to_gdf)
 from etl.sources.replica.transformers.to_vector_tiles import (
     NoVectorDataError, to_vector_tiles)
+from etl.sources.replica.transformers.trip_statistics import (
+    TRIP_STATISTICS_COLUMNS, TripStatistics, flag_service_area_trips)
+from etl.worker_pool import WorkerPool
 
 logger = logging.getLogger('replica_process_etl')
 logger.setLevel(logging.DEBUG)
@@ -46,9 +55,7 @@ class Season(TypedDict):
 
 
 class InputFilePathTemplates(TypedDict):
-    population_home: str
-    population_school: str
-    population_work: str
+    population: str
     walk_service_area: str
     bike_service_area: str
     saturday_trip: str
@@ -65,6 +72,14 @@ class ReplicaProcessETL:
     data_geo_hash: str
     days: list[Literal['saturday', 'thursday']]
 
+    # the memory to reserve for a stage that has not been measured in a previous run
+    # (each stage reads whole seasons of trips or population into memory)
+    stage_memory = '16G'
+
+    # network segments are built for all trips ('') and for the commutes of each travel mode
+    travel_modes = ['', 'biking', 'carpool', 'commercial', 'on_demand_auto',
+                    'other_travel_mode', 'private_auto', 'public_transit', 'walking']
+
     def __init__(self, parent: ReplicaETL, seasons: list[Season], area_geojson_paths: list[str] | list[Path], input_file_path_templates: InputFilePathTemplates, days: list[Literal['saturday', 'thursday']] = ['saturday', 'thursday']) -> None:
         self.parent = parent
         self.seasons = seasons
@@ -82,177 +97,202 @@ class ReplicaProcessETL:
         full_area_geometry_to_hash = geopandas.read_file(full_area_path).geometry.union_all().wkb
         self.data_geo_hash = hashlib.md5(full_area_geometry_to_hash).hexdigest()
 
+        # the cache files are only reused when the manifest confirms that
+        # the inputs, code, and parameters that produced them are unchanged
+        self.manifest = BuildManifest()
+
+        # statistics and completed chunks are recorded here so that
+        # interrupted runs can resume where they left off
+        self.checkpoints = CheckpointStore()
+
+    @instrument('process')
     def process(self):
         statistics: dict[str, Any] = {}
         logger.debug('Cache ID: ' + self.areas_seasons_hash)
 
-        population_stats_cache_path = self.output_folder / \
-            f'population_stats_cache__{self.areas_seasons_hash}.json.tmp'
-
-        if population_stats_cache_path.exists():
-            with open(population_stats_cache_path, 'r') as file:
-                statistics['synthetic_demographics'] = json.load(file)
-                logger.info(
-                    f'Population stats retrieved from the cache.')
+        population_stats_key = f'replica/population_stats/{self.areas_seasons_hash}'
+        population_stats_fingerprint = self._fingerprint(self.seasons, [
+            path
+            for season in self.seasons
+            for path in self._season_input_paths(season, ['population', 'walk_service_area', 'bike_service_area'])
+        ])
+
+        cached_population_stats = self._load_statistics('population_stats', self.areas_seasons_hash) \
+            if self.manifest.is_fresh(population_stats_key, population_stats_fingerprint) else None
+        if cached_population_stats is not None:
+            statistics['synthetic_demographics'] = cached_population_stats
+            logger.info(
+                f'Population stats retrieved from the cache.')
         else:
-            start_time = time.time()
-            shared_count = multiprocessing.Manager().Value('i', 0)
-            shared_stats = multiprocessing.Manager().dict()
-            process = multiprocessing.Process(
-                target=self.mp__process_population,
-                args=(shared_count, shared_stats)
-            )
-            process.start()
-            process.join()
-            if process.exitcode != 0:
-                raise RuntimeError(
-                    f'Population processing failed with exit code {process.exitcode}.')
-            process.close()
-
-            statistics['synthetic_demographics'] = shared_stats.copy()
-
-            elapsed_time = time.time() - start_time
-            formatted_time = time.strftime("%H:%M:%S", time.gmtime(elapsed_time))
-
-            # save to cache
-            with open(population_stats_cache_path, 'w') as file:
-                json.dump(statistics['synthetic_demographics'], file)
+            with reserve_memory('population', default=self.stage_memory), stage('population') as record:
+                # run in a worker process so that the memory used for the population data is released
+                with WorkerPool() as pool:
+                    population_count, population_stats = pool.run(self.process_population)
+
+                statistics['synthetic_demographics'] = population_stats
+
+                # save to cache
+                self._save_statistics('population_stats', self.areas_seasons_hash,
+                                      statistics['synthetic_demographics'])
+                self.manifest.record(population_stats_key, population_stats_fingerprint, [
+                    *(self.output_folder / area_name / 'population' for _, area_name in self.areas)
+                ])
 
             logger.info('')
             logger.info(
-                f'Population data processed for {shared_count.value} season-areas in {formatted_time}.')
+                f'Population data processed for {population_count} season-areas in {record.formatted_wall_time}.')
             logger.info('')
 
         for _season in self.seasons:
             season_str = f"{_season['region']}_{_season['year']}_{_season['quarter']}"
             season_areas_hash = self.create_season_areas_hash(
                 [_season], [area_name for _, area_name in self.areas])
-            season_saturday_stats_cache_path = self.output_folder / \
-                f'saturday_stats_cache__{season_str}__{season_areas_hash}.json.tmp'
-            season_thursday_stats_cache_path = self.output_folder / \
-                f'thursday_stats_cache__{season_str}__{season_areas_hash}.json.tmp'
 
             # ensure the saturday and thursday trip keys exist
             statistics.setdefault('saturday_trip', {})
             statistics.setdefault('thursday_trip', {})
 
             if 'saturday' in self.days:
-                if season_saturday_stats_cache_path.exists():
-                    with open(season_saturday_stats_cache_path, 'r') as file:
-                        saturday_stats = json.load(file)
-                        statistics['saturday_trip'][season_str] = saturday_stats[season_str]
+                # flag the trips in each area before the trips are fingerprinted
+                # since the flags are written to the full area trip chunks
+                with stage(f'saturday_trip_membership__{season_str}'):
+                    self.annotate_area_membership('saturday', _season)
+
+                saturday_stats_key = f'replica/saturday_trip_stats/{season_str}'
+                saturday_stats_fingerprint = self._fingerprint([_season], self._season_input_paths(
+                    _season, ['walk_service_area', 'bike_service_area', 'saturday_trip']))
+                cached_saturday_stats = self._load_statistics('saturday_stats', season_areas_hash, season_str) \
+                    if self.manifest.is_fresh(saturday_stats_key, saturday_stats_fingerprint) else None
+                if cached_saturday_stats is not None:
+                    statistics['saturday_trip'][season_str] = cached_saturday_stats[season_str]
 
-                        logger.info(
-                            f'Saturday trip stats retrieved for {season_str} from the cache. [Cache ID: {season_areas_hash}]')
+                    logger.info(
+                        f'Saturday trip stats retrieved for {season_str} from the cache. [Cache ID: {season_areas_hash}]')
                 else:
-                    start_time = time.time()
-
-                    [count, saturday_stats] = self.process_trips('saturday', [_season])
-                    statistics['saturday_trip'][season_str] = saturday_stats[season_str]
-
-                    elapsed_time = time.time() - start_time
-                    formatted_time = time.strftime("%H:%M:%S", time.gmtime(elapsed_time))
+                    with (reserve_memory(f'saturday_trip_stats__{season_str}', default=self.stage_memory),
+                          stage(f'saturday_trip_stats__{season_str}') as record):
+                        [count, saturday_stats] = self.process_trips('saturday', [_season])
+                        statistics['saturday_trip'][season_str] = saturday_stats[season_str]
 
-                    # save to cache
-                    with open(season_saturday_stats_cache_path, 'w') as file:
-                        json.dump(saturday_stats, file)
+                        # save to cache
+                        self._save_statistics('saturday_stats', season_areas_hash, saturday_stats, season_str)
+                        self.manifest.record(saturday_stats_key, saturday_stats_fingerprint, [
+                            self._area_trip_chunks_path('full_area', _season, 'saturday')
+                        ])
 
                     logger.info('')
                     logger.info(
-                        f'Saturday trip data processed for {count} areas in {season_str} in {formatted_time}.')
+                        f'Saturday trip data processed for {count} areas in {season_str} in {record.formatted_wall_time}.')
                     logger.info('')
 
             if 'thursday' in self.days:
-                if season_thursday_stats_cache_path.exists():
-                    with open(season_thursday_stats_cache_path, 'r') as file:
-                        thursday_stats = json.load(file)
-                        statistics['thursday_trip'][season_str] = thursday_stats[season_str]
+                # flag the trips in each area before the trips are fingerprinted
+                # since the flags are written to the full area trip chunks
+                with stage(f'thursday_trip_membership__{season_str}'):
+                    self.annotate_area_membership('thursday', _season)
+
+                thursday_stats_key = f'replica/thursday_trip_stats/{season_str}'
+                thursday_stats_fingerprint = self._fingerprint([_season], self._season_input_paths(
+                    _season, ['walk_service_area', 'bike_service_area', 'thursday_trip']))
+                cached_thursday_stats = self._load_statistics('thursday_stats', season_areas_hash, season_str) \
+                    if self.manifest.is_fresh(thursday_stats_key, thursday_stats_fingerprint) else None
+                if cached_thursday_stats is not None:
+                    statistics['thursday_trip'][season_str] = cached_thursday_stats[season_str]
 
-                        logger.info(
-                            f'Thursday trip stats retrieved for {season_str} from the cache. [Cache ID: {season_areas_hash}]')
+                    logger.info(
+                        f'Thursday trip stats retrieved for {season_str} from the cache. [Cache ID: {season_areas_hash}]')
                 else:
-                    start_time = time.time()
-
-                    [count, thursday_stats] = self.process_trips('thursday', [_season])
-                    statistics['thursday_trip'][season_str] = thursday_stats[season_str]
-
-                    elapsed_time = time.time() - start_time
-                    formatted_time = time.strftime("%H:%M:%S", time.gmtime(elapsed_time))
+                    with (reserve_memory(f'thursday_trip_stats__{season_str}', default=self.stage_memory),
+                          stage(f'thursday_trip_stats__{season_str}') as record):
+                        [count, thursday_stats] = self.process_trips('thursday', [_season])
+                        statistics['thursday_trip'][season_str] = thursday_stats[season_str]
 
-                    # save to cache
-                    with open(season_thursday_stats_cache_path, 'w') as file:
-                        json.dump(thursday_stats, file)
+                        # save to cache
+                        self._save_statistics('thursday_stats', season_areas_hash, thursday_stats, season_str)
+                        self.manifest.record(thursday_stats_key, thursday_stats_fingerprint, [
+                            self._area_trip_chunks_path('full_area', _season, 'thursday')
+                        ])
 
                     logger.info('')
                     logger.info(
-                        f'Thursday trip data processed for {count} areas in {season_str} in {formatted_time}.')
+                        f'Thursday trip data processed for {count} areas in {season_str} in {record.formatted_wall_time}.')
                     logger.info('')
 
         for _season in self.seasons:
             season_str = f"{_season['region']}_{_season['year']}_{_season['quarter']}"
             season_areas_hash = self.create_season_areas_hash(
                 [_season], [area_name for _, area_name in self.areas])
-            season_saturday_rider_stats_cache_path = self.output_folder / \
-                f'saturday_rider_stats_cache__{season_str}__{season_areas_hash}.json.tmp'
-            season_thursday_rider_stats_cache_path = self.output_folder / \
-                f'thursday_rider_stats_cache__{season_str}__{season_areas_hash}.json.tmp'
 
             # ensure the saturday and thursday trip keys exist
             statistics.setdefault('saturday_rider', {})
             statistics.setdefault('thursday_rider', {})
 
             if 'saturday' in self.days:
-                if season_saturday_rider_stats_cache_path.exists():
-                    with open(season_saturday_rider_stats_cache_path, 'r') as file:
-                        saturday_rider_stats = json.load(file)
-                        statistics['saturday_rider'][season_str] = saturday_rider_stats[season_str]
+                saturday_rider_stats_key = f'replica/saturday_rider_stats/{season_str}'
+                saturday_rider_stats_fingerprint = self._fingerprint([_season], [
+                    path
+                    for _, area_name in self.areas
+                    for path in [
+                        self.output_folder / area_name / 'population' / f'{season_str}_home.parquet',
+                        self._area_trip_chunks_path(area_name, _season, 'saturday'),
+                    ]
+                ])
+                cached_saturday_rider_stats = self._load_statistics('saturday_rider_stats', season_areas_hash, season_str) \
+                    if self.manifest.is_fresh(saturday_rider_stats_key, saturday_rider_stats_fingerprint) else None
+                if cached_saturday_rider_stats is not None:
+                    statistics['saturday_rider'][season_str] = cached_saturday_rider_stats[season_str]
 
-                        logger.info(
-                            f'Saturday rider stats retrieved for {season_str} from the cache. [Cache ID: {season_areas_hash}]')
+                    logger.info(
+                        f'Saturday rider stats retrieved for {season_str} from the cache. [Cache ID: {season_areas_hash}]')
                 else:
-                    start_time = time.time()
-
-                    [count, saturday_rider_stats] = self.calculate_public_transit_population_statistics(
-                        'saturday')
-                    statistics['saturday_rider'][season_str] = saturday_rider_stats[season_str]
-
-                    elapsed_time = time.time() - start_time
-                    formatted_time = time.strftime("%H:%M:%S", time.gmtime(elapsed_time))
+                    with (reserve_memory(f'saturday_rider_stats__{season_str}', default=self.stage_memory),
+                          stage(f'saturday_rider_stats__{season_str}') as record):
+                        [count, saturday_rider_stats] = self.calculate_public_transit_population_statistics(
+                            'saturday')
+                        statistics['saturday_rider'][season_str] = saturday_rider_stats[season_str]
 
-                    # save to cache
-                    with open(season_saturday_rider_stats_cache_path, 'w') as file:
-                        json.dump({season_str: saturday_rider_stats[season_str]}, file)
+                        # save to cache
+                        self._save_statistics('saturday_rider_stats', season_areas_hash,
+                                              {season_str: saturday_rider_stats[season_str]}, season_str)
+                        self.manifest.record(saturday_rider_stats_key, saturday_rider_stats_fingerprint, [])
 
                     logger.info('')
                     logger.info(
-                        f'Saturday rider data processed for {count} areas in {season_str} in {formatted_time}.')
+                        f'Saturday rider data processed for {count} areas in {season_str} in {record.formatted_wall_time}.')
                     logger.info('')
 
             if 'thursday' in self.days:
-                if season_thursday_rider_stats_cache_path.exists():
-                    with open(season_thursday_rider_stats_cache_path, 'r') as file:
-                        thursday_rider_stats = json.load(file)
-                        statistics['thursday_rider'][season_str] = thursday_rider_stats[season_str]
+                thursday_rider_stats_key = f'replica/thursday_rider_stats/{season_str}'
+                thursday_rider_stats_fingerprint = self._fingerprint([_season], [
+                    path
+                    for _, area_name in self.areas
+                    for path in [
+                        self.output_folder / area_name / 'population' / f'{season_str}_home.parquet',
+                        self._area_trip_chunks_path(area_name, _season, 'thursday'),
+                    ]
+                ])
+                cached_thursday_rider_stats = self._load_statistics('thursday_rider_stats', season_areas_hash, season_str) \
+                    if self.manifest.is_fresh(thursday_rider_stats_key, thursday_rider_stats_fingerprint) else None
+                if cached_thursday_rider_stats is not None:
+                    statistics['thursday_rider'][season_str] = cached_thursday_rider_stats[season_str]
 
-                        logger.info(
-                            f'Thursday rider stats retrieved for {season_str} from the cache. [Cache ID: {season_areas_hash}]')
+                    logger.info(
+                        f'Thursday rider stats retrieved for {season_str} from the cache. [Cache ID: {season_areas_hash}]')
                 else:
-                    start_time = time.time()
-
-                    [count, thursday_rider_stats] = self.calculate_public_transit_population_statistics(
-                        'thursday')
-                    statistics['thursday_rider'][season_str] = thursday_rider_stats[season_str]
-
-                    elapsed_time = time.time() - start_time
-                    formatted_time = time.strftime("%H:%M:%S", time.gmtime(elapsed_time))
+                    with (reserve_memory(f'thursday_rider_stats__{season_str}', default=self.stage_memory),
+                          stage(f'thursday_rider_stats__{season_str}') as record):
+                        [count, thursday_rider_stats] = self.calculate_public_transit_population_statistics(
+                            'thursday')
+                        statistics['thursday_rider'][season_str] = thursday_rider_stats[season_str]
 
-                    # save to cache
-                    with open(season_thursday_rider_stats_cache_path, 'w') as file:
-                        json.dump({season_str: thursday_rider_stats[season_str]}, file)
+                        # save to cache
+                        self._save_statistics('thursday_rider_stats', season_areas_hash,
+                                              {season_str: thursday_rider_stats[season_str]}, season_str)
+                        self.manifest.record(thursday_rider_stats_key, thursday_rider_stats_fingerprint, [])
 
                     logger.info('')
                     logger.info(
-                        f'Thursday rider data processed for {count} areas in {season_str} in {formatted_time}.')
+                        f'Thursday rider data processed for {count} areas in {season_str} in {record.formatted_wall_time}.')
                     logger.info('')
 
         # merge statistics for season + area combinations
@@ -276,12 +316,12 @@ class ReplicaProcessETL:
                 with open(statistics_path, 'w') as file:
                     json.dump(area_stats, file, indent=2)
 
-        start_time = time.time()
-        self.build_network_segments(self.days)
-        elapsed_time = time.time() - start_time
-        formatted_time = time.strftime("%H:%M:%S", time.gmtime(elapsed_time))
+        with (reserve_memory('network_segments', default=self.stage_memory),
+              stage('network_segments') as record):
+            self.build_network_segments(self.days)
+
         logger.info('')
-        logger.info(f'Network segments built in {formatted_time}.')
+        logger.info(f'Network segments built in {record.formatted_wall_time}.')
         logger.info('')
 
         # # discard the chunks since we no longer need them
@@ -303,6 +343,9 @@ class ReplicaProcessETL:
         """
         Create a hash based on the seasons and areas to ensure that the same
         data is not processed multiple times.
+
+        The hash only identifies the cache files. Whether a cache file can be
+        reused is determined by the build manifest (see `_fingerprint`).
         """
         # sort the seasons
         sorted_seasons = sorted(seasons, key=lambda s: (s['year'], s['quarter']), reverse=True)
@@ -315,10 +358,208 @@ class ReplicaProcessETL:
                     for season in sorted_seasons])
         return hashlib.md5(season_areas_string_to_hash.encode('utf8')).hexdigest()
 
-    def mp__process_population(self, shared_count: ValueProxy[int], shared_stats: DictProxy[str, Any]) -> None:
-        [count, population_stats] = self.process_population()
-        shared_count.value += count
-        shared_stats.update(population_stats.items())
+    def _fingerprint(self, seasons: list[Season], inputs: list[str] | list[Path]) -> str:
+        """
+        Compute the build manifest fingerprint for a processing step that
+        covers every area (see `_network_segments_record` for steps for one area).
+
+        The area GeoJSON files and the replica code are always included
+        in addition to the provided input files and folders.
+        """
+        return self.manifest.fingerprint(
+            inputs=[*(area_geojson_path for area_geojson_path, _ in self.areas), *inputs],
+            parameters={
+                'seasons': seasons,
+                'areas': [area_name for _, area_name in self.areas],
+            },
+            code=source_code_paths('replica'),
+        )
+
+    def _season_input_paths(self, season: Season, names: list[str]) -> list[Path]:
+        """
+        Get the paths of the input files for a season from the input file path templates.
+        """
+        paths: list[Path] = []
+        for name in names:
+            path = self.input_files[name].format(**season)  # type: ignore
+            if name == 'population' or name.endswith('_trip'):
+                # these templates are relative to the output folder
+                paths.append(self.output_folder / path)
+            else:
+                paths.append(Path(path))
+        return paths
+
+    def _area_trip_chunks_path(self, area_name: str, season: Season, day: Literal['saturday', 'thursday']) -> Path:
+        """
+        Get the folder containing the trip chunks for an area. Every area uses the
+        full area trip chunks, which flag the trips in each area (see `_area_filters`).
+        """
+        return self._season_input_paths(season, [f'{day}_trip'])[0]
+
+    def _legacy_area_trip_chunks_path(self, area_name: str, season: Season, day: Literal['saturday', 'thursday']) -> Path:
+        # the folder where older versions saved a filtered copy of the trip chunks for each area
+        return self.output_folder / area_name / f'{day}_trip' / \
+            f"{season['region']}_{season['year']}_{season['quarter']}" / '_chunks'
+
+    def _area_filters(self, area_name: str) -> Optional[list[tuple[str, str, Any]]]:
+        """
+        Get the Parquet filters that select the trips in an area from the trip
+        chunks of `_area_trip_chunks_path` (None for the full area).
+        """
+        return area_filters(area_name)
+
+    def _area_membership_hash(self) -> str:
+        """A hash of the names and geometry of the areas that the trips are flagged for."""
+        areas = [[area_name, self.manifest.hash_paths([area_geojson_path])]
+                 for area_geojson_path, area_name in self.areas if area_name != 'full_area']
+        return hashlib.md5(json.dumps(areas).encode('utf-8')).hexdigest()
+
+    def annotate_area_membership(self, day: Literal['saturday', 'thursday'], season: Season) -> int:
+        """
+        Flag the trips in each area in the full area trip chunks of a season (see
+        `write_area_membership`) so that the trips of an area are read from the full
+        area chunks with `_area_filters` instead of from a filtered copy for each area.
+
+        A chunk is only rewritten when the areas or the chunk itself changed since
+        its trips were flagged. The copies that older versions saved for each area
+        are removed.
+
+        Returns:
+            The number of chunks that were rewritten.
+        """
+        season_str = f"{season['region']}_{season['year']}_{season['quarter']}"
+        chunks_folder = self._area_trip_chunks_path('full_area', season, day)
+        chunk_paths = sorted(path for path in chunks_folder.glob('*.parquet') if not path.name.startswith('.'))
+        membership_hash = self._area_membership_hash()
+
+        def membership_tag(chunk_path: Path) -> str:
+            # rewriting a chunk (e.g., when it is downloaded again) changes its size or modification time
+            stat = chunk_path.stat()
+            return f'{membership_hash}:{stat.st_size}:{stat.st_mtime_ns}'
+
+        def trips_tag(chunk_path: Path) -> str:
+            # the chunk as it was before its trips were first flagged, which identifies its trips
+            # (flagging the trips again when the areas change rewrites the chunk but keeps its trips)
+            stat = chunk_path.stat()
+            checkpoint = self.checkpoints.get('area_membership', season=season_str, day=day, chunk=chunk_path.name)
+            if checkpoint is not None and checkpoint['result'] is not None \
+                    and checkpoint['tag'].endswith(f':{stat.st_size}:{stat.st_mtime_ns}'):
+                return checkpoint['result']['trips']
+            return f'{stat.st_size}:{stat.st_mtime_ns}'
+
+        for _, area_name in self.areas:
+            legacy_chunks_path = self._legacy_area_trip_chunks_path(area_name, season, day)
+            if area_name != 'full_area' and legacy_chunks_path.exists():
+                logger.info(f'  Removing the filtered copy of the {day} trips for {area_name}...')
+                shutil.rmtree(legacy_chunks_path, ignore_errors=True)
+                self.checkpoints.forget('filter_trips', season=season_str, area=area_name, day=day)
+
+        pending_paths = [
+            chunk_path for chunk_path in chunk_paths
+            if not self.checkpoints.is_complete('area_membership', season=season_str, day=day,
+                                                chunk=chunk_path.name, tag=membership_tag(chunk_path))
+        ]
+        if not pending_paths:
+            logger.info(f'  The {day} trips in {season_str} are already flagged for each area.')
+            return 0
+
+        # read the areas into one index in the CRS of the trips
+        geo_metadata = json.loads((pyarrow.parquet.read_schema(pending_paths[0]).metadata or {}).get(b'geo', b'{}'))
+        crs_json = geo_metadata.get('columns', {}).get('geometry', {}).get('crs')
+        trips_crs = CRS.from_json_dict(crs_json) if crs_json else CRS.from_epsg(4326)
+        area_index = AreaIndex.from_files(
+            [(path, name) for path, name in self.areas if name != 'full_area'], crs=trips_crs)
+
+        logger.info(f'  Flagging the {day} trips in {season_str} for {len(area_index)} areas...')
+        with logging_redirect_tqdm():
+            for index, chunk_path in enumerate(tqdm.tqdm(pending_paths, desc=f'Flagging trips in areas ({season_str} {day})',
+                                                         unit='chunk')):
+                report_progress(index, len(pending_paths))
+                chunk_trips_tag = trips_tag(chunk_path)
+                report_rows(rows_in=write_area_membership(chunk_path, area_index))
+                replace_with_partial(chunk_path)
+                self.checkpoints.commit('area_membership', season=season_str, day=day, chunk=chunk_path.name,
+                                        tag=membership_tag(chunk_path), outputs=[chunk_path],
+                                        result={'trips': chunk_trips_tag})
+                gc.collect()
+
+        return len(pending_paths)
+
+    def _trips_hash(self, season: Season, day: Literal['saturday', 'thursday']) -> str:
+        """
+        A hash of the trips in the full area trip chunks of a season, which does not
+        change when the chunks are rewritten to flag the trips in each area (see
+        `annotate_area_membership`), unlike a hash of the chunk files.
+        """
+        season_str = f"{season['region']}_{season['year']}_{season['quarter']}"
+        chunk_names = {path.name for path in self._area_trip_chunks_path('full_area', season, day).glob('*.parquet')}
+        trips = [
+            [checkpoint['chunk'], (checkpoint['result'] or {}).get('trips')]
+            for checkpoint in self.checkpoints.query('area_membership', season=season_str, day=day)
+            if checkpoint['chunk'] in chunk_names
+        ]
+        return hashlib.md5(json.dumps(trips).encode('utf-8')).hexdigest()
+
+    def _network_segments_record(self, area_name: str, season: Season, day: Literal['saturday', 'thursday']) -> tuple[str, str]:
+        """
+        Get the build manifest key and fingerprint for the network segments of an area.
+
+        The network segments of an area only depend on the trips and that area's
+        geometry (which determines the trips that are flagged for it), so adding,
+        removing, or changing other areas does not rebuild them.
+        """
+        key = f"replica/network_segments/{season['region']}_{season['year']}_{season['quarter']}/{area_name}/{day}"
+        fingerprint = self.manifest.fingerprint(
+            inputs=[path for path, name in self.areas if name == area_name and name != 'full_area'],
+            parameters={
+                'season': season,
+                'area': area_name,
+                'trips': self._trips_hash(season, day),
+            },
+            code=source_code_paths('replica'),
+        )
+        return key, fingerprint
+
+    def _network_segments_table_name(self, season: Season, day: Literal['saturday', 'thursday'], travel_mode: str) -> str:
+        """
+        Get the name of the network segments table for a travel mode ('' for all trips).
+        """
+        season_str = f"{season['region']}_{season['year']}_{season['quarter']}"
+        return f'{season_str}__{day}' if travel_mode == '' else f'{season_str}__{day}__commute__{travel_mode}'
+
+    def _legacy_statistics_cache_path(self, stage_name: str, cache_id: str, season_str: str = '') -> Path:
+        # the path where statistics were cached before the checkpoint store existed
+        return self.output_folder / f'{stage_name}_cache__{f'{season_str}__' if season_str else ''}{cache_id}.json.tmp'
+
+    def _load_statistics(self, stage_name: str, cache_id: str, season_str: str = '') -> Optional[Any]:
+        """
+        Get statistics that were saved to the checkpoint store by a previous run.
+        Returns None if there are no saved statistics.
+
+        Statistics that were cached in a .json.tmp file by older versions
+        are moved into the checkpoint store.
+        """
+        checkpoint = self.checkpoints.get(stage_name, season=season_str, chunk=cache_id)
+        if checkpoint is not None:
+            return checkpoint['result']
+
+        legacy_cache_path = self._legacy_statistics_cache_path(stage_name, cache_id, season_str)
+        if legacy_cache_path.exists():
+            with open(legacy_cache_path, 'r') as file:
+                statistics = json.load(file)
+            self.checkpoints.commit(stage_name, season=season_str, chunk=cache_id, result=statistics)
+            return statistics
+
+        return None
+
+    def _save_statistics(self, stage_name: str, cache_id: str, statistics: Any, season_str: str = '') -> None:
+        """Save statistics to the checkpoint store so that later runs can reuse them."""
+        self.checkpoints.commit(stage_name, season=season_str, chunk=cache_id, result=statistics)
+
+        # the legacy cache is replaced by the checkpoint
+        legacy_cache_path = self._legacy_statistics_cache_path(stage_name, cache_id, season_str)
+        if legacy_cache_path.exists():
+            legacy_cache_path.unlink()
 
     def filter_intersected(self, gdf_or_partitions_path: geopandas.GeoDataFrame | str, gdf_union: BaseGeometry) -> geopandas.GeoDataFrame:
         """Filter an input GeoDataFrame or folder of GeoDataFrame partitions to only include geometries that intersect with the gdf."""
@@ -330,6 +571,15 @@ class ReplicaProcessETL:
         # if the gdf is a GeoDataFrame, filter it
         return gdf_or_partitions_path[gdf_or_partitions_path.intersects(gdf_union)]
 
+    @staticmethod
+    def population_at(population_gdf: geopandas.GeoDataFrame, lng_column: str, lat_column: str) -> geopandas.GeoDataFrame:
+        """Get the population with the locations in the given coordinate columns (e.g., `lng_work` and `lat_work`) as the geometry."""
+        return geopandas.GeoDataFrame(
+            population_gdf.drop(columns='geometry'),
+            geometry=geopandas.points_from_xy(population_gdf[lng_column], population_gdf[lat_column]),
+            crs='EPSG:4326'
+        )
+
     def process_population(self) -> tuple[int, dict[str, Any]]:
         logger.info('Processing population data for the following regions and seasons:')
         for season in self.seasons:
@@ -348,9 +598,7 @@ class ReplicaProcessETL:
             quarter = season['quarter']
 
             input_files = {
-                'population_home': self.input_files['population_home'].format(region=region, year=year, quarter=quarter),
-                'population_school': self.input_files['population_school'].format(region=region, year=year, quarter=quarter),
-                'population_work': self.input_files['population_work'].format(region=region, year=year, quarter=quarter),
+                'population': self.input_files['population'].format(region=region, year=year, quarter=quarter),
                 'walk_service_area': self.input_files['walk_service_area'].format(region=region, year=year, quarter=quarter),
                 'bike_service_area': self.input_files['bike_service_area'].format(region=region, year=year, quarter=quarter),
             }
@@ -365,45 +613,36 @@ class ReplicaProcessETL:
             logger.info(f'Processing population data for {region} in {year} {quarter}')
             logger.info(f'  Opening season population data files...')
 
-            logger.info(f'    ...population data (home) [1/5]')
-            population_home_input_path = self.output_folder / input_files['population_home']
-            logger.debug(f'Population home input path: {population_home_input_path}')
-            population_home_gdf = geopandas.read_file(population_home_input_path)
+            # the geometry of the population file is the home location, and the
+            # school and work locations are only stored as coordinates
+            logger.info(f'    ...population data [1/3]')
+            population_input_path = self.output_folder / input_files['population']
+            logger.debug(f'Population input path: {population_input_path}')
+            population_home_gdf = geopandas.read_parquet(population_input_path).drop(columns='bbox', errors='ignore')
             population_home_gdf = drop_duplicate_columns(population_home_gdf)
 
-            logger.info(f'    ...population data (school) [2/5]')
-            publication_school_input_path = self.output_folder / input_files['population_school']
-            logger.debug(f'Population school input path: {publication_school_input_path}')
-            population_school_gdf = geopandas.read_file(publication_school_input_path)
-            population_school_gdf = drop_duplicate_columns(population_school_gdf)
-
-            logger.info(f'    ...population data (work) [3/5]')
-            population_work_input_path = self.output_folder / input_files['population_work']
-            logger.debug(f'Population work input path: {population_work_input_path}')
-            population_work_gdf = geopandas.read_file(population_work_input_path)
-            population_work_gdf = drop_duplicate_columns(population_work_gdf)
+            logger.debug(f'Creating the school and work locations...')
+            population_school_gdf = self.population_at(population_home_gdf, 'lng_school', 'lat_school')
+            population_work_gdf = self.population_at(population_home_gdf, 'lng_work', 'lat_work')
 
-            logger.info(f'    ...walking service area [4/5]')
+            logger.info(f'    ...walking service area [2/3]')
             walk_input_path = input_files['walk_service_area']
             logger.debug(f'Walking service area input path: {walk_input_path}')
-            walk_gdf = geopandas.read_file(walk_input_path)
+            walk_service_area = dissolved_geometry(walk_input_path)
 
-            logger.info(f'    ...biking service area [5/5]')
+            logger.info(f'    ...biking service area [3/3]')
             bike_input_path = input_files['bike_service_area']
             logger.debug(f'Biking service area input path: {bike_input_path}')
-            bike_gdf = geopandas.read_file(bike_input_path)
+            bike_service_area = dissolved_geometry(bike_input_path)
 
-            for [area_geojson_path, area_name] in self.areas:
+            for area_index, [area_geojson_path, area_name] in enumerate(self.areas):
                 logger.info(f'  Processing area: {area_name}')
+                report_progress(area_index, len(self.areas))
 
                 # open the geojson file
                 logger.debug(f'    Reading area GeoJSON: {area_geojson_path.as_posix()}')
-                gdf = geopandas.read_file(area_geojson_path).to_crs(epsg=4326)
-                logger.debug(
-                    f'    Area GeoDataFrame has {gdf.shape[0]} rows and {gdf.shape[1]} columns.')
-                logger.debug(f'    Area GeoDataFrame CRS: {gdf.crs}')
                 logger.debug(f'    Creating union of area geometries for filtering.')
-                gdf_union = gdf.geometry.union_all()
+                gdf_union = dissolved_geometry(area_geojson_path, crs='EPSG:4326')
 
                 # clip all of the geodataframes such that they are only within
                 # the area for the current geojson file
@@ -443,20 +682,23 @@ class ReplicaProcessETL:
                 # count households and population covered by the service areas (home-based)
                 logger.debug('Counting households and population in service areas...')
 
+                is_in_walk_service_area = population_home_filtered_gdf.intersects(walk_service_area)
+                is_in_bike_service_area = population_home_filtered_gdf.intersects(bike_service_area)
+
                 statistics['synthetic_demographics']['households_in_service_area'] = {}
                 statistics['synthetic_demographics']['households_in_service_area']['walk'] = population_home_filtered_gdf[
-                    population_home_filtered_gdf.intersects(walk_gdf.union_all())
+                    is_in_walk_service_area
                 ]['household_id'].nunique()
                 statistics['synthetic_demographics']['households_in_service_area']['bike'] = population_home_filtered_gdf[
-                    population_home_filtered_gdf.intersects(bike_gdf.union_all())
+                    is_in_bike_service_area
                 ]['household_id'].nunique()
 
                 statistics['synthetic_demographics']['population_in_service_area'] = {}
                 statistics['synthetic_demographics']['population_in_service_area']['walk'] = population_home_filtered_gdf[
-                    population_home_filtered_gdf.intersects(walk_gdf.union_all())
+                    is_in_walk_service_area
                 ]['person_id'].nunique()
                 statistics['synthetic_demographics']['population_in_service_area']['bike'] = population_home_filtered_gdf[
-                    population_home_filtered_gdf.intersects(bike_gdf.union_all())
+                    is_in_bike_service_area
                 ]['person_id'].nunique()
 
                 # save the statistics to the all_statistics dictionary so we can access them later
@@ -470,9 +712,9 @@ class ReplicaProcessETL:
                 logger.info(f'  Saving data for {area_name}...')
                 logger.debug(f'    Saving area polygon GeoDataFrame...')
                 area_polygon_gdf = geopandas.GeoDataFrame(
-                    {'name': [area_name], 'geometry': gdf_union},
-                    crs=gdf.crs
-                ).to_crs('EPSG:4326')
+                    {'name': [area_name], 'geometry': [gdf_union]},
+                    crs='EPSG:4326'
+                )
                 self.parent._save(
                     area_polygon_gdf,
                     area_name,
@@ -592,16 +834,6 @@ class ReplicaProcessETL:
             logger.info(f'Processing trip data for {region} in {year} {quarter}')
             logger.info(f'  Opening season data files...')
 
-            logger.info(f'    ...walking service area [1/2]')
-            walk_input_path = inputs['walk_service_area']
-            logger.debug(f'          Walking service area input path: {walk_input_path}')
-            walk_gdf = geopandas.read_file(walk_input_path)
-
-            logger.info(f'    ...biking service area [2/2]')
-            bike_input_path = inputs['bike_service_area']
-            logger.debug(f'          Biking service area input path: {bike_input_path}')
-            bike_gdf = geopandas.read_file(bike_input_path)
-
             logger.info(f'  Staging trip data for {region} in {year} {quarter}...')
             trip_partitions_folder_path = self.output_folder / inputs['trips']
             logger.debug(f'    Trip partitions path: {trip_partitions_folder_path}')
@@ -613,175 +845,69 @@ class ReplicaProcessETL:
                 logger.warning(f'No CRS found for trip partitions. Setting to EPSG:4326.')
                 trips_crs = CRS.from_epsg(4326)
 
-            # open each chunk and filter it for each area
-            # and save the filtered chunks to a file
-            # for later combination
-            logger.info(f'  Filtering full area chunks for each area...')
-            with logging_redirect_tqdm():
-                chunk_size = 10
-                to_filter_count = math.ceil(
-                    partitioned_all_trips_dgdf.npartitions / chunk_size) * len(self.areas)
-                bar = tqdm.tqdm(
-                    desc=f'Filtering chunks ({year} {quarter} {day})', total=to_filter_count, unit='filter')
-                for index in range(0, partitioned_all_trips_dgdf.npartitions, chunk_size):
-                    output_chunk_index = int(index / chunk_size)  # starts at 1
-
-                    # select a slice of partitions
-                    start = index
-                    end = min(index + chunk_size, partitioned_all_trips_dgdf.npartitions)
-                    logger.debug(
-                        f'    --Slicing partitions {index + 1} through {end} of {partitioned_all_trips_dgdf.npartitions}...')
-                    partitions_slice = partitioned_all_trips_dgdf.partitions[start:end]
+            # flag the trips in each area in the full area chunks (if they are not already)
+            # so that the trips of each area can be read with filters
+            self.annotate_area_membership(day, season)
 
-                    for [area_geojson_path, area_name] in self.areas:
-                        if area_name == 'full_area':
-                            # skip the full area since it does not need to be filtered
-                            bar.update(1)
-                            continue
+            # the service areas and areas are dissolved and prepared once (and cached
+            # across days), with the service areas in the CRS of the trips
+            logger.info(f'    ...walking service area [1/2]')
+            walk_input_path = inputs['walk_service_area']
+            logger.debug(f'          Walking service area input path: {walk_input_path}')
+            walk_service_area = dissolved_geometry(walk_input_path, crs=trips_crs)
 
-                        def process_area():
-                            logger.info(f'    Processing area: {area_name}')
-                            chunk_name = f'{region}_{year}_{quarter}__chunk_{output_chunk_index + 1}'
-
-                            # skip the area if it is already complete
-                            complete_indicator_path = self.output_folder / area_name / \
-                                f'{day}_trip' / f'{region}_{year}_{quarter}' / \
-                                '_chunks' / f'{chunk_name}__{self.data_geo_hash}.success'
-                            if complete_indicator_path.exists():
-                                logger.debug(
-                                    f'      Skipping {area_name} since it is already complete.')
-                                return
-
-                            # open the geojson file
-                            logger.debug(
-                                f'      Reading area GeoJSON: {area_geojson_path.as_posix()}')
-                            gdf = geopandas.read_file(area_geojson_path).to_crs(epsg=4326)
-                            logger.debug(
-                                f'      Area GeoDataFrame has {gdf.shape[0]} rows and {gdf.shape[1]} columns.')
-                            logger.debug(f'        Area GeoDataFrame CRS: {gdf.crs}')
-                            logger.debug(
-                                f'        Creating union of area geometries for filtering.')
-                            gdf_union = gdf.geometry.union_all()
-
-                            # filter the partition for the current area
-                            logger.info(f'      Filtering partition for {area_name}...')
-                            filtered_partition_gdf = partitions_slice[partitions_slice.intersects(
-                                gdf_union)].compute()
-
-                            # save the filtered partition to a file
-                            logger.info(f'      Saving filtered partition for {area_name}...')
-                            self.parent._save(
-                                filtered_partition_gdf,
-                                area_name,
-                                chunk_name,
-                                f'{day}_trip/{region}_{year}_{quarter}/_chunks',
-                                'geoparquet',
-                                '        '
-                            )
-
-                            # create an indicator file to show that this chunk is processed
-                            # for the current area
-                            complete_indicator_path.touch(exist_ok=True)
-
-                            del gdf
-                            del gdf_union
-                            del filtered_partition_gdf
-                            gc.collect()
-
-                        process_area()
-                        bar.update(1)
+            logger.info(f'    ...biking service area [2/2]')
+            bike_input_path = inputs['bike_service_area']
+            logger.debug(f'          Biking service area input path: {bike_input_path}')
+            bike_service_area = dissolved_geometry(bike_input_path, crs=trips_crs)
 
-                bar.close()
+            area_geometries = {
+                area_name: dissolved_geometry(area_geojson_path, crs='EPSG:4326')
+                for area_geojson_path, area_name in self.areas
+            }
 
-            # calculate statistics for each area
+            # calculate the statistics for every area at once, reading each chunk only once
+            area_statistics = {area_name: TripStatistics() for _, area_name in self.areas}
+            chunk_paths = sorted(path for path in trip_partitions_folder_path.glob('*.parquet')
+                                 if not path.name.startswith('.'))
+            logger.info(f'  Calculating statistics for {len(self.areas)} areas from {len(chunk_paths)} chunks...')
             with logging_redirect_tqdm():
-                for [area_geojson_path, area_name] in tqdm.tqdm(self.areas, desc=f'Calculating {day} trip statistics ({year} {quarter} {day})', unit='area', position=1):
-                    logger.info(f'  Calculating statistics for {area_name}...')
-                    statistics: dict[Any, Any] = {
-                        'methods': {},
-                        'median_duration': {},
-                        'possible_conversions': {},
-                        'destination_building_use': {},
-                        'destination_building_use__by_tour_type': {},
-                    }
-
-                    logger.debug('    Reading areas trips chunks...')
-                    area_trips_chunks_path = trip_partitions_folder_path if area_name == 'full_area' else self.output_folder / \
-                        area_name / f'{day}_trip' / f'{region}_{year}_{quarter}' / '_chunks'
-                    logger.debug(f'      Area trips chunks path: {area_trips_chunks_path}')
-                    area_trips_chunks_ddf = cast(dask.dataframe.DataFrame,
-                                                 dask.dataframe.read_parquet(area_trips_chunks_path, columns=['tour_type', 'mode', 'duration_minutes', 'destination_building_use_l1', 'destination_building_use_l2', 'end_lng', 'end_lat']))
-                    area_trips_chunks_dgdf = cast(dask_geopandas.GeoDataFrame,
-                                                  dask_geopandas.read_parquet(area_trips_chunks_path, columns=['mode', 'geometry']))
-                    logger.debug(f'    Computing DataFrame...')
-                    trips_df = area_trips_chunks_ddf.compute()
-
-                    # count trip travel methods
-                    logger.debug('    Counting trip travel methods...')
-                    statistics['methods'] = count_trip_travel_methods(trips_df)
-
-                    # calculate median trip commute time
-                    logger.debug('    Calculating median trip commute time...')
-                    statistics['median_duration'] = count_median_commute_time(trips_df)
-
-                    # get destination building use for all trips
-                    logger.debug('    Counting destination building uses...')
-                    area_gdf = geopandas.read_file(area_geojson_path).to_crs(epsg=4326)
-                    statistics['destination_building_use'] = count_destination_building_use_in_service_area(
-                        trips_df, trips_crs, area_gdf, walk_gdf, bike_gdf)
-
-                    # get desintation building use by tour type for all trips
-                    statistics['destination_building_use__by_tour_type'] = count_destination_building_use_in_service_area_by_tour_type(
-                        trips_df, trips_crs, area_gdf, walk_gdf, bike_gdf)
-
-                    # count the possible conversions in chunks (the geometry column is required, but it is huge)
-                    logger.debug('    Counting possible conversions...')
-                    for partition in tqdm.tqdm(area_trips_chunks_dgdf.to_delayed(), desc=f'Counting possible conversions for {area_name} ({year} {quarter} {day})', unit='partition', position=0):
-                        logger.debug('      Computing partition...')
-                        partition_gdf = partition.compute()
-
-                        logger.debug('      Counting...')
-                        results = count_possible_conversions(partition_gdf, walk_gdf, bike_gdf)
-
-                        for via, count in results.items():
-                            if via not in statistics['possible_conversions']:
-                                statistics['possible_conversions'][via] = 0
-                            statistics['possible_conversions'][via] += count
-
-                        del partition_gdf
-                        del partition
-                        gc.collect()
-
-                    # save the statistics to the all_statistics dictionary so we can access them later
-                    logger.debug(f'    Statistics for {area_name} added to all_statistics.')
-                    season_str = f'{region}_{year}_{quarter}'
-                    if season_str not in all_statistics:
-                        all_statistics[season_str] = {}
-                    if area_name not in all_statistics[season_str]:
-                        all_statistics[season_str][area_name] = {}
-                    all_statistics[season_str][area_name][day + '_trip'] = statistics
-
-                    # TODO: do this with a non-column-filtered version of the trips_gdf
-                    # # save the trips GeoDataFrame to a file
-                    # # since we have already had to compute it
-                    # logger.info(f'    Saving trips data for {area_name}...')
-                    # self.parent._save(
-                    #     trips_gdf,
-                    #     area_name,
-                    #     f'{region}_{year}_{quarter}',
-                    #     f'{day}_trip',
-                    #     'geoparquet',
-                    #     '      ',
-                    # )
-
-                    processed_count += 1
-                    del area_trips_chunks_ddf
-                    del area_trips_chunks_dgdf
+                for index, chunk_path in enumerate(tqdm.tqdm(chunk_paths, desc=f'Calculating {day} trip statistics ({year} {quarter} {day})', unit='chunk')):
+                    report_progress(index, len(chunk_paths))
+
+                    # only read the flags of the areas and the columns that the statistics need
+                    area_columns = {area_name: area_column(area_name) for _, area_name in self.areas
+                                    if area_name != 'full_area'}
+                    chunk_table = pyarrow.parquet.read_table(
+                        chunk_path, columns=[*TRIP_STATISTICS_COLUMNS, *area_columns.values()])
+                    report_rows(rows_in=chunk_table.num_rows)
+
+                    # find whether the trips are in the service areas once for every area
+                    is_in_areas = {area_name: chunk_table.column(column).to_numpy(zero_copy_only=False)
+                                   for area_name, column in area_columns.items()}
+                    trips_df = flag_service_area_trips(
+                        chunk_table.select(TRIP_STATISTICS_COLUMNS).to_pandas(),
+                        walk_service_area, bike_service_area)
+                    del chunk_table
+
+                    for area_name, statistics in area_statistics.items():
+                        is_in_area = is_in_areas.get(area_name)
+                        area_trips_df = trips_df if is_in_area is None else trips_df[is_in_area]
+                        statistics.update(area_trips_df, shapely.contains_xy(
+                            area_geometries[area_name],
+                            area_trips_df['end_lng'].to_numpy(dtype=float, na_value=numpy.nan),
+                            area_trips_df['end_lat'].to_numpy(dtype=float, na_value=numpy.nan)))
+
+                    del trips_df
+                    del is_in_areas
                     gc.collect()
 
-            del walk_gdf
-            del bike_gdf
-            gc.collect()
+            # save the statistics to the all_statistics dictionary so we can access them later
+            season_str = f'{region}_{year}_{quarter}'
+            for area_name, statistics in area_statistics.items():
+                logger.debug(f'    Statistics for {area_name} added to all_statistics.')
+                all_statistics.setdefault(season_str, {}).setdefault(area_name, {})[day + '_trip'] = statistics.result()
+                processed_count += 1
 
         # return the statistics for all areas in this season so that we can access them later
         return (processed_count, all_statistics)
@@ -790,8 +916,7 @@ class ReplicaProcessETL:
         # build network segments for each area
         season_areas_days = list(itertools.product(
             self.seasons, [area_name for _, area_name in self.areas], days))
-        travel_modes = ['', 'biking', 'carpool', 'commercial', 'on_demand_auto',
-                        'other_travel_mode', 'private_auto', 'public_transit', 'walking']
+        travel_modes = self.travel_modes
         bar = tqdm.tqdm(desc=f'Building network segments', unit='mode',
                         total=len(season_areas_days) * len(travel_modes), position=1)
 
@@ -804,89 +929,112 @@ class ReplicaProcessETL:
                 logger.info(
                     f'Building network segments for {area_name} ({year} {quarter} {day})...')
 
-                logger.info('  Reading trips chunks...')
-                area_trips_chunks_path = self.output_folder / \
-                    area_name / f'{day}_trip' / f'{region}_{year}_{quarter}' / '_chunks'
-                if area_name == 'full_area':
-                    # use the unfiltered trips chunks for the full area (filtering was skipped because it was uncessary, so the path is different)
-                    area_trips_chunks_path = self.output_folder / \
-                        self.input_files['saturday_trip' if day == 'saturday' else 'thursday_trip'].format(
-                            region=region, year=year, quarter=quarter)
-                logger.debug(f'    Area trips chunks path: {area_trips_chunks_path}')
-                area_trips_chunks_dgdf = cast(dask_geopandas.GeoDataFrame,
-                                              dask_geopandas.read_parquet(area_trips_chunks_path, columns=['activity_id', 'tour_type', 'mode', 'geometry']))
-                logger.debug(
-                    f'    Area trips chunks GeoDataFrame has {area_trips_chunks_dgdf.shape[0]} rows and {area_trips_chunks_dgdf.shape[1]} columns.')
-                logger.debug(
-                    f'    Area trips chunks GeoDataFrame CRS: {area_trips_chunks_dgdf.crs.name}')
+                network_segments_key, network_segments_fingerprint = self._network_segments_record(
+                    area_name, season, day)
+                network_segments_outputs = [
+                    self.output_folder / area_name / 'network_segments' /
+                    f'{self._network_segments_table_name(season, day, travel_mode)}.vectortiles'
+                    for travel_mode in travel_modes
+                ]
+                if self.manifest.is_fresh(network_segments_key, network_segments_fingerprint):
+                    logger.info(f'  Skipping {area_name} ({year} {quarter} {day}) since it is up to date.')
+                    bar.update(len(travel_modes))
+                    continue
+
+                # when the trips changed since the tiles were built, the existing tiles are stale
+                overwrite_existing = overwrite or self.manifest.has_record(network_segments_key)
+
+                area_trips_chunks_path = self._area_trip_chunks_path(area_name, season, day)
+                area_trips_chunk_paths = list(sorted(area_trips_chunks_path.glob('*.parquet')))
+                trip_filters = self._area_filters(area_name)
+                logger.debug(f'    Area trips chunks path: {area_trips_chunks_path} (filters: {trip_filters})')
 
                 logger.info(f'  Building network segments...')
-                intermediate_chunks_folder = area_trips_chunks_path.parent / '_intermediate_segment_chunks'
-                os.makedirs(intermediate_chunks_folder, exist_ok=True)
-                has_exploded_and_hashed = False  # expoding and hashing is expensive, so we only want to do it once
+                # the intermediate chunks of older versions, which exploded and hashed the trip geometry
+                legacy_intermediate_chunks_folder = self.output_folder / area_name / f'{day}_trip' / \
+                    f'{region}_{year}_{quarter}' / '_intermediate_segment_chunks'
+                area_trips_chunks_rows: Optional[int] = None
+
+                # the segment frequencies of every travel mode are counted together the
+                # first time that they are needed, so the trips are only read once
+                segment_store = self.parent._network_segment_store(year, quarter)
+                segment_frequencies: Optional[dict[str, tuple[numpy.ndarray, numpy.ndarray]]] = None
+
+                # the units of work for this season, area, and day in the checkpoint store
+                unit = {'season': f'{region}_{year}_{quarter}', 'area': area_name, 'day': day}
+
                 for index, travel_mode in enumerate(travel_modes):
+                    full_table_name = self._network_segments_table_name(season, day, travel_mode)
                     if travel_mode == '':
-                        full_table_name = f'{region}_{year}_{quarter}__{day}'
                         bar_label = f'{area_name} ({quarter} {year})'
                     else:
-                        full_table_name = f'{region}_{year}_{quarter}__{day}__commute__{travel_mode}'
                         bar_label = f'{area_name} ({quarter} {year}) (commute:{travel_mode})'
 
                     tile_folder_path = tile_folder_path = self.output_folder / \
                         area_name / 'network_segments' / full_table_name
                     vectortiles_filename = f'{tile_folder_path}.vectortiles'
-                    vectortiles_empty_filename = f'{tile_folder_path}.vectortiles.null'
-                    if not overwrite:
-                        # skip if the vectortiles file already exists
-                        if os.path.exists(vectortiles_filename):
+                    legacy_vectortiles_empty_filename = f'{tile_folder_path}.vectortiles.null'
+                    tiles_chunk = travel_mode or 'all'
+                    if not overwrite_existing:
+                        # adopt tiles that were built by older versions (the legacy .null
+                        # marker is kept because the build manifest may list it as an output)
+                        if not self.checkpoints.query('network_segments', **unit, chunk=tiles_chunk):
+                            self.checkpoints.adopt_marker(vectortiles_filename, 'network_segments', **unit,
+                                                          chunk=tiles_chunk, outputs=[vectortiles_filename],
+                                                          remove_marker=False)
+                            self.checkpoints.adopt_marker(legacy_vectortiles_empty_filename, 'network_segments',
+                                                          **unit, chunk=tiles_chunk, remove_marker=False)
+
+                        # skip if the vectortiles were already built or explicitly have no data
+                        tiles_checkpoint = self.checkpoints.get('network_segments', **unit, chunk=tiles_chunk)
+                        if tiles_checkpoint is not None:
                             logger.info(
-                                f'    Skipping {bar_label} since vectortiles file already exists.')
+                                f'    Skipping {bar_label} since {'it has no vector data' if tiles_checkpoint['outputs'] == [] else 'vectortiles file already exists'}.')
                             bar.update(1)
                             continue
 
-                        # skip if the vectortiles explicitly have no data
-                        if os.path.exists(vectortiles_empty_filename):
-                            logger.info(
-                                f'    Skipping {bar_label} since null vectortiles file exists.')
-                            bar.update(1)
-                            continue
+                    # remove stale tiles so that only the result of this run remains
+                    self.checkpoints.forget('network_segments', **unit, chunk=tiles_chunk)
+                    for stale_filename in [vectortiles_filename, legacy_vectortiles_empty_filename]:
+                        if os.path.exists(stale_filename):
+                            os.remove(stale_filename)
+
+                    # each travel mode reads all of the area's trips (they are filtered while counting)
+                    if area_trips_chunks_rows is None:
+                        area_trips_chunks_rows = count_area_rows(area_trips_chunk_paths, trip_filters)
+                    report_rows(rows_in=area_trips_chunks_rows)
+
+                    # calculate the frequencies of the network segments from the segment ids of the trips
+                    if segment_frequencies is None:
+                        frequency_bar = tqdm.tqdm(
+                            desc=f'Counting segment frequencies for {area_name} ({quarter} {year})',
+                            unit='chunk',
+                            total=len(area_trips_chunk_paths),
+                            leave=False,
+                            position=0,  # show above the other bar
+                        )
 
-                    os.makedirs('./data/tmp', exist_ok=True)
-                    output_file_path = tempfile.NamedTemporaryFile(
-                        suffix='.fgb', delete=False, dir='./data/tmp').name
-
-                    filter = None if travel_mode == '' else [
-                        ('mode', '==', travel_mode.upper()), ('tour_type', '==', 'COMMUTE')]
-
-                    # skip exploding and hashing if it has already been done
-                    done_chunks_count = len(list(area_trips_chunks_path.glob(
-                        f'*__{self.data_geo_hash}.success')))
-                    done_exploded_chunks_count = len(
-                        list(intermediate_chunks_folder.glob(f'*__{self.data_geo_hash}.success')))
-                    skip_explode = done_exploded_chunks_count > 0 and done_exploded_chunks_count == done_chunks_count
-
-                    # calculate the frequencies for the network segments (may be slow)
-                    frequency_bar = tqdm.tqdm(
-                        desc=f'Counting segment frequencies for {bar_label}',
-                        unit='step',
-                        leave=False,
-                        position=0,  # show above the other bar
-                    )
-                    for progress in count_segment_frequency_multi_input(
-                        list(sorted(area_trips_chunks_path.glob('*.parquet'))),
-                        output_file_path,
-                        log_space='    ',
-                        intermediate_chunks_folder=intermediate_chunks_folder.as_posix(),
-                        step1_columns=['activity_id', 'tour_type', 'mode', 'geometry'],
-                        skip_step_1=skip_explode or has_exploded_and_hashed,
-                        step_2_filter=filter,
-                        out_crs='EPSG:3857',
-                        success_hash=self.data_geo_hash,
-                    ):
-                        frequency_bar.update(progress[0] - frequency_bar.n)
-                        frequency_bar.total = progress[1]
-                    frequency_bar.close()
-                    has_exploded_and_hashed = True  # it is not possible to get here without having exploded and hashed
+                        def on_file_counted(counted: int, total: int) -> None:
+                            frequency_bar.update(counted - frequency_bar.n)
+                            report_progress(counted, total)
+
+                        segment_frequencies = count_edge_frequencies(
+                            area_trips_chunk_paths,
+                            segment_store,
+                            {
+                                travel_mode: None if travel_mode == '' else [
+                                    ('mode', '==', travel_mode.upper()), ('tour_type', '==', 'COMMUTE')]
+                                for travel_mode in travel_modes
+                            },
+                            filters=trip_filters,
+                            log_space='    ',
+                            on_file_counted=on_file_counted,
+                        )
+                        frequency_bar.close()
+
+                    segment_positions, segment_frequency = segment_frequencies[travel_mode]
+                    segments_gdf = edge_frequencies_to_gdf(
+                        segment_store, segment_positions, segment_frequency, out_crs='EPSG:3857')
 
                     # try to generate tiles for the network segments
                     logger.info(f'       ...generating tiles - {bar_label}')
@@ -900,25 +1048,25 @@ class ReplicaProcessETL:
                             position=0,  # show above the other bar
                         )
                         for current_percent_complete in to_vector_tiles(
-                                geopandas.read_file(output_file_path), f'Network Segments ({area_name}) ({quarter} {year})', full_table_name, tile_folder_path.as_posix(), 14):
+                                segments_gdf, f'Network Segments ({area_name}) ({quarter} {year})', full_table_name, tile_folder_path.as_posix(), 14):
                             tile_bar.update(current_percent_complete - tile_bar.n)
+                            report_progress(current_percent_complete, 100)
                         tile_bar.close()
 
                         # archive (no compression) the tiles folder
-                        if os.path.exists(vectortiles_filename):
-                            os.remove(vectortiles_filename)
-                        with tarfile.open(vectortiles_filename, 'w', format=tarfile.USTAR_FORMAT) as tar:
+                        with tarfile.open(partial_path(vectortiles_filename), 'w', format=tarfile.USTAR_FORMAT) as tar:
                             for name in os.listdir(tile_folder_path):
                                 path = os.path.join(tile_folder_path, name)
                                 tar.add(path, arcname=name)
+                        self.checkpoints.commit('network_segments', **unit, chunk=tiles_chunk,
+                                                outputs=[vectortiles_filename])
 
                     except NoVectorDataError:
                         logger.warning(
                             f'    No vector data found for {bar_label}. Skipping tile generation.')
 
-                        # write an empty file to indicate that there are no data
-                        with open(vectortiles_empty_filename, 'w') as f:
-                            f.write('')
+                        # record that there are no data so that tile generation is not tried again
+                        self.checkpoints.commit('network_segments', **unit, chunk=tiles_chunk)
 
                         continue
 
@@ -928,22 +1076,58 @@ class ReplicaProcessETL:
                     finally:
                         # remove the tiles folder
                         shutil.rmtree(tile_folder_path, ignore_errors=True)
-
-                        # remove the output flatgeobuf file
-                        if os.path.exists(output_file_path):
-                            os.remove(output_file_path)
+                        del segments_gdf
 
                         # increment the main progress bar
                         bar.update(1)
 
-                # clean up: remove the intermediate chunks folder
-                if os.path.exists(intermediate_chunks_folder):
+                # clean up: remove the intermediate chunks of older versions
+                if os.path.exists(legacy_intermediate_chunks_folder):
                     logger.info(
-                        f'    Removing intermediate chunks folder: {intermediate_chunks_folder}')
-                    shutil.rmtree(intermediate_chunks_folder, ignore_errors=True)
+                        f'    Removing intermediate chunks folder: {legacy_intermediate_chunks_folder}')
+                    shutil.rmtree(legacy_intermediate_chunks_folder, ignore_errors=True)
+                self.checkpoints.forget('explode_segments', **unit)
+                del segment_frequencies
+
+                self.manifest.record(network_segments_key, network_segments_fingerprint,
+                                     network_segments_outputs)
 
         bar.close()
 
+    def plan_network_segments(self, days: list[Literal['saturday', 'thursday']]) -> list[PlannedUnit]:
+        """
+        List the units of work that `build_network_segments` would do without
+        doing them: one for each season, area, day, and travel mode.
+
+        A unit is cached when the build manifest confirms that the area's network
+        segments are up to date or, like `build_network_segments`, when its
+        tiles were already built and the trips have not changed since.
+        """
+        units: list[PlannedUnit] = []
+        for season, area_name, day in itertools.product(self.seasons, [area_name for _, area_name in self.areas], days):
+            network_segments_key, network_segments_fingerprint = self._network_segments_record(area_name, season, day)
+            is_fresh = self.manifest.is_fresh(network_segments_key, network_segments_fingerprint)
+            overwrite_existing = self.manifest.has_record(network_segments_key)
+
+            area_trips_chunks_path = self._area_trip_chunks_path(area_name, season, day)
+            input_bytes = path_bytes([area_trips_chunks_path])
+            estimated_rows = count_parquet_rows([area_trips_chunks_path])
+
+            unit = {'season': f"{season['region']}_{season['year']}_{season['quarter']}", 'area': area_name, 'day': day}
+            for travel_mode in self.travel_modes:
+                vectortiles_filename = self.output_folder / area_name / 'network_segments' / \
+                    f'{self._network_segments_table_name(season, day, travel_mode)}.vectortiles'
+                tiles_exist = self.checkpoints.get('network_segments', **unit, chunk=travel_mode or 'all') is not None \
+                    or vectortiles_filename.exists() or Path(f'{vectortiles_filename}.null').exists()
+                units.append(PlannedUnit(
+                    stage='process/network_segments',
+                    unit=f"{unit['season']} {area_name} {day} {travel_mode or 'all trips'}",
+                    cached=is_fresh or (not overwrite_existing and tiles_exist),
+                    input_bytes=input_bytes,
+                    estimated_rows=estimated_rows,
+                ))
+        return units
+
     def calculate_public_transit_population_statistics(self, day: Literal['saturday', 'thursday']) -> tuple[int, dict[Any, Any]]:
         # create a statistics dictionary to hold the statistics for each area+seaso
         all_statistics: dict[Any, Any] = {}
@@ -959,9 +1143,7 @@ class ReplicaProcessETL:
 
                 area_population_path = self.output_folder / area_name / \
                     'population' / f'{region}_{year}_{quarter}_home.parquet'
-                area_trip_chunks_folder_path = self.output_folder / 'full_area' / \
-                    f'{day}_trip' / '_chunks' / f'{region}_{year}_{quarter}_{day}_trip' if area_name == 'full_area' else self.output_folder / \
-                    area_name / f'{day}_trip' / f'{region}_{year}_{quarter}' / '_chunks'
+                area_trip_chunks_folder_path = self._area_trip_chunks_path(area_name, season, day)
                 area_trip_chunk_paths = list(area_trip_chunks_folder_path.glob('*.parquet'))
 
                 area_statistics: dict[str, Any] = {}
@@ -969,10 +1151,11 @@ class ReplicaProcessETL:
                 for index, trip_chunk_path in enumerate(area_trip_chunk_paths):
                     logger.info(
                         f'  Processing trip chunk {index + 1} of {len(area_trip_chunk_paths)} for {area_name}...')
+                    report_progress(index, len(area_trip_chunk_paths))
 
                     logger.debug(f'    Reading trip chunk: {trip_chunk_path}')
                     trips_df = pandas.read_parquet(trip_chunk_path, columns=['person_id', 'mode'], filters=[
-                                                   ('mode', '==', 'PUBLIC_TRANSIT')])
+                                                   ('mode', '==', 'PUBLIC_TRANSIT'), *(self._area_filters(area_name) or [])])
                     logger.debug(
                         f'    Trip chunk has {trips_df.shape[0]} rows and {trips_df.shape[1]} columns.')
 
@@ -1032,6 +1215,25 @@ class ReplicaProcessETL:
         return (processed_count, all_statistics)
 
 
+def count_area_rows(paths: list[Path], filters: Optional[list[tuple[str, str, Any]]]) -> Optional[int]:
+    """
+    Count the rows of the parquet files that are in an area (see `area_filters`).
+    Only the area's membership column is read. Returns None if there are no files.
+    """
+    if not paths:
+        return None
+    if filters is None:
+        return count_parquet_rows(paths)
+    return pyarrow.dataset.dataset(paths, format='parquet').count_rows(
+        filter=pyarrow.parquet.filters_to_expression(filters))
+
+
+def _prepared_geometry(gdf_or_geometry: geopandas.GeoDataFrame | BaseGeometry) -> BaseGeometry:
+    if isinstance(gdf_or_geometry, geopandas.GeoDataFrame):
+        return prepared_union(gdf_or_geometry.geometry)
+    return prepared_union(gdf_or_geometry)
+
+
 def count_trip_travel_methods(trips_df: pandas.DataFrame) -> dict[str, int]:
     """Count the number of trips for each travel method."""
 
@@ -1074,57 +1276,14 @@ def count_median_commute_time(trips_df: pandas.DataFrame) -> dict[str, float]:
     return stats
 
 
-def count_possible_conversions(trips_gdf: geopandas.GeoDataFrame, walk_gdf: geopandas.GeoDataFrame, bike_gdf: geopandas.GeoDataFrame) -> dict[Literal['via_walk', 'via_bike'], int]:
-    """Count the number of possible conversions for each travel method."""
-
-    # ensure CRS matches between trips and service areas
-    if trips_gdf.crs != walk_gdf.crs:
-        raise ValueError(
-            f"CRS mismatch: trips_gdf CRS is {trips_gdf.crs}, but walk service area CRS is {walk_gdf.crs}. Both must be the same for spatial join.")
-    if trips_gdf.crs != bike_gdf.crs:
-        raise ValueError(
-            f"CRS mismatch: trips_gdf CRS is {trips_gdf.crs}, but bike service area CRS is {bike_gdf.crs}. Both must be the same for spatial join.")
+def count_destination_building_use_in_service_area(trips_df: pandas.DataFrame, trips_crs: CRS, area_gdf: geopandas.GeoDataFrame | BaseGeometry, walk_gdf: geopandas.GeoDataFrame | BaseGeometry, bike_gdf: geopandas.GeoDataFrame | BaseGeometry) -> dict[Literal['via_walk', 'via_bike'], dict[Literal['type_counts', 'subtype_counts'], dict[str, int]]]:
+    """
+    Count the destination building uses for trips within the walking and biking service areas that currently use or could use public transit.
 
-    # dissolve the walk and bike service areas
-    walk_gdf = walk_gdf.dissolve().reset_index(drop=True)
-    bike_gdf = bike_gdf.dissolve().reset_index(drop=True)
-
-    stats: dict[Literal['via_walk', 'via_bike'], int] = {
-        'via_walk': 0,
-        'via_bike': 0,
-    }
-
-    # get the trips that are not public transit
-    transit_filter = (trips_gdf['mode'] != 'PUBLIC_TRANSIT')
-    non_public_transit_trips_gdf = trips_gdf[transit_filter].reset_index(drop=True)
-
-    # get the non-public transit trips that are within the walking service area
-    logger.debug(
-        '        Finding possible conversions for non-public transit trips within waking service area...')
-    trips_within_walk_service_area_gdf = geopandas.sjoin(
-        non_public_transit_trips_gdf,
-        walk_gdf,
-        how="inner",
-        predicate="within"
-    )
-    stats['via_walk'] = len(trips_within_walk_service_area_gdf)
-
-    # get the non-public transit trips that are within the biking service area
-    logger.debug(
-        '        Finding possible conversions for non-public transit trips within biking service area...')
-    trips_within_bike_service_area_gdf = geopandas.sjoin(
-        non_public_transit_trips_gdf,
-        bike_gdf,
-        how="inner",
-        predicate="within"
-    )
-    stats['via_bike'] = len(trips_within_bike_service_area_gdf)
-
-    return stats
-
-
-def count_destination_building_use_in_service_area(trips_df: pandas.DataFrame, trips_crs: CRS, area_gdf: geopandas.GeoDataFrame, walk_gdf: geopandas.GeoDataFrame, bike_gdf: geopandas.GeoDataFrame) -> dict[Literal['via_walk', 'via_bike'], dict[Literal['type_counts', 'subtype_counts'], dict[str, int]]]:
-    """Count the destination building uses for trips within the walking and biking service areas that currently use or could use public transit."""
+    The area and service areas may be GeoDataFrames or geometries that were
+    already dissolved and prepared (see `etl.geometry_cache`), which avoids
+    dissolving them again for every call.
+    """
 
     stats: dict[Literal['via_walk', 'via_bike'], dict[Literal['type_counts', 'subtype_counts'], dict[str, int]]] = {
         'via_walk': {'type_counts': {}, 'subtype_counts': {}},
@@ -1134,17 +1293,17 @@ def count_destination_building_use_in_service_area(trips_df: pandas.DataFrame, t
     end_points = as_points(trips_df, 'end_lng', 'end_lat', trips_crs)
 
     # filter the end points to only those within the area
-    mask = end_points.within(area_gdf.geometry.union_all()).reindex(
+    mask = end_points.within(_prepared_geometry(area_gdf)).reindex(
         trips_df.index, fill_value=False)
     trips_df = trips_df[mask]
 
     # get the trips that end within the walking service area
-    mask = end_points.within(walk_gdf.geometry.union_all()).reindex(
+    mask = end_points.within(_prepared_geometry(walk_gdf)).reindex(
         trips_df.index, fill_value=False)
     distinations_within_walk_service_area_gdf = trips_df[mask]
 
     # get the trips that end within the biking service area
-    mask = end_points.within(bike_gdf.geometry.union_all()).reindex(
+    mask = end_points.within(_prepared_geometry(bike_gdf)).reindex(
         trips_df.index, fill_value=False)
     destinations_within_bike_service_area_gdf = trips_df[mask]
 
@@ -1171,9 +1330,14 @@ def count_destination_building_use_in_service_area(trips_df: pandas.DataFrame, t
     return stats
 
 
-def count_destination_building_use_in_service_area_by_tour_type(trips_df: pandas.DataFrame, trips_crs: CRS, area_gdf: geopandas.GeoDataFrame, walk_gdf: geopandas.GeoDataFrame, bike_gdf: geopandas.GeoDataFrame) -> dict[str, dict[Literal['via_walk', 'via_bike'], dict[Literal['type_counts', 'subtype_counts'], dict[str, int]]]]:
+def count_destination_building_use_in_service_area_by_tour_type(trips_df: pandas.DataFrame, trips_crs: CRS, area_gdf: geopandas.GeoDataFrame | BaseGeometry, walk_gdf: geopandas.GeoDataFrame | BaseGeometry, bike_gdf: geopandas.GeoDataFrame | BaseGeometry) -> dict[str, dict[Literal['via_walk', 'via_bike'], dict[Literal['type_counts', 'subtype_counts'], dict[str, int]]]]:
     """Calls `count_destination_building_use_in_service_area` for each tour type and returns the results for each tour type in a dictionary."""
 
+    # dissolve and prepare the areas once for every tour type
+    area_geometry = _prepared_geometry(area_gdf)
+    walk_service_area = _prepared_geometry(walk_gdf)
+    bike_service_area = _prepared_geometry(bike_gdf)
+
     tour_types = trips_df['tour_type'].dropna().str.lower().unique()
 
     stats: dict[str, dict[Literal['via_walk', 'via_bike'],
@@ -1186,9 +1350,9 @@ def count_destination_building_use_in_service_area_by_tour_type(trips_df: pandas
         stats[tour_type] = count_destination_building_use_in_service_area(
             trips_df[filter],
             trips_crs,
-            area_gdf,
-            walk_gdf,
-            bike_gdf,
+            area_geometry,
+            walk_service_area,
+            bike_service_area,
         )
 
     return stats
@@ -0,0 +1,351 @@
+import json
+import os
+from typing import Any, Callable, Iterable, Iterator, Optional, Protocol
+
+import numpy
+import pyarrow
+import pyarrow.compute
+import pyarrow.parquet
+import shapely
+from pyproj import CRS
+
+from etl.checkpoints import partial_path, replace_with_partial
+
+TableTransform = Callable[[pyarrow.Table], pyarrow.Table]
+
+
+class ArrowBatchReader(Protocol):
+    """Reads the results of a query as Arrow record batches."""
+
+    def read_batches(self, query: str) -> Iterator[pyarrow.RecordBatch]: ...
+
+
+class BigQueryStorageReader:
+    """
+    Runs a query in BigQuery and reads its results with the BigQuery Storage
+    Read API as Arrow record batches, without converting them to pandas.
+
+    Only `max_queue_size` batches are buffered for each read stream, so the
+    memory used does not grow with the size of the results.
+    """
+
+    def __init__(self, project_id: str, credentials: Any = None, max_queue_size: int = 2) -> None:
+        self.project_id = project_id
+        self.credentials = credentials
+        self.max_queue_size = max_queue_size
+
+    def read_batches(self, query: str) -> Iterator[pyarrow.RecordBatch]:
+        # only import the BigQuery libraries when data are downloaded
+        from google.cloud import bigquery, bigquery_storage
+
+        client = bigquery.Client(project=self.project_id, credentials=self.credentials)
+        read_client = bigquery_storage.BigQueryReadClient(credentials=self.credentials)
+        try:
+            rows = client.query(query).result()
+            yield from rows.to_arrow_iterable(bqstorage_client=read_client, max_queue_size=self.max_queue_size)
+        finally:
+            client.close()
+
+
+class LocalArrowReader:
+    """
+    A stand-in for `BigQueryStorageReader` that reads local data instead of
+    running the query, so that the download path can be tested without BigQuery.
+
+    Args:
+        resolve: Returns the results of a query as the path to a Parquet file or as an Arrow table.
+        batch_rows: The number of rows in each batch.
+    """
+
+    def __init__(self, resolve: Callable[[str], str | os.PathLike[str] | pyarrow.Table], batch_rows: int = 65536) -> None:
+        self.resolve = resolve
+        self.batch_rows = batch_rows
+
+    def read_batches(self, query: str) -> Iterator[pyarrow.RecordBatch]:
+        results = self.resolve(query)
+        if isinstance(results, pyarrow.Table):
+            yield from results.to_batches(max_chunksize=self.batch_rows)
+        else:
+            yield from pyarrow.parquet.ParquetFile(results).iter_batches(batch_size=self.batch_rows)
+
+
+def stream_to_parquet(batches: Iterable[pyarrow.RecordBatch], outputs: dict[str, Optional[TableTransform]],
+                      batch_rows: int = 250000, empty_schema: Optional[pyarrow.Schema] = None,
+                      on_rows: Optional[Callable[[int], None]] = None) -> int:
+    """
+    Write record batches to one or more Parquet files as they arrive.
+
+    Batches are collected into row groups of `batch_rows` rows, and each row
+    group is transformed and written to every output before the next one is
+    collected, so only about one row group is held in memory at a time.
+
+    Each output is written to its partial path (see `etl.checkpoints.partial_path`).
+    Commit the outputs with `CheckpointStore.commit` to move them into place.
+
+    Args:
+        batches: The record batches to write.
+        outputs: The path of each output mapped to a transform that is applied to each row group before it is written to that output (or None to write it as it is).
+        batch_rows: The number of rows in each row group.
+        empty_schema: The schema of the results if there are no batches. If None, an output without columns is written.
+        on_rows: Called with the total number of rows read after each row group is written.
+
+    Returns:
+        The number of rows read.
+    """
+    writers: dict[str, pyarrow.parquet.ParquetWriter] = {}
+    pending: list[pyarrow.RecordBatch] = []
+    pending_rows = 0
+    total_rows = 0
+
+    def write(table: pyarrow.Table) -> None:
+        for output_path, transform in outputs.items():
+            output_table = transform(table) if transform is not None else table
+            if output_path in writers and not output_table.schema.equals(writers[output_path].schema):
+                try:
+                    output_table = cast_id_lists(output_table, writers[output_path].schema)
+                except ValueError:
+                    # an earlier row group has integer ids but this one does not (see
+                    # `encode_id_lists`), so write the earlier row groups again with string ids
+                    writers.pop(output_path).close()
+                    written_table = cast_id_lists(pyarrow.parquet.read_table(partial_path(output_path)),
+                                                  output_table.schema)
+                    writers[output_path] = pyarrow.parquet.ParquetWriter(
+                        partial_path(output_path), output_table.schema, compression='snappy')
+                    writers[output_path].write_table(written_table, row_group_size=batch_rows)
+                    del written_table
+            if output_path not in writers:
+                writers[output_path] = pyarrow.parquet.ParquetWriter(
+                    partial_path(output_path), output_table.schema, compression='snappy')
+            writers[output_path].write_table(output_table, row_group_size=batch_rows)
+
+    try:
+        schema: Optional[pyarrow.Schema] = None
+        for batch in batches:
+            schema = schema or batch.schema
+            if batch.num_rows == 0:
+                continue
+            pending.append(batch)
+            pending_rows += batch.num_rows
+            total_rows += batch.num_rows
+            if pending_rows < batch_rows:
+                continue
+
+            # write the full row groups and keep the rows that do not fill one for the next
+            table = pyarrow.Table.from_batches(pending)
+            full_rows = table.num_rows - table.num_rows % batch_rows
+            for offset in range(0, full_rows, batch_rows):
+                write(table.slice(offset, batch_rows))
+            remainder = table.slice(full_rows)
+            pending, pending_rows = remainder.to_batches(), remainder.num_rows
+            del table
+
+            if on_rows is not None:
+                on_rows(total_rows)
+        if pending:
+            write(pyarrow.Table.from_batches(pending))
+
+        # write the outputs even if there are no rows so that they can be read
+        if not writers:
+            write((schema or empty_schema or pyarrow.schema([])).empty_table())
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    return total_rows
+
+
+# matches the ids that are integers and are the same when they are converted back to strings
+INTEGER_ID_PATTERN = r'^(0|-?[1-9][0-9]{0,18})$'
+
+# the ids of id list columns that prefer integer ids but have ids that are not integers
+# (Parquet stores the dictionary of each column chunk once, so repeated ids stay small)
+STRING_ID_TYPE = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+
+
+def is_id_list(data_type: pyarrow.DataType, id_type: pyarrow.DataType) -> bool:
+    """
+    Whether a column type is a list of ids of `id_type` (whatever its list item
+    is named). Lists of integer ids may also be lists of `STRING_ID_TYPE` ids
+    (see `encode_id_lists`).
+    """
+    if not pyarrow.types.is_list(data_type):
+        return False
+    return data_type.value_type == id_type or (
+        pyarrow.types.is_integer(id_type) and data_type.value_type == STRING_ID_TYPE)
+
+
+def flatten_id_lists(lists: pyarrow.Array | pyarrow.ChunkedArray) -> tuple[pyarrow.Array, pyarrow.Array]:
+    """
+    Flatten a column of id lists of any id type (integers, strings, or
+    dictionary-encoded strings), leaving out the ids that are missing.
+
+    Returns:
+        The ids (integers or strings) and the position (row) of the list of each id.
+    """
+    if isinstance(lists, pyarrow.ChunkedArray):
+        lists = lists.combine_chunks()
+    ids = pyarrow.compute.list_flatten(lists)
+    parents = pyarrow.compute.list_parent_indices(lists)
+    if pyarrow.types.is_dictionary(ids.type):
+        ids = ids.cast(pyarrow.string())
+    is_id = ids.is_valid()
+    return ids.filter(is_id), parents.filter(is_id)
+
+
+def _integer_ids(ids: pyarrow.Array) -> Optional[pyarrow.Array]:
+    """Convert string ids to integers if every id is an integer that fits in an int64 (otherwise, None)."""
+    if len(ids) and not pyarrow.compute.all(pyarrow.compute.match_substring_regex(ids, INTEGER_ID_PATTERN)).as_py():
+        return None
+    try:
+        return ids.cast(pyarrow.int64())
+    except (pyarrow.ArrowInvalid, OverflowError):
+        return None
+
+
+def _id_lists(lists: pyarrow.Array, ids: pyarrow.Array, parents: pyarrow.Array) -> pyarrow.ListArray:
+    """Rebuild lists from their ids and the position of the list of each id (missing lists stay missing)."""
+    counts = numpy.bincount(parents.to_numpy(zero_copy_only=False), minlength=len(lists))
+    offsets = pyarrow.array(numpy.concatenate([[0], numpy.cumsum(counts)]), pyarrow.int32())
+    return pyarrow.ListArray.from_arrays(offsets, ids, mask=lists.is_null())
+
+
+def encode_id_lists(table: pyarrow.Table, columns: dict[str, pyarrow.DataType]) -> pyarrow.Table:
+    """
+    Store columns of id lists as lists of the given type, such as `list<int64>`
+    for network link ids or `list<string>` for transit route ids (which Parquet
+    dictionary-encodes when they are written).
+
+    Integer ids are chosen from the data, like the ids of a `NetworkSegmentStore`:
+    when an id of a column is not an integer (see `INTEGER_ID_PATTERN`) or does
+    not fit in an int64, the column is stored as lists of `STRING_ID_TYPE` ids
+    instead. Use `unify_id_lists` so that every file of a download has the same schema.
+
+    Columns may be lists of ids or comma-separated strings of ids (the format of
+    older downloads). Missing columns are ignored and missing lists stay missing.
+
+    Args:
+        table: The table with the id list columns.
+        columns: The name of each id list column mapped to the type of its ids.
+    """
+    for column, id_type in columns.items():
+        index = table.schema.get_field_index(column)
+        if index == -1 or is_id_list(table.schema.field(index).type, id_type):
+            continue
+
+        lists = table.column(index).combine_chunks()
+        if pyarrow.types.is_string(lists.type) or pyarrow.types.is_large_string(lists.type):
+            lists = pyarrow.compute.split_pattern(lists, ',')
+        ids, parents = flatten_id_lists(lists)
+        ids = ids.cast(pyarrow.string())
+
+        # drop empty ids (e.g., from trailing commas)
+        ids = pyarrow.compute.utf8_trim_whitespace(ids)
+        is_id = pyarrow.compute.not_equal(ids, '')
+        ids, parents = ids.filter(is_id), parents.filter(is_id)
+
+        if pyarrow.types.is_integer(id_type):
+            integer_ids = _integer_ids(ids)
+            ids = integer_ids.cast(id_type) if integer_ids is not None else ids.dictionary_encode()
+        else:
+            ids = ids.cast(id_type)
+
+        # rebuild the lists from the remaining ids of each row
+        table = table.set_column(index, column, _id_lists(lists, ids, parents))
+    return table
+
+
+def cast_id_lists(table: pyarrow.Table, schema: pyarrow.Schema) -> pyarrow.Table:
+    """
+    Convert the id list columns of a table to the id types of the same columns
+    in a schema (e.g., the schema of a file that the table is appended to).
+
+    Raises:
+        ValueError: If the schema has integer ids but an id of the table is not an integer.
+    """
+    for field in schema:
+        index = table.schema.get_field_index(field.name)
+        if index == -1 or table.schema.field(index).type == field.type or not pyarrow.types.is_list(field.type):
+            continue
+
+        lists = table.column(index).combine_chunks()
+        ids, parents = flatten_id_lists(lists)
+        if pyarrow.types.is_integer(field.type.value_type):
+            integer_ids = _integer_ids(ids.cast(pyarrow.string()))
+            if integer_ids is None:
+                raise ValueError(f"The '{field.name}' column has ids that are not integers.")
+            ids = integer_ids.cast(field.type.value_type)
+        elif field.type.value_type == STRING_ID_TYPE:
+            ids = ids.cast(pyarrow.string()).dictionary_encode()
+        else:
+            ids = ids.cast(field.type.value_type)
+        table = table.set_column(index, field.name, _id_lists(lists, ids, parents))
+    return table
+
+
+def unify_id_lists(paths: list[str], columns: dict[str, pyarrow.DataType]) -> None:
+    """
+    Make the id list columns of several Parquet files (e.g., the chunks or
+    shards of a download) have the same type so that they can be read together.
+
+    When a column is stored with integer ids in some files and with
+    `STRING_ID_TYPE` ids in others (see `encode_id_lists`), the files with
+    integer ids are rewritten with string ids.
+    """
+    schemas = {path: pyarrow.parquet.read_schema(path) for path in paths}
+    for column, id_type in columns.items():
+        if not pyarrow.types.is_integer(id_type):
+            continue
+        def has_string_ids(schema: pyarrow.Schema) -> bool:
+            return column in schema.names and pyarrow.types.is_list(schema.field(column).type) \
+                and schema.field(column).type.value_type == STRING_ID_TYPE
+
+        if not any(has_string_ids(schema) for schema in schemas.values()):
+            continue
+
+        for path, schema in schemas.items():
+            if column not in schema.names or has_string_ids(schema):
+                continue
+            table = cast_id_lists(pyarrow.parquet.read_table(path),
+                                  pyarrow.schema([pyarrow.field(column, pyarrow.list_(STRING_ID_TYPE))]))
+            pyarrow.parquet.write_table(table, partial_path(path), compression='snappy')
+            replace_with_partial(path)
+            schemas[path] = table.schema
+
+
+def with_geometry(table: pyarrow.Table, geometry: numpy.ndarray, geometry_types: list[str],
+                  crs: str = 'EPSG:4326') -> pyarrow.Table:
+    """
+    Add a WKB `geometry` column and a `bbox` covering column to a table, along
+    with the GeoParquet 1.1 metadata that geopandas uses to read it as a
+    GeoDataFrame (the same layout that `GeoDataFrame.to_parquet` writes with
+    `write_covering_bbox=True`).
+
+    Args:
+        table: The table to add the geometry to.
+        geometry: The shapely geometry for each row of the table.
+        geometry_types: The GeoParquet geometry types (e.g., `['Point']`), or an empty list if they are not known. This must be the same for every row group of a file.
+        crs: The coordinate reference system of the geometry.
+    """
+    bounds = shapely.bounds(geometry)
+    bbox = pyarrow.StructArray.from_arrays(
+        [pyarrow.array(bounds[:, index], pyarrow.float64()) for index in range(4)],
+        names=['xmin', 'ymin', 'xmax', 'ymax'],
+    )
+    table = table.append_column('geometry', pyarrow.array(shapely.to_wkb(geometry), pyarrow.binary()))
+    table = table.append_column('bbox', bbox)
+
+    geo_metadata = {
+        'version': '1.1.0',
+        'primary_column': 'geometry',
+        'columns': {
+            'geometry': {
+                'encoding': 'WKB',
+                'geometry_types': geometry_types,
+                'crs': CRS(crs).to_json_dict(),
+                'covering': {
+                    'bbox': {name: ['bbox', name] for name in ['xmin', 'ymin', 'xmax', 'ymax']},
+                },
+            },
+        },
+    }
+    return table.replace_schema_metadata({**(table.schema.metadata or {}), b'geo': json.dumps(geo_metadata).encode()})
@@ -3,10 +3,13 @@ from typing import Literal, Optional
 
 from etl.sources.replica.etl import ReplicaETL
 
-after = ['greenlink_gtfs']
+after = ['greenlink_gtfs', 'passthrough']
 
+# the replica process itself (the heavy downloads and stages inside of it reserve their own memory)
+peak_memory = '4G'
 
-def source_runner():
+
+def create_replica_etl() -> ReplicaETL:
     REPLICA_YEARS_FILTER = os.getenv('REPLICA_YEARS_FILTER') or None
     years: Optional[list[int]] = None
     if REPLICA_YEARS_FILTER is not None:
@@ -25,4 +28,12 @@ def source_runner():
                     'network_link_ids', 'vehicle_type', 'start_local_hour',
                     'end_local_hour', 'duration_minutes',
                     'destination_building_use_l1', 'destination_building_use_l2',]
-    ReplicaETL(trip_columns, years, quarters).run()
+    return ReplicaETL(trip_columns, years, quarters)
+
+
+def source_runner():
+    create_replica_etl().run()
+
+
+def source_plan():
+    return create_replica_etl().plan()
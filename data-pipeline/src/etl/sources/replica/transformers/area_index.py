@@ -0,0 +1,141 @@
+import os
+from pathlib import Path
+from typing import Any, Optional
+
+import geopandas
+import numpy
+import pyarrow
+import pyarrow.parquet
+import shapely
+from pyproj import CRS
+
+from etl.checkpoints import partial_path
+
+# the prefix of the columns that flag the trips in each area
+AREA_COLUMN_PREFIX = 'in_area__'
+
+
+def area_column(area_name: str) -> str:
+    """The name of the boolean column that is true for the rows in an area (see `write_area_membership`)."""
+    return f'{AREA_COLUMN_PREFIX}{area_name}'
+
+
+def area_filters(area_name: str) -> Optional[list[tuple[str, str, Any]]]:
+    """
+    The Parquet filters that select the rows in an area from files with area
+    membership columns (see `write_area_membership`). The filters can be passed
+    to pandas, geopandas, pyarrow, and dask when reading the files.
+
+    Returns:
+        The filters, or None for the full area, which includes every row.
+    """
+    if area_name == 'full_area':
+        return None
+    return [(area_column(area_name), '==', True)]
+
+
+class AreaIndex:
+    """
+    A spatial index of the polygons of many interest areas, so that geometries
+    can be assigned to every area they intersect with one bulk query instead of
+    one intersection test per area.
+
+    The polygons of each area are split into their parts and stored in a single
+    STRtree, so a geometry is only tested against the parts whose bounding boxes
+    it overlaps.
+    """
+
+    def __init__(self, names: list[str], polygons: numpy.ndarray, polygon_areas: numpy.ndarray) -> None:
+        self.names = names
+        self.polygon_areas = polygon_areas
+        self.tree = shapely.STRtree(polygons)
+
+    @classmethod
+    def from_files(cls, areas: list[tuple[Path, str]], crs: Any = 'EPSG:4326') -> 'AreaIndex':
+        """
+        Read the polygons of areas from their GeoJSON files.
+
+        Args:
+            areas: The path of the GeoJSON file and the name of each area.
+            crs: The coordinate reference system of the geometries that will be assigned to the areas.
+        """
+        names: list[str] = []
+        polygons: list[numpy.ndarray] = []
+        polygon_areas: list[numpy.ndarray] = []
+        for area_index, (area_geojson_path, area_name) in enumerate(areas):
+            area_gdf = geopandas.read_file(os.fspath(area_geojson_path)).to_crs(CRS(crs))
+            parts = area_gdf.geometry[area_gdf.geometry.notna() & ~area_gdf.geometry.is_empty] \
+                .explode(ignore_index=True).to_numpy()
+            names.append(area_name)
+            polygons.append(parts)
+            polygon_areas.append(numpy.full(len(parts), area_index, dtype=numpy.int64))
+
+        return cls(
+            names,
+            numpy.concatenate(polygons) if polygons else numpy.array([], dtype=object),
+            numpy.concatenate(polygon_areas) if polygon_areas else numpy.array([], dtype=numpy.int64),
+        )
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def query(self, geometry: Any) -> tuple[numpy.ndarray, numpy.ndarray]:
+        """
+        Find every area that each geometry intersects.
+
+        Returns:
+            The positions of the geometries and the positions of the areas (in
+            `names`) of each intersecting pair, sorted by geometry and then by
+            area. Each pair appears once, even if the geometry intersects
+            several parts of the area. Missing geometries do not intersect any area.
+        """
+        geometry_positions, polygon_positions = self.tree.query(
+            numpy.asarray(geometry, dtype=object), predicate='intersects')
+        pairs = numpy.unique(numpy.stack([geometry_positions, self.polygon_areas[polygon_positions]], axis=1), axis=0)
+        return pairs[:, 0], pairs[:, 1]
+
+    def rows_by_area(self, geometry: Any) -> dict[str, numpy.ndarray]:
+        """
+        Find the geometries that intersect each area.
+
+        Returns:
+            The name of each area mapped to the positions of the geometries that
+            intersect it, in their original order.
+        """
+        geometry_positions, area_positions = self.query(geometry)
+        order = numpy.argsort(area_positions, kind='stable')
+        bounds = numpy.searchsorted(area_positions[order], numpy.arange(len(self.names) + 1))
+        return {
+            name: geometry_positions[order[bounds[index]:bounds[index + 1]]]
+            for index, name in enumerate(self.names)
+        }
+
+
+def write_area_membership(path: str | os.PathLike[str], area_index: AreaIndex) -> int:
+    """
+    Add a boolean column for each area of an index to a GeoParquet file that
+    is true for the rows whose geometry intersects the area (see `area_column`).
+    Columns for areas that are no longer in the index are removed.
+
+    Parquet stores boolean columns as bit-packed, run-length encoded values,
+    so the columns add about one bit per row for each area, and the rows of
+    an area can be read with the filters from `area_filters`.
+
+    The file is written to its partial path (see `etl.checkpoints.partial_path`).
+    Commit it with `CheckpointStore.commit` to move it into place.
+
+    Returns:
+        The number of rows in the file.
+    """
+    table = pyarrow.parquet.read_table(path)
+    table = table.drop_columns([name for name in table.column_names if name.startswith(AREA_COLUMN_PREFIX)])
+
+    geometry = shapely.from_wkb(table.column('geometry').to_numpy(zero_copy_only=False))
+    for name, rows in area_index.rows_by_area(geometry).items():
+        is_in_area = numpy.zeros(table.num_rows, dtype=bool)
+        is_in_area[rows] = True
+        table = table.append_column(area_column(name), pyarrow.array(is_in_area, pyarrow.bool_()))
+
+    # the schema metadata (including the GeoParquet metadata) is kept
+    pyarrow.parquet.write_table(table, partial_path(path), compression='snappy')
+    return table.num_rows
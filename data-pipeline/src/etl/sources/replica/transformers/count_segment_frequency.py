@@ -1,15 +1,17 @@
-import gc
 import logging
-import os
-import shutil
-import tempfile
 from pathlib import Path
-from typing import Any, Generator, Optional
+from typing import Any, Callable, Optional
 
-import dask.dataframe
 import geopandas
 import numpy
-import pandas
+import pyarrow
+import pyarrow.compute
+import pyarrow.parquet
+
+from etl.sources.replica.readers.arrow_batches import (encode_id_lists,
+                                                       flatten_id_lists)
+from etl.sources.replica.transformers.network_segment_store import \
+    NetworkSegmentStore
 
 logger = logging.getLogger('count_segment_frequency')
 logger.setLevel(logging.DEBUG)
@@ -90,270 +92,113 @@ def count_segment_frequency(trips_gdf: geopandas.GeoDataFrame, full_segments_gdf
     return segments_gdf
 
 
-def explode_and_hash(gdf: geopandas.GeoDataFrame, multiindex_column: str = 'activity_id', index_start: int = 0, *, log_space: str = '',) -> geopandas.GeoDataFrame:
+def frequency_buckets(frequency: numpy.ndarray, buckets_count: int = 10) -> numpy.ndarray:
     """
-    Explode a GeoDataFrame with MultiIndex and hash the index to create a unique identifier.
-
-    Args:
-        gdf (geopandas.GeoDataFrame): GeoDataFrame to explode and hash.
-        multiindex_column (str): The column to use for MultiIndex.
-
-    Returns:
-        geopandas.GeoDataFrame: A new GeoDataFrame with exploded segments and hashed index.
+    Assign each segment to a bucket based on its frequency, where 0 represents
+    low frequency and `buckets_count` represents the highest frequency.
     """
-    # split each multilinestring into individual linestrings
-    # and create a MultiIndex with activity_id and segment_index
-    logger.debug(f'{log_space}Exploding trips GeoDataFrame to count segment frequencies...')
-    exploded = gdf.set_index(multiindex_column).explode(index_parts=True)  # create a multiindex
-    exploded.index.rename(['activity_id', 'segment_index'], inplace=True)
-
-    # count how many segments each activity has
-    logger.debug(f'{log_space}Counting segments per activity...')
-    activity_segment_counts = exploded.index.to_frame(index=False).groupby(
-        'activity_id')['segment_index'].max() + 1
-
-    logger.debug(f'{log_space}Building filter...')
-
-    # get the segment indices and activity ids as numpy arrays
-    segment_indices = exploded.index.get_level_values('segment_index')
-    activity_ids = exploded.index.get_level_values('activity_id')
-
-    # Look up the total number of segments for each activity and subtract 1
-    # This gives us the upper bound for the segment index to keep (last segment's index - 1)
-    upper_bound = activity_segment_counts[activity_ids].to_numpy() - 1
-
-    # filter to omit the first and last segments (lines) since these are
-    # short lines that indicate the start and end points of the activity
-    # and do not represent actual network segments
-    filter_condition = (segment_indices > 0) & (segment_indices < upper_bound)
-    filtered_exploded = exploded[filter_condition].copy().sort_index()
-    del exploded
-    gc.collect()
-
-    # create a hash for each segment's geometry
-    logger.debug(f'{log_space}Hashing segment geometries...')
-    filtered_exploded.loc[:, 'geometry_hash'] = filtered_exploded.geometry.apply(
-        lambda geom: hash(geom.wkb) if geom is not None else None
-    )
-
-    result = filtered_exploded.reset_index(
-        drop=True  # reset index to avoid multiindex in the final GeoDataFrame
-    )
-    result.index = pandas.Index(result.index + index_start)  # start index from the specified value
-    return result
+    bucket_size = frequency.max() // buckets_count if len(frequency) else 0
+    if bucket_size == 0:
+        # every frequency is in the highest bucket when there are fewer occurrences than buckets
+        return numpy.full(len(frequency), float(buckets_count))
+    return numpy.minimum(numpy.ceil(frequency / bucket_size), buckets_count)
 
 
-def count_frequency(df: pandas.DataFrame, freq_column: str = 'geometry_hash', *, log_space: str = '',) -> pandas.DataFrame:
+def count_edge_frequencies(
+    input_file_paths: list[Path],
+    segment_store: NetworkSegmentStore,
+    groups: dict[str, Optional[list[tuple[str, str, Any]]]],
+    *,
+    filters: Optional[list[tuple[str, str, Any]]] = None,
+    log_space: str = '',
+    on_file_counted: Optional[Callable[[int, int], None]] = None,
+) -> dict[str, tuple[numpy.ndarray, numpy.ndarray]]:
     """
-    Count the frequency of each unique value in a specified column of a DataFrame.
+    Count how many trips use each network segment, for several groups of trips at once.
 
-    This function groups the DataFrame by the specified column, counts the occurrences of each unique value,
-    and assigns a frequency bucket based on the maximum frequency found. The frequency buckets range from
-    0 (low frequency) to 10 (highest frequency).
+    The segments are counted by the ids in the `network_link_ids` column of the
+    trips instead of by their geometry, so the trip geometry is never read,
+    exploded, or hashed. Each file is read once for every group, and only the
+    counts of the segments that are used are kept in memory.
 
-    The added columns are:
-        - 'frequency': The count of occurrences for each unique value.
-        - 'frequency_bucket': A bucketed representation of the frequency, where 0 is low frequency
-          and 10 is the highest frequency.
-        - 'first_occurrence_index': The index of the first occurrence of each unique value.
+    The short lines that mark the start and end of each trip are only added to
+    the trip geometry (see `trips_as_lines`), so they are never counted. Ids
+    that are not in the segment store are ignored, like the segments that are
+    missing from the trip geometry.
 
     Args:
-        df (pandas.DataFrame): DataFrame containing the data.
-        freq_column (str): The column for which occurences should be counted.
+        input_file_paths (list[Path]): The Parquet files of trips with `network_link_ids`.
+        segment_store (NetworkSegmentStore): The network segments that the trips use.
+        groups (dict[str, Optional[list[tuple[str, str, Any]]]]): The name of each group mapped to the
+            filters that select its trips (e.g., `[('mode', '==', 'WALKING')]`), or None for every trip.
+        filters (Optional[list[tuple[str, str, Any]]], optional): Filters to apply when reading the
+            files (e.g., to only read the trips in an area). Defaults to None.
+        log_space (str, optional): A string to prepend to log messages. Defaults to ''.
+        on_file_counted (Optional[Callable[[int, int], None]], optional): If provided, called with the
+            number of files that have been counted and the total number of files after each file.
 
     Returns:
-        pandas.DataFrame: A DataFrame with unique values and their frequencies.
+        dict[str, tuple[numpy.ndarray, numpy.ndarray]]: The name of each group mapped to the positions
+            of the used segments in the store (see `NetworkSegmentStore.positions`) and their frequencies.
     """
-    # count frequency and get the first index for each unique segment
-    logger.debug(f'{log_space}Counting segment frequencies...')
-    segment_counts = df.groupby(freq_column).agg(
-        frequency=(freq_column, 'size'),
-        first_occurrence_index=(freq_column, lambda x: x.index[0])
-    ).reset_index()
-
-    # assign each segment to bucket based on its frequency (0 = low frequency, 10 = highest frequency)
-    logger.debug(f'{log_space}Assigning frequency buckets...')
-    buckets_count = 10
-    max_frequency = segment_counts['frequency'].max()
-    segment_counts['frequency_bucket'] = numpy.minimum(
-        numpy.ceil(segment_counts['frequency'] / (max_frequency // buckets_count)), buckets_count
-    )
-
-    return segment_counts
-
-
-def count_segment_frequency_multi_input(
-    input_file_paths: list[Path],
-    output_file_path: str,
-    *,
-    intermediate_chunks_folder: str | None = None,
-    step1_columns: Optional[list[str]] = None,
-    skip_step_1: bool = False,
-    step_2_filter: Optional[list[tuple[str, str, Any]] | list[list[tuple[str, str, Any]]]] = None,
-    out_crs: str = 'EPSG:4326',
-    log_space: str = '',
-    success_hash: Optional[str] = None,
-) -> Generator[tuple[int, int], None, None]:
+    group_columns = {column for group_filters in groups.values() for column, _, _ in group_filters or []}
+    group_expressions = {
+        name: pyarrow.parquet.filters_to_expression(group_filters) if group_filters else None
+        for name, group_filters in groups.items()
+    }
+    # the unique segment positions and their counts from each file for each group
+    file_counts: dict[str, list[tuple[numpy.ndarray, numpy.ndarray]]] = {name: [] for name in groups}
+    for file_index, file_path in enumerate(input_file_paths):
+        logger.debug(f'{log_space}Counting segments in file: {file_path}')
+        # (the ids may be integers or, when a download has ids that are not integers, strings)
+        table = pyarrow.parquet.read_table(
+            file_path, columns=['network_link_ids', *sorted(group_columns)], filters=filters)
+        table = encode_id_lists(table, {'network_link_ids': pyarrow.int64()})
+
+        for name, expression in group_expressions.items():
+            lists = (table if expression is None else table.filter(expression)).column('network_link_ids')
+            ids, _ = flatten_id_lists(lists)
+            positions = segment_store.positions(ids.to_numpy(zero_copy_only=False))
+            file_counts[name].append(numpy.unique(positions[positions >= 0], return_counts=True))
+
+        del table
+        if on_file_counted is not None:
+            on_file_counted(file_index + 1, len(input_file_paths))
+
+    # add up the counts of each segment across the files
+    frequencies: dict[str, tuple[numpy.ndarray, numpy.ndarray]] = {}
+    for name, counts in file_counts.items():
+        positions = numpy.concatenate([file_positions for file_positions, _ in counts] or [numpy.array([], numpy.int64)])
+        positions_counts = numpy.concatenate([file_count for _, file_count in counts] or [numpy.array([], numpy.int64)])
+        unique_positions, inverse = numpy.unique(positions, return_inverse=True)
+        frequencies[name] = (
+            unique_positions.astype(numpy.int64),
+            numpy.bincount(inverse, weights=positions_counts, minlength=len(unique_positions)).astype(numpy.int64),
+        )
+    return frequencies
+
+
+def edge_frequencies_to_gdf(segment_store: NetworkSegmentStore, positions: numpy.ndarray, frequency: numpy.ndarray,
+                            *, crs: str = 'EPSG:4326', out_crs: str = 'EPSG:4326') -> geopandas.GeoDataFrame:
     """
-    Counts the frequency of segments across multiple input files, links them to their frequencies, and saves the result.
-
-    This function processes geographic data from multiple input files, identifies unique segments, counts their occurrences,
-    and saves the segments along with their frequencies to an output file. It is designed to handle large datasets by
-    processing data in chunks and using temporary files for intermediate results.
+    Create a GeoDataFrame of segments and their frequencies from `count_edge_frequencies`,
+    with the geometry of each segment from the segment store.
 
     Args:
-        input_file_paths (list[Path]): A list of paths to the input files. These files can be either GeoJSON or Parquet
-            and should contain geographic data, specifically trip geometries.
-        output_file_path (str): The path to the output file. The output file may be a parquet file or any single-layer
-            file that is supported by GeoPandas for writing in append mode. It will contain the segment geometries
-            and their frequencies. If the file already exists, it will be overwritten.
-        intermediate_chunks_folder (str | None, optional):  Path to a folder to store intermediate chunk files. If None, a
-            temporary directory will be created and used.  Defaults to None.
-        step1_columns (Optional[list[str]], optional): List of columns to read from the input files in the first step
-            (Exploding and hashing).  If None, all columns are read. Defaults to None.
-        skip_step_1 (bool, optional): If True, skips the first step (Exploding and hashing) and assumes that the
-            intermediate chunk files already exist in the `intermediate_chunks_folder`. Defaults to False.
-        step_2_filter (Optional[list[tuple[str, str, Any]] | list[list[tuple[str, str, Any]]]], optional): Filters to apply
-            when reading the intermediate chunk files in the second step (Counting segment frequencies). This can be a list
-            of filters or a list of lists of filters, compatible with dask's filter syntax. Defaults to None.
-        out_crs (str, optional): The coordinate reference system (CRS) to convert the segment geometries to.
+        segment_store (NetworkSegmentStore): The store that the frequencies were counted with.
+        positions (numpy.ndarray): The positions of the segments in the store.
+        frequency (numpy.ndarray): The frequency of each segment.
+        crs (str, optional): The coordinate reference system of the segments in the store. Defaults to 'EPSG:4326'.
+        out_crs (str, optional): The coordinate reference system to convert the segment geometries to.
             Defaults to 'EPSG:4326'.
-        log_space (str, optional): A string to prepend to log messages. Defaults to ''.
-        success_hash (Optional[str], optional): If provided, a success file will be created for each chunk with the
-            hash in the name. This can be used to track successful processing of chunks. Defaults to None.
-
-    Yields:
-        Generator[tuple[int, int], None, None]: Yields tuples of the current step and total steps for progress tracking.
-            The first element is the current step (0-indexed), and the second element is the total number of steps.
-
-    Raises:
-        FileNotFoundError: If any of the input files specified in `input_file_paths` do not exist.
-        ValueError: If the input file format is not supported (only GeoJSON and Parquet are supported).
-        Exception: If any error occurs during file reading, processing, or writing.
-
-    Notes:
-        - The function uses temporary files to store intermediate results, especially segment hashes and frequencies.
-        - The `intermediate_chunks_folder` can be specified to avoid recomputing the segment hashes if the process is
-          interrupted or needs to be rerun with different parameters. For example, if you run with the same input files
-          but different filters, you can reuse the intermediate chunks. Remember to specify `skip_step_1=True` for
-          subsequent runs to skip the explosion and hashing step (the slowest part).
-        - The function is designed to be memory-efficient by processing data in chunks and using Dask for parallel
-          computation.
+
+    Returns:
+        geopandas.GeoDataFrame: A GeoDataFrame with `frequency`, `frequency_bucket`, and `geometry` columns.
     """
-    total_steps = len(input_file_paths) * (1 if skip_step_1 else 2) + \
-        1  # explosion + linking and saving + counting
-    current_step = 0
-    yield (0, total_steps)
-
-    # create a temporary folder for intermediate output
-    should_clean_temp_folder = False
-    if intermediate_chunks_folder is None:
-        should_clean_temp_folder = True
-        temporary_chunks_folder = tempfile.TemporaryDirectory(prefix='segment_hash_chunks_').name
-    else:
-        temporary_chunks_folder = intermediate_chunks_folder
-
-    # Part 1. Explode the trip geometry into segments and generate hashes for each segment geometry
-    if not skip_step_1:
-        logger.info(f'{log_space}Exploding trip geometries and generating hashes...')
-        last_max_row_index = -1  # track so that we can ensure index is unique across all files
-        for file_index, file_path in enumerate(input_file_paths):
-            current_step += 1
-
-            logger.debug(f'{log_space}  Reading file: {file_path}')
-            if file_path.as_posix().endswith('.parquet'):
-                gdf = geopandas.read_parquet(
-                    file_path,
-                    columns=step1_columns
-                )
-            else:
-                gdf = geopandas.read_file(file_path)
-
-            logger.debug(f'{log_space}  Exploding and hashing...')
-            result = explode_and_hash(
-                gdf, 'activity_id', last_max_row_index + 1, log_space=f'{log_space}    ')
-            last_max_row_index = result.index.max()
-
-            logger.debug(f'{log_space}  Saving chunk...')
-            chunk_file_path = f'{temporary_chunks_folder}/chunk_{file_index}.parquet'
-            result.to_parquet(chunk_file_path, index=True)
-
-            # if there is a success_hash, create a .success file with the hash in the name
-            if success_hash:
-                success_file_path = chunk_file_path.replace(
-                    '.parquet', f'__{success_hash}.success')
-                with open(success_file_path, 'w') as success_file:
-                    success_file.write('')
-
-            del result
-            gc.collect()
-
-            # yield the step that was just completed so the consumer can show and update progress
-            yield (current_step, total_steps)
-
-    # Part 2. Read the segment geometry hashes and find the frequency of each hash
-    current_step += 1
-    logger.info(f'{log_space}Counting segment frequencies...')
-    logger.debug(f'{log_space}  Reading all segment hashes...')
-    logger.debug(f'{log_space}    Temporary chunks folder: {temporary_chunks_folder}')
-    segment_hashes_df = dask.dataframe.read_parquet(  # use dask instead of pandas because it ignores the success files
-        temporary_chunks_folder,
-        columns=['geometry_hash'],
-        engine='pyarrow',
-        filters=[step_2_filter] if step_2_filter is not None else None,
-    ).compute()
-    logger.debug(f'{log_space}  Counting frequencies...')
-    segment_hash_frequencies = count_frequency(
-        segment_hashes_df, 'geometry_hash', log_space=f'{log_space}    ')
-
-    yield (current_step, total_steps)
-
-    # Part 3. Look through each chunk and join the segment hashes with the associated partition
-    logger.info(f'{log_space}Linking segment geometries with their frequencies and saving...')
-    for chunk_index, chunk_path in enumerate(Path(temporary_chunks_folder).glob('*.parquet')):
-        current_step += 1
-
-        logger.debug(f'{log_space}  Reading chunk: {chunk_path}')
-        chunk_gdf = geopandas.read_parquet(
-            chunk_path,
-            columns=['geometry', 'geometry_hash'],
-            filters=[step_2_filter] if step_2_filter is not None else None,
-        ).to_crs(out_crs)
-
-        logger.debug(f'{log_space}  Joining with segment frequencies...')
-        chunk_gdf = chunk_gdf.merge(
-            segment_hash_frequencies,
-            left_index=True,
-            right_on='first_occurrence_index',
-            how='left',
-        ).set_index('first_occurrence_index')
-        chunk_gdf.index.name = None
-
-        # drop all columns except frequency and frequency_bucket
-        chunk_gdf = chunk_gdf[['frequency', 'frequency_bucket', 'geometry']]
-
-        # ignore rows without an occurence
-        chunk_gdf = chunk_gdf[chunk_gdf['frequency'] > 0]
-
-        # save to the outpit file path in append mode
-        logger.debug(f'{log_space}  Saving chunk {chunk_index} to output file: {output_file_path}')
-        if output_file_path.endswith('.parquet'):
-            if chunk_index == 0:
-                chunk_gdf.to_parquet(output_file_path, engine='pyarrow')
-            else:
-                chunk_gdf.to_parquet(output_file_path, engine='pyarrow', append=True)
-        else:
-            # write to the output file, appending to the same file each interation of the loop
-            chunk_gdf\
-                .to_crs(out_crs)\
-                .to_file(output_file_path, mode='w' if chunk_index == 0 else 'a')
-
-        yield (current_step, total_steps)
-
-    # clean up the temporary folder
-    if should_clean_temp_folder:
-        logger.debug(f'{log_space}Cleaning up temporary chunks folder: {temporary_chunks_folder}')
-        shutil.rmtree(temporary_chunks_folder, ignore_errors=True)
+    return geopandas.GeoDataFrame(
+        {'frequency': frequency, 'frequency_bucket': frequency_buckets(frequency)},
+        geometry=geopandas.GeoSeries(segment_store.linestrings_at(positions), crs=crs),
+    ).to_crs(out_crs)
 
 
 def fix_geometry(gdf: geopandas.GeoDataFrame) -> geopandas.GeoDataFrame:
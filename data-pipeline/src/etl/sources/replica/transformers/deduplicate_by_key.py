@@ -0,0 +1,101 @@
+import logging
+import math
+import os
+import shutil
+from pathlib import Path
+from typing import cast
+
+import polars
+import pyarrow
+import pyarrow.parquet
+
+logger = logging.getLogger('deduplicate_by_key')
+logger.setLevel(logging.DEBUG)
+
+
+def conform_to_schema(table: pyarrow.Table, schema: pyarrow.Schema) -> pyarrow.Table:
+    """Cast the columns of a table to the types of a schema, adding the columns that it does not have as nulls."""
+    columns = [
+        table.column(field.name).cast(field.type) if field.name in table.column_names
+        else pyarrow.nulls(table.num_rows, field.type)
+        for field in schema
+    ]
+    return pyarrow.Table.from_arrays(columns, schema=schema)
+
+
+def deduplicate_by_key(input_paths: list[str], output_folder: str | os.PathLike[str], key: str = 'activity_id', *,
+                       bucket_bytes: int = 256 * 1024 ** 2, batch_rows: int = 250000, log_space: str = '') -> tuple[list[str], int]:
+    """
+    Write the rows of parquet files to a folder so that each value of `key`
+    appears only once (the first row with the value is kept, in the order of
+    `input_paths`). Rows without a value are kept.
+
+    The files are never loaded into memory all at once. Instead, the rows are
+    first split into buckets on disk by a hash of `key`, so that every row with
+    the same value is in the same bucket. Then each bucket is de-duplicated by
+    itself. Only one bucket (about `bucket_bytes` of compressed input) is held
+    in memory at a time.
+
+    Args:
+        input_paths: The parquet files to de-duplicate. Files without rows are skipped.
+        output_folder: The folder to write the de-duplicated parquet files to (one for each bucket). It is replaced if it exists.
+        key: The column that identifies a row.
+        bucket_bytes: The approximate size of the input in each bucket.
+        batch_rows: The number of rows to read from an input file at a time.
+
+    Returns:
+        The paths of the de-duplicated files and the number of duplicate rows that were removed.
+    """
+    output_folder = Path(output_folder)
+    shutil.rmtree(output_folder, ignore_errors=True)
+    buckets_folder = output_folder / '_buckets'
+    buckets_folder.mkdir(parents=True)
+
+    input_paths = [path for path in input_paths if pyarrow.parquet.read_metadata(path).num_rows > 0]
+
+    # every bucket is written with the same schema, since the types that are inferred for each input
+    # can differ (e.g., a column without any values in one of the inputs has the null type)
+    schema = pyarrow.unify_schemas([pyarrow.parquet.read_schema(path) for path in input_paths],
+                                   promote_options='permissive') if input_paths else pyarrow.schema([])
+    total_bytes = sum(os.path.getsize(path) for path in input_paths)
+    bucket_count = max(1, math.ceil(total_bytes / bucket_bytes))
+    logger.info(f'{log_space}Splitting {len(input_paths)} files into {bucket_count} buckets by {key}...')
+
+    # split the rows into buckets by the hash of the key, keeping the order of the inputs
+    writers: dict[int, pyarrow.parquet.ParquetWriter] = {}
+    try:
+        for input_path in input_paths:
+            for batch in pyarrow.parquet.ParquetFile(input_path).iter_batches(batch_size=batch_rows):
+                batch_df = polars.from_arrow(pyarrow.Table.from_batches([batch]))
+                assert isinstance(batch_df, polars.DataFrame)
+                bucketed = batch_df.with_columns(
+                    (polars.col(key).hash(seed=0) % bucket_count).alias('_bucket'))
+                for (bucket_value,), bucket_df in bucketed.partition_by('_bucket', as_dict=True).items():
+                    bucket = cast(int, bucket_value)
+                    bucket_table = conform_to_schema(bucket_df.drop('_bucket').to_arrow(), schema)
+                    if bucket not in writers:
+                        writers[bucket] = pyarrow.parquet.ParquetWriter(
+                            buckets_folder / f'bucket_{bucket}.parquet', schema, compression='snappy')
+                    writers[bucket].write_table(bucket_table)
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    # de-duplicate each bucket by itself (all rows with the same key are in the same bucket)
+    output_paths: list[str] = []
+    duplicate_count = 0
+    for bucket in sorted(writers):
+        bucket_df = polars.read_parquet(buckets_folder / f'bucket_{bucket}.parquet')
+        unique_df = polars.concat([
+            bucket_df.filter(polars.col(key).is_null()),
+            bucket_df.filter(polars.col(key).is_not_null()).unique(subset=[key], keep='first', maintain_order=True),
+        ])
+        duplicate_count += len(bucket_df) - len(unique_df)
+        output_path = output_folder / f'part_{bucket}.parquet'
+        unique_df.write_parquet(output_path, compression='snappy')
+        output_paths.append(output_path.as_posix())
+        del bucket_df, unique_df
+
+    shutil.rmtree(buckets_folder, ignore_errors=True)
+    logger.info(f'{log_space}Removed {duplicate_count} rows with duplicate {key} values.')
+    return output_paths, duplicate_count
@@ -0,0 +1,176 @@
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import Any, Iterable, Optional
+
+import geopandas
+import numpy
+import pandas
+import shapely
+from shapely.geometry import LineString
+
+from etl.checkpoints import partial_path, replace_with_partial
+from etl.sources.replica.readers.arrow_batches import INTEGER_ID_PATTERN
+
+logger = logging.getLogger('network_segment_store')
+logger.setLevel(logging.INFO)
+
+
+class NetworkSegmentStore:
+    """
+    A read-only lookup of network segment geometry by stableEdgeId that is
+    stored as a few flat arrays instead of a dictionary of shapely objects:
+
+    - `ids`: the sorted segment ids (int64 when every id is an integer, which
+      matches the network link ids of trips, or fixed-width strings otherwise)
+    - `offsets`: where the coordinates of each segment start in `coordinates`
+      (the coordinates of segment `i` are `coordinates[offsets[i]:offsets[i + 1]]`)
+    - `coordinates`: the x and y coordinates of every segment, one after another
+
+    The arrays are saved as .npy files in a folder and are memory-mapped when the
+    store is opened, so processes that open the same store share one copy in the
+    page cache, and only the coordinates of the segments that are looked up are read.
+
+    The store can be used in place of the dictionary from `create_network_segments_lookup`.
+    """
+
+    def __init__(self, ids: numpy.ndarray, offsets: numpy.ndarray, coordinates: numpy.ndarray) -> None:
+        self.ids = ids
+        self.offsets = offsets
+        self.coordinates = coordinates
+
+    @classmethod
+    def from_geometries(cls, ids: Iterable[Any] | numpy.ndarray, geometry: Iterable[Any] | numpy.ndarray) -> 'NetworkSegmentStore':
+        """
+        Create a store in memory from segment ids and their geometry. Segments
+        without a LineString geometry are left out, so they are missing from the
+        store. If an id appears more than once, its last geometry is kept (like a dictionary).
+        """
+        geometry_array = numpy.asarray(geometry if isinstance(geometry, numpy.ndarray) else list(geometry), dtype=object)
+        id_series = pandas.Series(numpy.asarray(ids if isinstance(ids, numpy.ndarray) else list(ids), dtype=object))
+
+        is_line = shapely.get_type_id(geometry_array) == shapely.GeometryType.LINESTRING
+        if not is_line.all():
+            logger.warning(f'Leaving {(~is_line).sum()} segments that are not LineStrings out of the segment store.')
+        id_series, geometry_array = id_series[is_line].astype(str), geometry_array[is_line]
+
+        # integer ids are stored as integers so that they match the network link ids of trips
+        # (like `encode_id_lists`, ids that do not fit in an int64 are stored as strings)
+        id_array = id_series.to_numpy().astype(str)
+        if id_series.str.fullmatch(INTEGER_ID_PATTERN).all():
+            try:
+                id_array = id_array.astype(numpy.int64)
+            except (ValueError, OverflowError):
+                pass
+
+        # sort by id, keeping the last of any duplicate ids
+        order = numpy.argsort(id_array, kind='stable')
+        sorted_ids = id_array[order]
+        is_last = numpy.append(sorted_ids[1:] != sorted_ids[:-1], True) if len(sorted_ids) else numpy.array([], bool)
+        order = order[is_last]
+
+        coordinates, geometry_index = shapely.get_coordinates(geometry_array[order], return_index=True)
+        counts = numpy.bincount(geometry_index, minlength=len(order))
+        offsets = numpy.concatenate([[0], numpy.cumsum(counts)]).astype(numpy.int64)
+        return cls(id_array[order], offsets, numpy.ascontiguousarray(coordinates, dtype=numpy.float64))
+
+    @classmethod
+    def build(cls, network_segments_gdf: geopandas.GeoDataFrame, folder: str | os.PathLike[str]) -> 'NetworkSegmentStore':
+        """
+        Save a store of the segments in a GeoDataFrame (see `from_geometries`)
+        to a folder, which is replaced if it exists, and open it.
+        """
+        store = cls.from_geometries(network_segments_gdf['stableEdgeId'].to_numpy(),
+                                    network_segments_gdf.geometry.to_numpy())
+
+        # write to a partial folder so that an interrupted write never leaves an incomplete store
+        folder = Path(folder)
+        partial_folder = partial_path(folder)
+        shutil.rmtree(partial_folder, ignore_errors=True)
+        partial_folder.mkdir(parents=True)
+        numpy.save(partial_folder / 'ids.npy', store.ids)
+        numpy.save(partial_folder / 'offsets.npy', store.offsets)
+        numpy.save(partial_folder / 'coordinates.npy', store.coordinates)
+        replace_with_partial(folder)
+        logger.info(f'Saved {len(store)} segments to the segment store at {folder}.')
+
+        return cls.open(folder)
+
+    @classmethod
+    def open(cls, folder: str | os.PathLike[str]) -> 'NetworkSegmentStore':
+        """Open a store that was saved with `build` by memory-mapping its arrays."""
+        folder = Path(folder)
+        return cls(
+            numpy.load(folder / 'ids.npy', mmap_mode='r'),
+            numpy.load(folder / 'offsets.npy', mmap_mode='r'),
+            numpy.load(folder / 'coordinates.npy', mmap_mode='r'),
+        )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def positions(self, ids: Iterable[Any] | numpy.ndarray) -> numpy.ndarray:
+        """
+        Find the positions of segment ids in the store.
+
+        Returns:
+            The position of each id, or -1 for ids that are not in the store.
+        """
+        id_array = numpy.asarray(ids if isinstance(ids, numpy.ndarray) else list(ids))
+        if len(self.ids) == 0 or len(id_array) == 0:
+            return numpy.full(len(id_array), -1, dtype=numpy.int64)
+
+        # ids that are not integers (e.g., string ids of trips with other ids that are not integers)
+        # are not in a store of integer ids, but the ids that are integers may be
+        is_id = numpy.ones(len(id_array), dtype=bool)
+        if self.ids.dtype.kind == 'i' and id_array.dtype.kind not in 'iu':
+            id_strings = id_array.astype(str)
+            is_id = pandas.Series(id_strings).str.fullmatch(INTEGER_ID_PATTERN).to_numpy()
+            # (ids with 19 digits may not fit in an int64)
+            values = [int(id) for id in id_strings[is_id]]
+            fits = [-2 ** 63 <= value < 2 ** 63 for value in values]
+            is_id[is_id] = fits
+            id_array = numpy.zeros(len(id_strings), dtype=numpy.int64)
+            id_array[is_id] = [value for value, value_fits in zip(values, fits) if value_fits]
+        else:
+            id_array = id_array.astype(numpy.int64 if self.ids.dtype.kind == 'i' else str)
+
+        positions = numpy.minimum(numpy.searchsorted(self.ids, id_array), len(self.ids) - 1)
+        return numpy.where(is_id & (self.ids[positions] == id_array), positions, -1).astype(numpy.int64)
+
+    def linestrings(self, ids: Iterable[Any] | numpy.ndarray) -> numpy.ndarray:
+        """
+        Get the geometry of many segments at once.
+
+        Returns:
+            An object array with the LineString of each id, or None for ids that are not in the store.
+        """
+        return self.linestrings_at(self.positions(ids))
+
+    def linestrings_at(self, positions: numpy.ndarray) -> numpy.ndarray:
+        """
+        Get the geometry of the segments at positions from `positions`.
+
+        Returns:
+            An object array with the LineString at each position, or None for positions that are -1.
+        """
+        result = numpy.full(len(positions), None, dtype=object)
+        found = numpy.flatnonzero(positions >= 0)
+        if len(found) == 0:
+            return result
+
+        # gather the coordinates of the found segments into one array
+        starts = numpy.asarray(self.offsets[positions[found]])
+        counts = numpy.asarray(self.offsets[positions[found] + 1]) - starts
+        first_points = numpy.cumsum(counts) - counts
+        point_positions = numpy.repeat(starts - first_points, counts) + numpy.arange(counts.sum())
+        geometry_index = numpy.repeat(numpy.arange(len(found)), counts)
+
+        result[found] = shapely.linestrings(self.coordinates[point_positions], indices=geometry_index)
+        return result
+
+    def get(self, id: Any, default: Optional[LineString] = None) -> Optional[LineString]:
+        """Get the geometry of one segment (like `dict.get`)."""
+        [linestring] = self.linestrings([id])
+        return linestring if linestring is not None else default
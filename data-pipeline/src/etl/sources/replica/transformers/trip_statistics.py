@@ -0,0 +1,155 @@
+import math
+from collections import Counter, defaultdict
+from typing import Any, Literal
+
+import numpy
+import pandas
+import shapely
+from shapely.geometry.base import BaseGeometry
+
+# the columns of the trips that the statistics are calculated from
+TRIP_STATISTICS_COLUMNS = ['tour_type', 'mode', 'duration_minutes', 'destination_building_use_l1',
+                           'destination_building_use_l2', 'end_lng', 'end_lat', 'geometry']
+
+ServiceAreaVia = Literal['via_walk', 'via_bike']
+
+
+def flag_service_area_trips(trips_df: pandas.DataFrame, walk_service_area: BaseGeometry,
+                            bike_service_area: BaseGeometry) -> pandas.DataFrame:
+    """
+    Add the boolean columns that `TripStatistics.update` needs to a chunk of
+    trips with the columns in `TRIP_STATISTICS_COLUMNS` (the geometry may be WKB):
+
+    - `destination_in_walk` and `destination_in_bike`: whether the trip ends
+      within the walking or biking service area
+    - `within_walk` and `within_bike`: whether the trip is not a public transit
+      trip and its entire route is within the walking or biking service area
+
+    These do not depend on the area, so they are found once for every area
+    that the chunk is used for. The geometry column is dropped afterward.
+
+    Pass the service areas to `shapely.prepare` first so that they are only prepared once.
+    """
+    end_lng = trips_df['end_lng'].to_numpy(dtype=float, na_value=numpy.nan)
+    end_lat = trips_df['end_lat'].to_numpy(dtype=float, na_value=numpy.nan)
+
+    # only trips that could have used public transit instead are possible conversions
+    is_not_transit = (trips_df['mode'] != 'PUBLIC_TRANSIT').to_numpy(dtype=bool, na_value=True)
+    geometry = trips_df['geometry'].to_numpy()[is_not_transit]
+    if len(geometry) > 0 and not isinstance(geometry[0], BaseGeometry):
+        geometry = shapely.from_wkb(geometry)
+
+    within_walk = numpy.zeros(len(trips_df), dtype=bool)
+    within_bike = numpy.zeros(len(trips_df), dtype=bool)
+    within_walk[is_not_transit] = shapely.within(geometry, walk_service_area)
+    within_bike[is_not_transit] = shapely.within(geometry, bike_service_area)
+
+    return pandas.DataFrame(trips_df.drop(columns='geometry')).assign(
+        destination_in_walk=shapely.contains_xy(walk_service_area, end_lng, end_lat),
+        destination_in_bike=shapely.contains_xy(bike_service_area, end_lng, end_lat),
+        within_walk=within_walk,
+        within_bike=within_bike,
+    )
+
+
+def histogram_median(histogram: Counter[float]) -> float:
+    """The median of the values in a histogram of value counts (NaN if it is empty)."""
+    total = sum(histogram.values())
+    if total == 0:
+        return math.nan
+
+    # the two middle values are the same when the number of values is odd
+    values = numpy.array(sorted(histogram))
+    cumulative_counts = numpy.cumsum([histogram[value] for value in values])
+    lower = values[numpy.searchsorted(cumulative_counts, (total - 1) // 2, side='right')]
+    upper = values[numpy.searchsorted(cumulative_counts, total // 2, side='right')]
+    return float((lower + upper) / 2)
+
+
+class TripStatistics:
+    """
+    The trip statistics of an area, which are updated one chunk of trips at a
+    time so that each chunk is only read once and the memory that is used does
+    not depend on the number of trips.
+
+    Every statistic is a count, so they are added up across the chunks. The
+    median durations are found from a histogram of the durations, which are
+    whole minutes, so they are exact.
+
+    The results have the same format as `count_trip_travel_methods`,
+    `count_median_commute_time`,
+    `count_destination_building_use_in_service_area`, and
+    `count_destination_building_use_in_service_area_by_tour_type`. The possible
+    conversions are the number of trips that are not public transit trips and
+    whose entire route is within the walking or biking service area.
+    """
+
+    def __init__(self) -> None:
+        self.tour_types: dict[str, None] = {}  # the tour types in the order they were found
+        self.mode_counts: defaultdict[str, Counter[str]] = defaultdict(Counter)
+        self.duration_histograms: defaultdict[str, Counter[float]] = defaultdict(Counter)
+        self.possible_conversions: dict[ServiceAreaVia, int] = {'via_walk': 0, 'via_bike': 0}
+        # (tour type, via, building use level) -> building use -> count
+        self.building_use_counts: defaultdict[tuple[str, ServiceAreaVia, str], Counter[str]] = defaultdict(Counter)
+
+    def update(self, trips_df: pandas.DataFrame, destination_in_area: numpy.ndarray) -> None:
+        """
+        Add a chunk of trips in the area to the statistics.
+
+        Args:
+            trips_df: The trips, with the columns from `flag_service_area_trips`.
+            destination_in_area: Whether each trip ends within the area.
+        """
+        tour_types = trips_df['tour_type'].str.lower()
+        for tour_type in tour_types.dropna().unique():
+            self.tour_types.setdefault(tour_type, None)
+
+        modes = trips_df['mode'].str.lower()
+        self.mode_counts['__all'].update(modes.value_counts().to_dict())
+        for (tour_type, mode), count in modes.groupby(tour_types).value_counts().items():
+            self.mode_counts[tour_type][mode] += count
+
+        durations = trips_df['duration_minutes']
+        self.duration_histograms['__all'].update(durations.value_counts().to_dict())
+        for (tour_type, duration), count in durations.groupby(tour_types).value_counts().items():
+            self.duration_histograms[tour_type][duration] += count
+
+        conversion_columns: list[tuple[ServiceAreaVia, str]] = [('via_walk', 'within_walk'), ('via_bike', 'within_bike')]
+        for via, column in conversion_columns:
+            self.possible_conversions[via] += int(trips_df[column].sum())
+
+        # count the building uses at the destinations in the area and service area
+        destination_columns: list[tuple[ServiceAreaVia, str]] = [('via_walk', 'destination_in_walk'),
+                                                                 ('via_bike', 'destination_in_bike')]
+        for via, column in destination_columns:
+            is_destination = destination_in_area & trips_df[column].to_numpy()
+            destinations_df = trips_df[is_destination]
+            destination_tour_types = tour_types[is_destination]
+            for level, level_column in [('type_counts', 'destination_building_use_l1'),
+                                        ('subtype_counts', 'destination_building_use_l2')]:
+                building_uses = destinations_df[level_column]
+                self.building_use_counts[('__all', via, level)].update(building_uses.value_counts().to_dict())
+                for (tour_type, building_use), count in building_uses.groupby(destination_tour_types).value_counts().items():
+                    self.building_use_counts[(tour_type, via, level)][building_use] += count
+
+    def _building_use(self, tour_type: str) -> dict[ServiceAreaVia, dict[str, dict[str, int]]]:
+        return {
+            via: {
+                level: {building_use: int(count) for building_use, count in
+                        self.building_use_counts[(tour_type, via, level)].items()}
+                for level in ['type_counts', 'subtype_counts']
+            }
+            for via in ('via_walk', 'via_bike')
+        }
+
+    def result(self) -> dict[str, Any]:
+        """Get the statistics of the trips that were added."""
+        groups = ['__all', *self.tour_types]
+        return {
+            'methods': {group: {mode: int(count) for mode, count in self.mode_counts[group].items()} for group in groups},
+            'median_duration': {group: histogram_median(self.duration_histograms[group]) for group in groups},
+            'possible_conversions': dict(self.possible_conversions),
+            'destination_building_use': self._building_use('__all'),
+            'destination_building_use__by_tour_type': {tour_type: self._building_use(tour_type)
+                                                       for tour_type in self.tour_types},
+        }
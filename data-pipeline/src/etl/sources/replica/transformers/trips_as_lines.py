@@ -2,38 +2,56 @@ import gc
 import logging
 from datetime import datetime
 from logging import getLogger
-from typing import Optional
+from typing import Any, Optional
 
 import geopandas
+import numpy
 import pandas
-from shapely.geometry import LineString, MultiLineString
+import pyarrow
+import pyarrow.compute
+import shapely
+from shapely.geometry import LineString
 from tqdm import tqdm
 
+from etl.sources.replica.readers.arrow_batches import (INTEGER_ID_PATTERN,
+                                                       encode_id_lists,
+                                                       flatten_id_lists)
+from etl.sources.replica.transformers.network_segment_store import \
+    NetworkSegmentStore
+
 logger = getLogger('trips_as_lines')
 logger.setLevel(logging.INFO)
 
 
-def create_network_segments_lookup(network_segments_gdf: geopandas.GeoDataFrame) -> dict[str, LineString]:
+def create_network_segments_lookup(network_segments_gdf: geopandas.GeoDataFrame) -> dict[Any, LineString]:
     """
     Create a lookup dictionary for network segments from a GeoDataFrame.
 
+    The keys are integers when every stableEdgeId is an integer, which matches
+    the network link ids of trips (see `encode_id_lists`). Otherwise, they are strings.
+
     Args:
         network_segments_gdf (geopandas.GeoDataFrame): GeoDataFrame containing network segments.
 
     Returns:
-        dict[str, LineString]: Dictionary mapping stableEdgeId to LineString geometry.
+        dict[int | str, LineString]: Dictionary mapping stableEdgeId to LineString geometry.
     """
     logger.info('Creating segment WKT lookup dictionary...')
     start_time = datetime.now()
-    segment_lookup: dict[str, LineString] = network_segments_gdf.set_index("stableEdgeId")[
-        "geometry"].to_dict()
+    edge_ids = network_segments_gdf['stableEdgeId'].astype(str)
+    if edge_ids.str.fullmatch(INTEGER_ID_PATTERN).all():
+        try:
+            edge_ids = edge_ids.astype('int64')
+        except (ValueError, OverflowError):
+            pass  # ids that do not fit in an int64 stay strings
+    segment_lookup: dict[Any, LineString] = dict(zip(edge_ids.tolist(), network_segments_gdf.geometry))
     elapsed_time = datetime.now() - start_time
     logger.info(
         f'Created segment WKT lookup dictionary with {len(segment_lookup)} entries in {elapsed_time} seconds.')
     return segment_lookup
 
 
-def trips_as_lines(trips_df: pandas.DataFrame, network_segments_lookup: dict[str, LineString] | geopandas.GeoDataFrame, crs: str = 'EPSG:4326', bar: Optional[tqdm] = None) -> geopandas.GeoDataFrame:
+def trips_as_lines(trips_df: pandas.DataFrame, network_segments_lookup: dict[Any, LineString] | NetworkSegmentStore | geopandas.GeoDataFrame, crs: str = 'EPSG:4326', bar: Optional[tqdm] = None) -> geopandas.GeoDataFrame:
     """
     Convert trips to lines by joining trip points with network segments.
 
@@ -43,6 +61,10 @@ def trips_as_lines(trips_df: pandas.DataFrame, network_segments_lookup: dict[str
     `missing_network_link_ids` column as a comma-separated string. If all network link IDs
     are found, this column will be `None`.
 
+    The lines of every trip are built at once: the network link IDs are exploded
+    with Arrow, the segments are found in a `NetworkSegmentStore`, and the
+    multilinestrings are created with shapely's array constructors.
+
     The start and end coordinates must exist as the following columns in the input trip GeoDataFrame:
     - `start_lng`
     - `start_lat`
@@ -51,7 +73,7 @@ def trips_as_lines(trips_df: pandas.DataFrame, network_segments_lookup: dict[str
 
     Args:
         trips_df (pandas.DataFrame): DataFrame containing trips.
-        network_segments_lookup ( dict[str, LineString] | geopandas.GeoDataFrame): A dict of key-value pairs where the key is the entwork segment id and the value is a LineString OR a GeoDataFrame containing network segments. If providing a dict, ensure the LineString geometries are in the same coordinate reference system (CRS) as the trips_df
+        network_segments_lookup ( dict[int | str, LineString] | NetworkSegmentStore | geopandas.GeoDataFrame): A dict of key-value pairs where the key is the entwork segment id and the value is a LineString, a NetworkSegmentStore, OR a GeoDataFrame containing network segments. If providing a dict, ensure the LineString geometries are in the same coordinate reference system (CRS) as the trips_df
         crs (str): Coordinate reference system of the input trips_df data. Defaults to 'EPSG:4326' If network_segments_lookup is a GeoDataFrame and has a different crs, it will be converted.
 
     Returns:
@@ -68,116 +90,103 @@ def trips_as_lines(trips_df: pandas.DataFrame, network_segments_lookup: dict[str
         logger.warning(
             "The 'geometry' column already exists in the trips DataFrame. It will be replaced with the new geometry.")
 
+    # look up the segments in a segment store, which finds the segments for every trip at once
     if isinstance(network_segments_lookup, geopandas.GeoDataFrame):
         # if the network segments GeoDataFrame has a different CRS than the trips DataFrame, convert it
         if network_segments_lookup.crs != crs:
             logger.info(
                 f'Converting network segments GeoDataFrame from {network_segments_lookup.crs} to {crs}...')
             network_segments_lookup = network_segments_lookup.to_crs(crs)
-
-        # convert to a dictionary for faster lookups of network segments
-        network_segments_lookup = create_network_segments_lookup(network_segments_lookup)
-
-    def get_matching_segments(row: pandas.Series) -> tuple[bytes | None, str | None]:
-        trip_id = row['activity_id']
-        if not isinstance(trip_id, str):
-            logger.warning(
-                f"Trip ID {trip_id} is not a string. Skipping trip.")
-            return (None, None)
-
-        link_ids: list[str] = [link_id.strip()
-                               for link_id in row['network_link_ids'].split(',') if link_id.strip() != '']
-
-        origin_lng = row["start_lng"]
-        origin_lat = row["start_lat"]
-        dest_lng = row["end_lng"]
-        dest_lat = row["end_lat"]
-        if not (isinstance(origin_lng, (float, int)) and isinstance(origin_lat, (float, int)) and isinstance(dest_lng, (float, int)) and isinstance(dest_lat, (float, int))):
-            logger.warning(
-                f"Trip {trip_id} has missing start or end coordinates or the coordinate values are invalud. Skipping trip.")
-            return (None, None)
-
-        # retrieve segments using the lookup dictionary
-        ordered_segments = [
-            network_segments_lookup.get(link_id) for link_id in link_ids
-        ]
-
-        # filter out None values in case a link_id is not found
-        found_segments = [
-            seg for seg in ordered_segments if seg is not None
-        ]
-
-        # create missing links
-        missing_links = None
-        if len(found_segments) != len(link_ids):
-            missing_links = set(link_ids) - set(
-                [
-                    link_id
-                    for link_id, seg in zip(link_ids, ordered_segments)
-                    if seg is not None
-                ]
-            )
-            for link_id in missing_links:
-                logger.debug(
-                    f"Link ID {link_id} from trip {trip_id} not found in network segments."
-                )
-
-        # convert missing_links to a csv to reduce memory usage
-        missing_links_str = None
-        if missing_links:
-            missing_links_str = ','.join(missing_links)
-        del missing_links  # free up memory
-
-        # insert the start and end points of the trip as the first and last segments
-        # as really short linestrings so that the geometry includes the trip start and end points
-        # in case the netwokr segments cannot be fully matched
-        epsilon = 1e-9  # 0.000000001
-        origin_line = LineString([
-            [origin_lng, origin_lat],
-            [origin_lng + epsilon, origin_lat + epsilon]
-        ])
-        dest_line = LineString([
-            [dest_lng + epsilon, dest_lat + epsilon],
-            [dest_lng, dest_lat]
-        ])
-        found_segments = [origin_line] + found_segments + [dest_line]
-
-        # convert the segments to well-known binary (WKB) byte representation of MultiLineString
-        found_segments_wkb = None
-        if found_segments:
-            # converting to bytes instead of keeping as a shapely MultiLineString is slower but way less memory intensive
-            found_segments_wkb = MultiLineString(found_segments).wkb
-
-        # increment the progress bar
-        bar.update(1)
-
-        # convert the ordered segments into a multilinestring indicating the line geometries as a single multilinestring
-        if found_segments:
-            return (found_segments_wkb, missing_links_str)
-
-        return (None, missing_links_str)
+        network_segments_lookup = NetworkSegmentStore.from_geometries(
+            network_segments_lookup['stableEdgeId'].to_numpy(), network_segments_lookup.geometry.to_numpy())
+    elif isinstance(network_segments_lookup, dict):
+        network_segments_lookup = NetworkSegmentStore.from_geometries(
+            list(network_segments_lookup.keys()), list(network_segments_lookup.values()))
+    store = network_segments_lookup
 
     logger.info(f'Finding matching segments for {len(trips_df)} trips...')
-
-    # Apply the function to each row and unpack the results into new columns
-    # expand: create a new DataFrame with the results for each row
-    apply_results = trips_df.apply(
-        get_matching_segments, axis=1, result_type='expand')
-    geometry_wkb: pandas.Series[bytes | None] = apply_results[0]  # type: ignore
-    missing_network_link_ids: pandas.Series[str | None] = apply_results[1]  # type: ignore
+    trip_count = len(trips_df)
+
+    # trips without a string id or without numeric start and end coordinates are skipped
+    is_valid = is_instance(trips_df['activity_id'], str)
+    invalid_id_count = int((~is_valid).sum())
+    if invalid_id_count:
+        logger.warning(f'Skipping {invalid_id_count} trips with IDs that are not strings.')
+    for column in ['start_lng', 'start_lat', 'end_lng', 'end_lat']:
+        is_valid &= is_instance(trips_df[column], (float, int))
+    invalid_coordinates_count = int((~is_valid).sum()) - invalid_id_count
+    if invalid_coordinates_count:
+        logger.warning(
+            f'Skipping {invalid_coordinates_count} trips with missing start or end coordinates or invalid coordinate values.')
+
+    # explode the network link ids of every trip into one array of ids and the trip (row) of each id
+    link_ids, link_trips = explode_id_lists(trips_df['network_link_ids'])
+    is_valid_link = is_valid[link_trips]
+    link_ids, link_trips = link_ids[is_valid_link], link_trips[is_valid_link]
+    link_positions = store.positions(link_ids)
+    is_found = link_positions >= 0
+
+    # record the ids that are missing for each trip (the same set difference
+    # as the ids of the trip minus its found ids, but only for trips with missing ids)
+    missing_network_link_ids = numpy.full(trip_count, None, dtype=object)
+    trips_with_missing = numpy.unique(link_trips[~is_found])
+    trip_starts = numpy.searchsorted(link_trips, trips_with_missing, side='left')
+    trip_ends = numpy.searchsorted(link_trips, trips_with_missing, side='right')
+    for trip, start, end in zip(trips_with_missing, trip_starts, trip_ends):
+        trip_link_ids = link_ids[start:end].tolist()
+        trip_is_found = is_found[start:end]
+        missing_links = set(trip_link_ids) - set(
+            link_id for link_id, found in zip(trip_link_ids, trip_is_found) if found)
+        for link_id in missing_links:
+            logger.debug(
+                f"Link ID {link_id} from trip {trips_df['activity_id'].iloc[trip]} not found in network segments.")
+        missing_network_link_ids[trip] = ','.join(map(str, missing_links))
+
+    # insert the start and end points of each trip as the first and last segments
+    # as really short linestrings so that the geometry includes the trip start and end points
+    # in case the netwokr segments cannot be fully matched
+    valid_trips = numpy.flatnonzero(is_valid)
+    epsilon = 1e-9  # 0.000000001
+    origin_lngs = trips_df['start_lng'].to_numpy()[valid_trips].astype(float)
+    origin_lats = trips_df['start_lat'].to_numpy()[valid_trips].astype(float)
+    dest_lngs = trips_df['end_lng'].to_numpy()[valid_trips].astype(float)
+    dest_lats = trips_df['end_lat'].to_numpy()[valid_trips].astype(float)
+    origin_lines = shapely.linestrings(numpy.stack([
+        numpy.column_stack([origin_lngs, origin_lats]),
+        numpy.column_stack([origin_lngs + epsilon, origin_lats + epsilon]),
+    ], axis=1))
+    dest_lines = shapely.linestrings(numpy.stack([
+        numpy.column_stack([dest_lngs + epsilon, dest_lats + epsilon]),
+        numpy.column_stack([dest_lngs, dest_lats]),
+    ], axis=1))
+    segment_lines = store.linestrings_at(link_positions[is_found])
+
+    # combine the lines of each trip (in order: start, found segments, end) into a multilinestring
+    # (the trips are numbered by their position among the valid trips so that every number has lines)
+    valid_trip_numbers = numpy.cumsum(is_valid) - 1
+    lines = numpy.concatenate([origin_lines, segment_lines, dest_lines])
+    line_trips = numpy.concatenate([
+        numpy.arange(len(valid_trips)), valid_trip_numbers[link_trips[is_found]], numpy.arange(len(valid_trips))])
+    line_order = numpy.concatenate([
+        numpy.full(len(valid_trips), -1), numpy.flatnonzero(is_found), numpy.full(len(valid_trips), len(link_ids))])
+    order = numpy.lexsort((line_order, line_trips))
+    geometry_array = numpy.full(trip_count, None, dtype=object)
+    if len(valid_trips):
+        geometry_array[valid_trips] = shapely.multilinestrings(lines[order], indices=line_trips[order])
+    del lines, origin_lines, dest_lines, segment_lines
+    bar.update(len(valid_trips))
 
     # assign the resultant multilinestring geometry
     # create a GeoDatFrame from the trips DataFrame and the network segments geometry
     logger.info('Creating GeoDataFrame with route segment geometries...')
-    geometry = geopandas.GeoSeries.from_wkb(geometry_wkb, crs=crs)
+    geometry = geopandas.GeoSeries(geometry_array, index=trips_df.index, crs=crs)
     gdf = geopandas.GeoDataFrame(trips_df, geometry=geometry)
 
     # keep track of the missing network link ids, which are returned as csv (when any are misisng) or None (when all are found)
     gdf['missing_network_link_ids'] = missing_network_link_ids
 
     # force memory cleanup
-    del apply_results
-    del geometry_wkb
+    del geometry_array
     del missing_network_link_ids
     gc.collect()
 
@@ -187,3 +196,35 @@ def trips_as_lines(trips_df: pandas.DataFrame, network_segments_lookup: dict[str
 
     # filter out null geometries before returning the new GeoDataFrame
     return gdf
+
+
+def is_instance(series: pandas.Series, types: type | tuple[type, ...]) -> numpy.ndarray:
+    """Check whether each value of a series is an instance of `types` (as `isinstance` would for each row)."""
+    if types is str and pandas.api.types.is_string_dtype(series.dtype) and series.dtype != object:
+        return series.notna().to_numpy()
+    if types == (float, int) and (pandas.api.types.is_float_dtype(series.dtype)
+                                  or pandas.api.types.is_integer_dtype(series.dtype)) \
+            and not pandas.api.types.is_extension_array_dtype(series.dtype):
+        return numpy.ones(len(series), dtype=bool)
+    return numpy.fromiter((isinstance(value, types) for value in series.to_numpy()), dtype=bool, count=len(series))
+
+
+def explode_id_lists(id_lists: pandas.Series) -> tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Explode a column of id lists (lists or arrays of integer, string, or
+    dictionary-encoded string ids, or comma-separated strings of ids from older
+    downloads) with Arrow list kernels.
+
+    Returns:
+        The ids in order and the position (row) in the series of each id.
+    """
+    lists = pyarrow.array(id_lists.to_numpy(), from_pandas=True)
+    if pyarrow.types.is_string(lists.type) or pyarrow.types.is_large_string(lists.type):
+        lists = encode_id_lists(pyarrow.table({'ids': lists}), {'ids': pyarrow.string()}).column('ids').combine_chunks()
+    if not (pyarrow.types.is_list(lists.type) or pyarrow.types.is_large_list(lists.type)):
+        # a column without any lists (e.g., every value is missing)
+        return numpy.array([], dtype=object), numpy.array([], dtype=numpy.int64)
+
+    # ids that are null within a list are not ids
+    ids, trips = flatten_id_lists(lists)
+    return ids.to_numpy(zero_copy_only=False), trips.to_numpy(zero_copy_only=False).astype(numpy.int64)
@@ -0,0 +1,599 @@
+from pathlib import Path
+from typing import Literal, Optional, TypedDict
+
+import geopandas
+import numpy
+import pandas
+import shapely
+from shapely.geometry import box
+from tqdm import tqdm
+
+from etl.checkpoints import CheckpointStore, partial_path, replace_with_partial
+
+type Quarter = Literal['Q2', 'Q4']
+type Season = tuple[int, Quarter]
+
+
+class SyntheticDataSizes(TypedDict):
+    network_segments: int
+    persons: int
+    households: int
+    trips: int
+    trip_chunks: int
+    points_of_interest: int
+    zoning_parcels: int
+
+
+class SyntheticDataGenerator:
+    """
+    Generates synthetic inputs for the replica, greenlink_gtfs, essential_services,
+    and future_routes ETLs so that the pipeline can be run (and benchmarked)
+    without credentials for BigQuery or the geocoder.
+
+    The inputs are written to the current working directory in the same layout
+    as real inputs: area polygons and future route scenarios in `./input`, and
+    the downloaded replica tables (recorded in the checkpoint store as complete),
+    an unconverted GTFS feed, and geocoded points of interest in `./data`.
+
+    The street network is a grid of segments over a fixed extent around
+    Greenville, SC. Homes, workplaces, schools, and trip ends are clustered
+    around a few centers so that the areas of interest contain very different
+    numbers of features, like real data.
+
+    The number of rows in every table that grows with the population (network
+    segments, persons, trips, points of interest, and zoning parcels) is
+    multiplied by the scale factor. The extent, areas of interest, transit
+    network, and the number of segments that each trip crosses do not change,
+    so the total size of the data grows linearly with the scale factor.
+    """
+
+    region = 'south_atlantic'
+
+    # the extent of the synthetic data (min lng, min lat, max lng, max lat)
+    bounds = (-82.60, 34.65, -82.20, 35.05)
+
+    # (lng, lat, standard deviation in degrees, weight) for each cluster of activity
+    centers = [
+        (-82.40, 34.85, 0.030, 0.35),  # downtown
+        (-82.30, 34.94, 0.040, 0.20),
+        (-82.52, 34.78, 0.040, 0.15),
+        (-82.27, 34.75, 0.050, 0.15),
+        (-82.40, 34.85, 0.150, 0.15),  # everywhere else
+    ]
+
+    # areas of interest (name, min lng, min lat, max lng, max lat)
+    areas = [
+        ('downtown', -82.44, 34.82, -82.36, 34.88),
+        ('north', -82.38, 34.88, -82.22, 35.02),
+        ('west', -82.58, 34.70, -82.44, 34.86),
+    ]
+
+    # the number of rows at a scale factor of 1
+    base_network_segments = 20_000
+    base_persons = 20_000
+    base_trips_per_person = 5
+    base_points_of_interest = 40  # per kind of point of interest
+    base_zoning_parcels = 2_000
+
+    # the maximum number of grid steps between the start and end of a trip in each direction
+    max_trip_offset = 12
+
+    # the share of trips that reference a network segment that is not in the network segments table
+    missing_link_rate = 0.005
+
+    # rows per trip chunk (matches the size of the chunks produced by the download)
+    trip_chunk_rows = 100_000
+
+    gtfs_routes = 12
+    gtfs_stops_per_route = 25
+
+    trip_modes = {
+        'PRIVATE_AUTO': 0.62,
+        'CARPOOL': 0.18,
+        'WALKING': 0.08,
+        'PUBLIC_TRANSIT': 0.03,
+        'BIKING': 0.02,
+        'ON_DEMAND_AUTO': 0.02,
+        'COMMERCIAL': 0.03,
+        'OTHER_TRAVEL_MODE': 0.02,
+    }
+
+    # minutes to cross a single network segment for each mode
+    minutes_per_segment = {
+        'PRIVATE_AUTO': 0.4,
+        'CARPOOL': 0.4,
+        'WALKING': 3.0,
+        'PUBLIC_TRANSIT': 1.2,
+        'BIKING': 1.0,
+        'ON_DEMAND_AUTO': 0.4,
+        'COMMERCIAL': 0.5,
+        'OTHER_TRAVEL_MODE': 0.8,
+    }
+
+    travel_purposes = ['HOME', 'WORK', 'SCHOOL', 'SHOP', 'EAT', 'SOCIAL', 'RECREATION', 'ERRANDS', 'OTHER']
+    tour_types = {'COMMUTE': 0.35, 'HOME_BASED': 0.45, 'WORK_BASED': 0.10, 'OTHER': 0.10}
+    building_uses = {
+        'RESIDENTIAL': ['SINGLE_FAMILY', 'MULTI_FAMILY', 'MOBILE_HOME'],
+        'COMMERCIAL': ['RETAIL', 'OFFICE', 'RESTAURANT', 'HOTEL'],
+        'INDUSTRIAL': ['MANUFACTURING', 'WAREHOUSE'],
+        'CIVIC_INSTITUTIONAL': ['EDUCATION', 'HEALTHCARE', 'GOVERNMENT', 'RELIGIOUS'],
+        'OPEN_SPACE': ['PARK', 'AGRICULTURE'],
+    }
+
+    races = {'white': 0.66, 'black_african_american': 0.18, 'asian': 0.03,
+             'other_race': 0.06, 'two_or_more_races': 0.07}
+    ethnicities = {'not_hispanic_or_latino': 0.90, 'hispanic_or_latino': 0.10}
+    educations = {'no_school': 0.03, 'k_12': 0.25, 'high_school': 0.27, 'some_college': 0.20,
+                  'bachelors_degree': 0.16, 'advanced_degree': 0.09}
+    commute_modes = {'driving': 0.55, 'carpool': 0.08, 'public_transit': 0.01, 'walking': 0.02,
+                     'biking': 0.01, 'work_from_home': 0.08, 'not_working': 0.25}
+
+    point_of_interest_kinds = ['childcare', 'dental', 'eye_care', 'family_medicine', 'free_clinics',
+                               'hospitals', 'internal_medicine', 'urgent_care', 'grocery_stores']
+    zoning_codes = {'R-1': 0.40, 'R-2': 0.15, 'R-3': 0.10, 'C-1': 0.08, 'C-2': 0.07, 'C-3': 0.05,
+                    'S-4': 0.03, 'NC': 0.04, 'I-1': 0.08}
+
+    # projected coordinate reference system for buffers (UTM zone 17N)
+    projected_crs = 'EPSG:32617'
+
+    def __init__(self, scale: float = 1, seasons: Optional[list[Season]] = None, seed: int = 0) -> None:
+        """
+        Args:
+            scale: The number of rows in each table relative to scale 1.
+            seasons: The seasons to generate data for. Defaults to 2024 Q2.
+            seed: The seed for the random number generator. The same seed and
+                scale always generate the same data.
+        """
+        if scale <= 0:
+            raise ValueError(f'The scale factor must be positive. Got: {scale}.')
+
+        self.scale = scale
+        self.seasons = seasons or [(2024, 'Q2')]
+        self.seed = seed
+
+        self.network_segment_count = max(4, round(self.base_network_segments * scale))
+        self.person_count = max(10, round(self.base_persons * scale))
+        self.trip_count = self.person_count * self.base_trips_per_person
+        self.point_of_interest_count = max(1, round(self.base_points_of_interest * scale))
+        self.zoning_parcel_count = max(10, round(self.base_zoning_parcels * scale))
+
+        # a square grid of nodes with 2 * n * (n - 1) segments between them
+        self.grid_size = int(numpy.ceil((1 + numpy.sqrt(1 + 2 * self.network_segment_count)) / 2))
+
+    def generate(self) -> SyntheticDataSizes:
+        """
+        Write the synthetic inputs to `./input` and `./data`.
+
+        Returns:
+            The number of rows that were generated for each kind of input.
+        """
+        self.write_area_polygons()
+        self.write_future_routes()
+
+        sizes: SyntheticDataSizes | None = None
+        for index, season in enumerate(self.seasons):
+            # each season is a slightly different sample of the same region
+            rng = numpy.random.default_rng([self.seed, index])
+            sizes = self.write_season(season, rng)
+
+        assert sizes is not None
+        return sizes
+
+    def write_season(self, season: Season, rng: numpy.random.Generator) -> SyntheticDataSizes:
+        year, quarter = season
+        season_name = f'{self.region}_{year}_{quarter}'
+        print(f'Generating synthetic data for {season_name} at scale {self.scale:g}...')
+
+        segments_gdf = self.write_network_segments(season)
+        persons_df = self.write_population(season, rng)
+        trip_chunks = self.write_trips(season, rng, segments_gdf, persons_df)
+        self.write_gtfs_feed(season, rng)
+        self.write_points_of_interest(season, rng)
+        self.write_zoning(season, rng)
+
+        return SyntheticDataSizes(
+            network_segments=len(segments_gdf),
+            persons=len(persons_df),
+            households=int(persons_df['household_id'].nunique()),
+            trips=self.trip_count,
+            trip_chunks=trip_chunks,
+            points_of_interest=self.point_of_interest_count * len(self.point_of_interest_kinds),
+            zoning_parcels=self.zoning_parcel_count,
+        )
+
+    def write_area_polygons(self) -> None:
+        folder = Path('./input/replica_interest_area_polygons')
+        folder.mkdir(parents=True, exist_ok=True)
+
+        full_area_gdf = geopandas.GeoDataFrame({'name': ['full_area']}, geometry=[box(*self.bounds)],
+                                               crs='EPSG:4326')
+        full_area_gdf.to_file(folder / 'full_area.geojson', driver='GeoJSON')
+
+        for name, *bounds in self.areas:
+            area_gdf = geopandas.GeoDataFrame({'name': [name]}, geometry=[box(*bounds)], crs='EPSG:4326')
+            area_gdf.to_file(folder / f'{name}.geojson', driver='GeoJSON')
+
+    def write_future_routes(self) -> None:
+        """Write a future route scenario that crosses downtown from west to east."""
+        folder = Path('./input/future_routes/synthetic_crosstown')
+        folder.mkdir(parents=True, exist_ok=True)
+
+        route = shapely.LineString([(-82.55, 34.80), (-82.45, 34.84), (-82.40, 34.85),
+                                    (-82.33, 34.87), (-82.25, 34.90)])
+        stops = [route.interpolate(distance, normalized=True) for distance in numpy.linspace(0, 1, 30)]
+
+        route_gdf = geopandas.GeoDataFrame({'name': ['Crosstown']}, geometry=[route], crs='EPSG:4326')
+        stops_gdf = geopandas.GeoDataFrame({'name': [f'Stop {index + 1}' for index in range(len(stops))]},
+                                           geometry=stops, crs='EPSG:4326')
+        stops_projected = stops_gdf.to_crs(self.projected_crs)
+        route_projected = route_gdf.to_crs(self.projected_crs)
+
+        buffers = {
+            'walkshed': stops_projected.buffer(800).union_all(),
+            'bikeshed': stops_projected.buffer(3_500).union_all(),
+            'paratransit': route_projected.buffer(1_200).union_all(),
+        }
+        for name, geometry in buffers.items():
+            geopandas.GeoDataFrame(geometry=[geometry], crs=self.projected_crs)\
+                .to_crs('EPSG:4326')\
+                .to_file(folder / f'{name}.geojson', driver='GeoJSON')
+        route_gdf.to_file(folder / 'route.geojson', driver='GeoJSON')
+        stops_gdf.to_file(folder / 'stops.geojson', driver='GeoJSON')
+
+    def _node_coordinates(self) -> tuple[numpy.ndarray, numpy.ndarray]:
+        min_lng, min_lat, max_lng, max_lat = self.bounds
+        return (numpy.linspace(min_lng, max_lng, self.grid_size),
+                numpy.linspace(min_lat, max_lat, self.grid_size))
+
+    def _edge_ids(self, edge_indices: numpy.ndarray) -> numpy.ndarray:
+        # stable edge ids are large numbers stored as strings
+        return (edge_indices.astype(numpy.int64) + 10 ** 17).astype(str)
+
+    def write_network_segments(self, season: Season) -> geopandas.GeoDataFrame:
+        """
+        Write the network segments table. Horizontal segments are numbered
+        first (row by row), followed by vertical segments (column by column).
+        """
+        n = self.grid_size
+        lngs, lats = self._node_coordinates()
+
+        # horizontal segments: (i, j) -> (i + 1, j)
+        i, j = numpy.meshgrid(numpy.arange(n - 1), numpy.arange(n), indexing='xy')
+        horizontal_starts = numpy.column_stack([lngs[i.ravel()], lats[j.ravel()]])
+        horizontal_ends = numpy.column_stack([lngs[i.ravel() + 1], lats[j.ravel()]])
+        horizontal_names = numpy.char.add(numpy.char.add(j.ravel().astype(str), ' '), 'Street')
+
+        # vertical segments: (i, j) -> (i, j + 1)
+        j, i = numpy.meshgrid(numpy.arange(n - 1), numpy.arange(n), indexing='xy')
+        vertical_starts = numpy.column_stack([lngs[i.ravel()], lats[j.ravel()]])
+        vertical_ends = numpy.column_stack([lngs[i.ravel()], lats[j.ravel() + 1]])
+        vertical_names = numpy.char.add(numpy.char.add(i.ravel().astype(str), ' '), 'Avenue')
+
+        starts = numpy.concatenate([horizontal_starts, vertical_starts])
+        ends = numpy.concatenate([horizontal_ends, vertical_ends])
+        geometry = shapely.linestrings(numpy.stack([starts, ends], axis=1))
+
+        edge_count = len(geometry)
+        segments_gdf = geopandas.GeoDataFrame({
+            'stableEdgeId': self._edge_ids(numpy.arange(edge_count)),
+            'streetName': numpy.concatenate([horizontal_names, vertical_names]),
+            'osmid': numpy.arange(edge_count, dtype=numpy.int64) + 100_000_000,
+        }, geometry=geometry, crs='EPSG:4326')
+
+        year, quarter = season
+        output_path = Path(f'./data/replica/full_area/network_segments/{self.region}_{year}_{quarter}.parquet')
+        self._save_geoparquet(segments_gdf, output_path)
+        CheckpointStore().commit('download/network_segments', season=f'{self.region}_{year}_{quarter}',
+                                 area='full_area', outputs=[output_path])
+        return segments_gdf
+
+    def _clustered_points(self, rng: numpy.random.Generator, count: int) -> tuple[numpy.ndarray, numpy.ndarray]:
+        weights = numpy.array([center[3] for center in self.centers])
+        cluster = rng.choice(len(self.centers), size=count, p=weights / weights.sum())
+        centers = numpy.array([center[:3] for center in self.centers])[cluster]
+
+        min_lng, min_lat, max_lng, max_lat = self.bounds
+        lngs = numpy.clip(rng.normal(centers[:, 0], centers[:, 2]), min_lng, max_lng)
+        lats = numpy.clip(rng.normal(centers[:, 1], centers[:, 2]), min_lat, max_lat)
+        return lngs, lats
+
+    @staticmethod
+    def _choice(rng: numpy.random.Generator, weights: dict[str, float], count: int) -> numpy.ndarray:
+        values = list(weights.keys())
+        probabilities = numpy.array(list(weights.values()))
+        return numpy.array(values, dtype=object)[
+            rng.choice(len(values), size=count, p=probabilities / probabilities.sum())]
+
+    def write_population(self, season: Season, rng: numpy.random.Generator) -> pandas.DataFrame:
+        """
+        Write the population tables. Like the download, each table contains every
+        person, with the geometry at their home, school, or work location.
+        """
+        count = self.person_count
+        household_count = max(1, round(count / 2.5))
+        household_ids = rng.integers(0, household_count, size=count)
+        home_lngs, home_lats = self._clustered_points(rng, household_count)
+        work_lngs, work_lats = self._clustered_points(rng, count)
+        school_lngs, school_lats = self._clustered_points(rng, count)
+
+        commute_modes = self._choice(rng, self.commute_modes, count)
+        is_working = ~numpy.isin(commute_modes, ['not_working'])
+        is_student = rng.random(count) < 0.2
+
+        persons_df = pandas.DataFrame({
+            'person_id': (numpy.arange(count, dtype=numpy.int64) + 10 ** 15).astype(str),
+            'household_id': (household_ids + 10 ** 14).astype(str),
+            'race': self._choice(rng, self.races, count),
+            'ethnicity': self._choice(rng, self.ethnicities, count),
+            'education': self._choice(rng, self.educations, count),
+            'commute_mode': commute_modes,
+            'lng': home_lngs[household_ids],
+            'lat': home_lats[household_ids],
+            'lng_work': numpy.where(is_working, work_lngs, numpy.nan),
+            'lat_work': numpy.where(is_working, work_lats, numpy.nan),
+            'lng_school': numpy.where(is_student, school_lngs, numpy.nan),
+            'lat_school': numpy.where(is_student, school_lats, numpy.nan),
+        })
+
+        # the home locations are the geometry (the work and school locations stay as coordinates)
+        year, quarter = season
+        population_gdf = geopandas.GeoDataFrame(
+            persons_df,
+            geometry=geopandas.points_from_xy(persons_df['lng'], persons_df['lat']),
+            crs='EPSG:4326'
+        )
+        output_path = Path(f'./data/replica/full_area/population/{self.region}_{year}_{quarter}.parquet')
+        self._save_geoparquet(population_gdf, output_path)
+
+        CheckpointStore().commit('download/population', season=f'{self.region}_{year}_{quarter}',
+                                 area='full_area', outputs=[output_path])
+        return persons_df
+
+    def write_trips(self, season: Season, rng: numpy.random.Generator, segments_gdf: geopandas.GeoDataFrame,
+                    persons_df: pandas.DataFrame) -> int:
+        """
+        Write the thursday trips as chunks of trip lines (the output of
+        `trips_as_lines`). Each trip follows the grid from the node nearest to
+        the home of the person who takes it to a nearby node.
+
+        Returns:
+            The number of chunks.
+        """
+        year, quarter = season
+        table_name = f'{self.region}_{year}_{quarter}_thursday_trip'
+        output_folder = Path(f'./data/replica/full_area/thursday_trip/_chunks/{table_name}')
+        output_folder.mkdir(parents=True, exist_ok=True)
+
+        segment_geometry = segments_gdf.geometry.to_numpy()
+        person_lngs = persons_df['lng'].to_numpy()
+        person_lats = persons_df['lat'].to_numpy()
+
+        chunk_count = int(numpy.ceil(self.trip_count / self.trip_chunk_rows))
+        for chunk_index in tqdm(range(chunk_count), desc=f'Generating trips for {table_name}', unit='chunk'):
+            first_trip = chunk_index * self.trip_chunk_rows
+            trip_count = min(self.trip_chunk_rows, self.trip_count - first_trip)
+            person_indices = rng.integers(0, len(persons_df), size=trip_count)
+
+            trips_gdf = self._trip_lines(
+                rng, first_trip, segment_geometry,
+                persons_df['person_id'].to_numpy()[person_indices],
+                persons_df['household_id'].to_numpy()[person_indices],
+                person_lngs[person_indices], person_lats[person_indices],
+            )
+            trips_gdf['source_table'] = table_name
+
+            output_path = output_folder / f'chunk_{chunk_index + 1}.parquet'
+            self._save_geoparquet(trips_gdf, output_path)
+
+        CheckpointStore().commit('download/thursday_trip', season=f'{self.region}_{year}_{quarter}',
+                                 area='full_area', outputs=[output_folder])
+        return chunk_count
+
+    def _trip_lines(self, rng: numpy.random.Generator, first_trip: int, segment_geometry: numpy.ndarray,
+                    person_ids: numpy.ndarray, household_ids: numpy.ndarray,
+                    home_lngs: numpy.ndarray, home_lats: numpy.ndarray) -> geopandas.GeoDataFrame:
+        count = len(person_ids)
+        n = self.grid_size
+        horizontal_count = (n - 1) * n
+        min_lng, min_lat, max_lng, max_lat = self.bounds
+        lngs, lats = self._node_coordinates()
+
+        # start at the node nearest to home and walk to a nearby node
+        start_i = numpy.rint((home_lngs - min_lng) / (max_lng - min_lng) * (n - 1)).astype(numpy.int64)
+        start_j = numpy.rint((home_lats - min_lat) / (max_lat - min_lat) * (n - 1)).astype(numpy.int64)
+        end_i = numpy.clip(start_i + rng.integers(-self.max_trip_offset, self.max_trip_offset + 1, count), 0, n - 1)
+        end_j = numpy.clip(start_j + rng.integers(-self.max_trip_offset, self.max_trip_offset + 1, count), 0, n - 1)
+        lengths = numpy.abs(end_i - start_i) + numpy.abs(end_j - start_j)
+
+        # walk one segment at a time, randomly choosing between the remaining directions
+        edges = numpy.full((count, max(1, int(lengths.max()))), -1, dtype=numpy.int64)
+        i, j = start_i.copy(), start_j.copy()
+        for step in range(edges.shape[1]):
+            remaining_i, remaining_j = end_i - i, end_j - j
+            active = step < lengths
+            total_remaining = numpy.maximum(1, numpy.abs(remaining_i) + numpy.abs(remaining_j))
+            move_i = (remaining_i != 0) & (
+                (remaining_j == 0) | (rng.random(count) < numpy.abs(remaining_i) / total_remaining))
+            direction_i = numpy.sign(remaining_i)
+            direction_j = numpy.sign(remaining_j)
+
+            horizontal_edge = j * (n - 1) + numpy.minimum(i, i + direction_i)
+            vertical_edge = horizontal_count + i * (n - 1) + numpy.minimum(j, j + direction_j)
+            edges[:, step] = numpy.where(active, numpy.where(move_i, horizontal_edge, vertical_edge), -1)
+
+            i = numpy.where(active & move_i, i + direction_i, i)
+            j = numpy.where(active & ~move_i, j + direction_j, j)
+
+        # network link ids as lists of integers (the stable edge ids as numbers)
+        edge_ids = self._edge_ids(numpy.maximum(edges, 0)).astype(numpy.int64)
+        network_link_ids = [row[:length] for row, length in zip(edge_ids, lengths)]
+
+        # a few trips reference segments that are not in the network segments table
+        missing_link_ids: list[Optional[str]] = [None] * count
+        for index in numpy.flatnonzero(rng.random(count) < self.missing_link_rate):
+            missing_link_id = 10 ** 18 + first_trip + int(index)
+            network_link_ids[index] = numpy.append(network_link_ids[index], missing_link_id)
+            missing_link_ids[index] = str(missing_link_id)
+
+        # jitter the start and end coordinates around their nodes
+        jitter = (lngs[1] - lngs[0]) * 0.2
+        start_lngs = lngs[start_i] + rng.uniform(-jitter, jitter, count)
+        start_lats = lats[start_j] + rng.uniform(-jitter, jitter, count)
+        end_lngs = lngs[end_i] + rng.uniform(-jitter, jitter, count)
+        end_lats = lats[end_j] + rng.uniform(-jitter, jitter, count)
+
+        # trip lines are a multilinestring of a tiny line at the start, the segments, and a tiny line at the end
+        epsilon = 1e-9
+        origin_lines = shapely.linestrings(numpy.stack([
+            numpy.column_stack([start_lngs, start_lats]),
+            numpy.column_stack([start_lngs + epsilon, start_lats + epsilon]),
+        ], axis=1))
+        destination_lines = shapely.linestrings(numpy.stack([
+            numpy.column_stack([end_lngs + epsilon, end_lats + epsilon]),
+            numpy.column_stack([end_lngs, end_lats]),
+        ], axis=1))
+        trip_rows, trip_steps = numpy.nonzero(edges >= 0)
+        parts = numpy.concatenate([origin_lines, segment_geometry[edges[trip_rows, trip_steps]], destination_lines])
+        part_trips = numpy.concatenate([numpy.arange(count), trip_rows, numpy.arange(count)])
+        part_order = numpy.concatenate([numpy.full(count, -1), trip_steps, numpy.full(count, edges.shape[1])])
+        order = numpy.lexsort((part_order, part_trips))
+        geometry = shapely.multilinestrings(parts[order], indices=part_trips[order])
+
+        modes = self._choice(rng, self.trip_modes, count)
+        minutes_per_segment = pandas.Series(modes).map(self.minutes_per_segment).to_numpy(dtype=float)
+        duration_minutes = numpy.maximum(1, numpy.rint(
+            (lengths + 1) * minutes_per_segment * rng.lognormal(0, 0.25, count))).astype(numpy.int64)
+        start_hours = numpy.clip(numpy.rint(rng.normal(13, 4, count)), 0, 23).astype(numpy.int64)
+
+        building_use_l1 = self._choice(rng, {use: 1.0 for use in self.building_uses}, count)
+        building_use_l2 = numpy.array([
+            subtypes[index % len(subtypes)]
+            for subtypes, index in zip(
+                (self.building_uses[use] for use in building_use_l1), rng.integers(0, 12, count))
+        ], dtype=object)
+
+        is_transit = modes == 'PUBLIC_TRANSIT'
+        transit_routes = rng.integers(1, self.gtfs_routes + 1, count)
+        is_auto = numpy.isin(modes, ['PRIVATE_AUTO', 'CARPOOL', 'ON_DEMAND_AUTO', 'COMMERCIAL'])
+
+        # only car trips have a vehicle type
+        vehicle_types = numpy.full(count, None, dtype=object)
+        vehicle_types[is_auto] = 'CAR'
+
+        trips_df = pandas.DataFrame({
+            'household_id': household_ids,
+            'activity_id': (numpy.arange(first_trip, first_trip + count, dtype=numpy.int64) + 10 ** 16).astype(str),
+            'person_id': person_ids,
+            'mode': modes,
+            'travel_purpose': self._choice(rng, {purpose: 1.0 for purpose in self.travel_purposes}, count),
+            'tour_type': self._choice(rng, self.tour_types, count),
+            'transit_route_ids': [[f'route_{route}'] if transit else None
+                                  for route, transit in zip(transit_routes, is_transit)],
+            'network_link_ids': network_link_ids,
+            'vehicle_type': vehicle_types,
+            'start_local_hour': start_hours,
+            'end_local_hour': (start_hours + (duration_minutes // 60)) % 24,
+            'duration_minutes': duration_minutes,
+            'destination_building_use_l1': building_use_l1,
+            'destination_building_use_l2': building_use_l2,
+            'start_lng': start_lngs,
+            'start_lat': start_lats,
+            'end_lng': end_lngs,
+            'end_lat': end_lats,
+        })
+        trips_gdf = geopandas.GeoDataFrame(trips_df, geometry=geometry, crs='EPSG:4326')
+        trips_gdf['missing_network_link_ids'] = missing_link_ids
+        return trips_gdf
+
+    def write_gtfs_feed(self, season: Season, rng: numpy.random.Generator) -> None:
+        """
+        Write a GTFS feed of routes that radiate from downtown to the season's
+        folder in the same state as a feed that has just been downloaded and
+        unzipped (see `GreenlinkGtfsETL.download`).
+        """
+        year, quarter = season
+        folder = Path(f'./data/greenlink_gtfs/{year}/{quarter}')
+        folder.mkdir(parents=True, exist_ok=True)
+
+        min_lng, min_lat, max_lng, max_lat = self.bounds
+        center_lng, center_lat = self.centers[0][:2]
+        routes, trips, shapes, stops, stop_times = [], [], [], [], []
+        for route_index in range(self.gtfs_routes):
+            route_id = f'route_{route_index + 1}'
+            angle = 2 * numpy.pi * route_index / self.gtfs_routes + rng.uniform(-0.2, 0.2)
+            reach = rng.uniform(0.08, 0.16)
+
+            # a wiggly line from downtown outward
+            distances = numpy.linspace(0, reach, 40)
+            wiggle = numpy.cumsum(rng.normal(0, 0.002, len(distances)))
+            shape_lngs = numpy.clip(center_lng + distances * numpy.cos(angle) - wiggle * numpy.sin(angle),
+                                    min_lng, max_lng)
+            shape_lats = numpy.clip(center_lat + distances * numpy.sin(angle) + wiggle * numpy.cos(angle),
+                                    min_lat, max_lat)
+
+            routes.append({
+                'route_id': route_id, 'agency_id': 'synthetic', 'route_short_name': str(route_index + 1),
+                'route_long_name': f'Route {route_index + 1}', 'route_desc': '', 'route_type': 3,
+                'route_color': f'{rng.integers(0, 0xFFFFFF):06X}', 'route_text_color': 'FFFFFF',
+            })
+            trips.append({'route_id': route_id, 'service_id': 'weekday',
+                          'trip_id': f'trip_{route_index + 1}', 'shape_id': f'shape_{route_index + 1}'})
+            for sequence, (lng, lat) in enumerate(zip(shape_lngs, shape_lats)):
+                shapes.append({'shape_id': f'shape_{route_index + 1}', 'shape_pt_lat': lat,
+                               'shape_pt_lon': lng, 'shape_pt_sequence': sequence + 1})
+
+            stop_positions = numpy.linspace(0, len(shape_lngs) - 1, self.gtfs_stops_per_route).astype(int)
+            for sequence, position in enumerate(stop_positions):
+                stop_number = route_index * self.gtfs_stops_per_route + sequence + 1
+                stops.append({'stop_id': f'stop_{stop_number}', 'stop_code': stop_number,
+                              'stop_name': f'Stop {stop_number}', 'stop_lat': shape_lats[position],
+                              'stop_lon': shape_lngs[position]})
+                departure = f'{6 + sequence // 30:02d}:{(sequence * 2) % 60:02d}:00'
+                stop_times.append({'trip_id': f'trip_{route_index + 1}', 'arrival_time': departure,
+                                   'departure_time': departure, 'stop_id': f'stop_{stop_number}',
+                                   'stop_sequence': sequence + 1})
+
+        for name, rows in [('routes', routes), ('trips', trips), ('shapes', shapes),
+                           ('stops', stops), ('stop_times', stop_times)]:
+            pandas.DataFrame(rows).to_csv(folder / f'{name}.txt', index=False)
+
+    def write_points_of_interest(self, season: Season, rng: numpy.random.Generator) -> None:
+        """
+        Write geocoded points of interest (the output of the geocoder) for
+        each kind of point of interest used by the essential services ETL.
+        """
+        year, quarter = season
+        date = f'{year}-{'04' if quarter == 'Q2' else '10'}-01'
+        folder = Path('./data/geocoded')
+        folder.mkdir(parents=True, exist_ok=True)
+
+        for kind in self.point_of_interest_kinds:
+            lngs, lats = self._clustered_points(rng, self.point_of_interest_count)
+            poi_gdf = geopandas.GeoDataFrame({
+                'Name': [f'{kind.replace('_', ' ').title()} {index + 1}' for index in range(len(lngs))],
+                'Address': [f'{rng.integers(1, 9999)} Main Street' for _ in range(len(lngs))],
+                'ZIP': rng.choice(['29601', '29605', '29607', '29609', '29611', '29615'], len(lngs)),
+            }, geometry=geopandas.points_from_xy(lngs, lats), crs='EPSG:4326')
+            poi_gdf.to_file(folder / f'geocoded_{kind}__{date}.geojson', driver='GeoJSON')
+
+    def write_zoning(self, season: Season, rng: numpy.random.Generator) -> None:
+        """Write zoning parcels as a shapefile in `./input/zoning/<date>`."""
+        year, quarter = season
+        folder = Path(f'./input/zoning/{year}-{'04' if quarter == 'Q2' else '10'}-01')
+        folder.mkdir(parents=True, exist_ok=True)
+
+        lngs, lats = self._clustered_points(rng, self.zoning_parcel_count)
+        half_size = rng.uniform(0.0005, 0.002, self.zoning_parcel_count)
+        zoning_gdf = geopandas.GeoDataFrame({
+            'ZONING': self._choice(rng, self.zoning_codes, self.zoning_parcel_count),
+        }, geometry=shapely.box(lngs - half_size, lats - half_size, lngs + half_size, lats + half_size),
+            crs='EPSG:4326')
+        zoning_gdf.to_file(folder / 'zoning.shp', driver='ESRI Shapefile')
+
+    @staticmethod
+    def _save_geoparquet(gdf: geopandas.GeoDataFrame, output_path: Path) -> None:
+        # written the same way as the downloaded replica tables
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        gdf.to_parquet(partial_path(output_path), write_covering_bbox=True, geometry_encoding='WKB',
+                       schema_version='1.1.0', compression='snappy')
+        replace_with_partial(output_path)
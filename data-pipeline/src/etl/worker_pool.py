@@ -0,0 +1,160 @@
+import logging
+import multiprocessing
+import os
+import sys
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+
+from etl.heartbeat import connect, current_channel
+from etl.memory_budget import BudgetState, attach, continue_reservations, current_budget, held_memory
+from etl.run_report import continue_stages, open_stage_names
+
+# modules that the fork server imports once so that every worker starts with them already imported
+preload_modules = [
+    'numpy',
+    'pandas',
+    'pyarrow.parquet',
+    'pyproj',
+    'shapely',
+    'pyogrio',
+    'geopandas',
+    'dask.dataframe',
+    'dask_geopandas',
+]
+
+
+def _get_context() -> multiprocessing.context.BaseContext:
+    # workers are started from a small fork server process instead of being forked from the
+    # (often very large) process that submits the tasks, which avoids copying its memory
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        # only applies if the fork server has not been started yet
+        context.set_forkserver_preload(preload_modules)
+        return context
+    return multiprocessing.get_context('spawn')
+
+
+def _initialize_worker(channel: Any, budget: Optional[BudgetState], log_level: int,
+                       log_formatter: Optional[logging.Formatter],
+                       initializer: Optional[Callable[..., object]], initargs: tuple[Any, ...]) -> None:
+    # workers do not inherit the redirected output, logging configuration, heartbeat
+    # channel, or memory budget of the process that started them, so set them up the same way
+    log_path = os.getenv('PIPELINE_LOG_PATH')
+    if log_path:
+        from TeeLogger import TeeLogger
+        sys.stdout = TeeLogger(log_path, write_header=False)
+        sys.stderr = sys.stdout
+
+    handler = logging.StreamHandler(sys.stderr)
+    if log_formatter is not None:
+        handler.setFormatter(log_formatter)
+    logging.basicConfig(level=log_level, handlers=[handler], force=True)
+
+    if channel is not None:
+        connect(channel)
+
+    if budget is not None:
+        attach(budget)
+
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def _run_task(stage_names: list[str], held: int, func: Callable[..., Any], args: tuple[Any, ...],
+              kwargs: dict[str, Any]) -> Any:
+    with continue_stages(stage_names), continue_reservations(held):
+        return func(*args, **kwargs)
+
+
+class WorkerPool:
+    """
+    A pool of worker processes for memory-intensive tasks.
+
+    Workers are started from a fork server that has already imported the
+    heavy geospatial modules (see `preload_modules`), so they start quickly
+    and do not copy the memory of the process that submits the tasks.
+
+    Each worker is replaced after it runs `max_tasks_per_worker` tasks so
+    that memory that is never released (e.g., by pandas_gbq) is returned to
+    the operating system.
+
+    Tasks behave like they ran in the process that submitted them: stages
+    that they open are recorded as sub-stages of the stage that was open when
+    they were submitted, they send heartbeats to the stall watchdog, they
+    reserve memory against the pipeline's memory budget (within the
+    reservations that were open when they were submitted), and their
+    output is written to the pipeline log.
+
+    Tasks and their arguments are pickled, so tasks must be module-level
+    functions or methods of picklable objects.
+
+    Example:
+        ```
+        with WorkerPool(max_tasks_per_worker=1) as pool:
+            count, stats = pool.run(self.process_population)
+        ```
+    """
+
+    def __init__(self, max_workers: int = 1, max_tasks_per_worker: Optional[int] = None,
+                 initializer: Optional[Callable[..., object]] = None,
+                 initargs: tuple[Any, ...] = ()) -> None:
+        """
+        Args:
+            max_workers: The maximum number of tasks that run at the same time.
+            max_tasks_per_worker: The number of tasks a worker runs before it is
+                replaced. If None, workers are never replaced.
+            initializer: A picklable function that each worker calls when it starts.
+            initargs: The arguments for the initializer.
+        """
+        self.max_workers = max_workers
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.initializer = initializer
+        self.initargs = initargs
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            root_logger = logging.getLogger()
+            log_formatter = root_logger.handlers[0].formatter if root_logger.handlers else None
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=_get_context(),
+                initializer=_initialize_worker,
+                initargs=(current_channel(), current_budget(), root_logger.level, log_formatter,
+                          self.initializer, self.initargs),
+                max_tasks_per_child=self.max_tasks_per_worker,
+            )
+        return self._executor
+
+    def submit(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Future[Any]:
+        """Run a task in a worker. Returns a future for the result of the task."""
+        return self._get_executor().submit(_run_task, open_stage_names(), held_memory(), func, args, kwargs)
+
+    def run(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """
+        Run a task in a worker and wait for its result.
+
+        Raises:
+            Exception: The exception raised by the task.
+            BrokenProcessPool: If the worker died (e.g., it was killed because the
+                machine ran out of memory). The pool starts new workers for the
+                next task.
+        """
+        try:
+            return self.submit(func, *args, **kwargs).result()
+        except BrokenProcessPool:
+            self.shutdown()
+            raise
+
+    def shutdown(self) -> None:
+        """Stop the workers after the submitted tasks finish."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def __enter__(self) -> 'WorkerPool':
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.shutdown()
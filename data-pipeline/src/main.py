@@ -2,13 +2,11 @@ import argparse
 import logging
 import os
 import sys
-import time
 from typing import Optional
 
-import pandas_gbq
-import pydata_google_auth
 from dotenv import load_dotenv
 
+from etl.planner import plan_pipeline
 from etl.runner import etl_runner
 from TeeLogger import TeeLogger
 
@@ -32,12 +30,34 @@ if __name__ == "__main__":
     )
     parser.add_argument(
         '--etls', type=str, help='Comma-separated list of ETL sources to run. If not provided, all sources will be run.')
+    parser.add_argument(
+        '--workers', type=int, default=None,
+        help='Maximum number of ETL sources to run at the same time. If not provided, every ETL source whose dependencies have finished will start immediately.')
+    parser.add_argument(
+        '--max-memory', type=str, default=os.getenv('MAX_MEMORY'),
+        help='Memory budget for the pipeline (e.g., 48G). ETL sources and their heavy stages wait for memory instead of running out of it. If not provided, memory is not limited.')
+    parser.add_argument(
+        '--force', action='store_true',
+        help='Run every step even if its inputs, code, and parameters have not changed since it last finished.')
+    parser.add_argument(
+        '--plan', action='store_true',
+        help='Print the work that would be done (with its size and estimated time from the previous run) without doing it.')
     args = parser.parse_args()
 
+    # the build manifest reads this when it is created (including in child processes)
+    if args.force:
+        os.environ['FORCE_REBUILD'] = '1'
+
     # if not running in docker, load the .env file
     if not docker:
         load_dotenv()
 
+    # print the planned work and exit (nothing is downloaded, so credentials are not needed)
+    if args.plan:
+        logging.basicConfig(level=logging.WARNING, format='%(name)-24s | %(levelname)-5s | %(message)s')
+        plan_pipeline([string.strip() for string in args.etls.split(',')] if args.etls else None)
+        exit(0)
+
     # if not running in docker, prompt whether to run the data pipeline
     if not docker:
         run_pipeline = input("Do you want to run the data pipeline? (Y/n): ")
@@ -55,8 +75,15 @@ if __name__ == "__main__":
     if not os.path.exists(log_folder_path):
         os.makedirs(log_folder_path)
     current_log_file_count = len([name for name in os.listdir(
-        log_folder_path) if os.path.isfile(os.path.join(log_folder_path, name))])
+        log_folder_path) if os.path.isfile(os.path.join(log_folder_path, name)) and name.startswith('pipeline-')])
     log_file_path = os.path.join(log_folder_path, f'pipeline-{current_log_file_count}.log')
+
+    # the run report (stage timings and resource usage) uses the same number as the log file
+    os.environ['RUN_REPORT_PATH'] = os.path.join(
+        log_folder_path, f'run-report-{current_log_file_count}.json')
+    # worker pool processes (see etl/worker_pool.py) do not inherit the redirected
+    # output, so they read the log file path from here
+    os.environ['PIPELINE_LOG_PATH'] = log_file_path
     sys.stdout = TeeLogger(log_file_path)
     sys.stderr = sys.stdout  # redirect stderr to the same logger
 
@@ -74,9 +101,16 @@ if __name__ == "__main__":
     if args.etls:
         etls = [string.strip() for string in args.etls.split(',')]
 
+    # warnings are shown again after the pipeline finishes so that they are not lost in the output
+    warnings: list[str] = []
+
     if (etls is None or 'replica' in etls):
         print("Checking replica credentials...")
         try:
+            # only import the BigQuery libraries when replica data may be downloaded
+            import pandas_gbq
+            import pydata_google_auth
+
             credentials = pydata_google_auth.load_user_credentials(
                 './credentials/bigquery_credentials.json')
             pandas_gbq.context.credentials = credentials
@@ -92,31 +126,33 @@ if __name__ == "__main__":
                 )
             )
 
-            print('\n\n' + "-" * 78)
-            print("Warning: Google BigQuery credentials are not set (or are expired).")
+            warning = "Warning: Google BigQuery credentials are not set (or are expired).\n"
             if replica_full_data_is_available:
-                print('         Full area data will not be downloaded.')
-                print('         Available season datasets will be inferred from local files.')
+                warning += '         Full area data will not be downloaded.\n'
+                warning += '         Available season datasets will be inferred from local files.'
             else:
-                print(
-                    '         Please run the authentication script to retrieve credentials.')
-            print("-" * 78 + '\n\n')
-            time.sleep(4) if replica_full_data_is_available else exit(1)
+                warning += '         Please run the authentication script to retrieve credentials.'
+            print('\n\n' + "-" * 78 + '\n' + warning + '\n' + "-" * 78 + '\n\n')
+            if not replica_full_data_is_available:
+                exit(1)
+            warnings.append(warning)
 
     if (etls is None or 'greenlink_gtfs' in etls):
         # unless running on GitHub Actions, print a warning if the API key is not set
         transitland_api_key = os.getenv('TRANSITLAND_API_KEY', None)
         if transitland_api_key is None:
-            print('\n\n' + "-" * 78)
-            print(
-                "Warning: TRANSITLAND_API_KEY is not set. Current GTFS data will be substituted\n         for historical GTFS data.")
-            print("\n         To get the historical GTFS data, set the TRANSITLAND_API_KEY\n         environment variable.")
-            print("-" * 78 + '\n\n')
+            warning = ("Warning: TRANSITLAND_API_KEY is not set. Current GTFS data will be substituted\n         for historical GTFS data.\n"
+                       "\n         To get the historical GTFS data, set the TRANSITLAND_API_KEY\n         environment variable.")
+            print('\n\n' + "-" * 78 + '\n' + warning + '\n' + "-" * 78 + '\n\n')
 
-            # wait for 10 seconds before continuing
+            # the warning is expected in GitHub Actions, so do not repeat it there
             if not is_running_in_workflow:
-                time.sleep(10)
+                warnings.append(warning)
 
     # run the ETL pipeline
-    etl_runner(etls)
+    try:
+        etl_runner(etls, args.workers, args.max_memory)
+    finally:
+        for warning in warnings:
+            print('\n' + "-" * 78 + '\n' + warning + '\n' + "-" * 78)
     print('\nDONE')